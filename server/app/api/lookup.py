@@ -1,18 +1,46 @@
-from flask import current_app, jsonify, make_response, request, render_template, send_from_directory, Response
+from flask import current_app, jsonify, make_response, request, render_template, send_from_directory, Response,\
+	stream_with_context
+import functools
+import json
 import time
+from typing import Callable, Iterator
 from . import api
-from .. import db_manager
+from .. import db_manager, metrics
 from ..dictionaries import simplify
 
 
+def _timed(operation_name: str) -> Callable[[Callable[..., Response]], Callable[..., Response]]:
+	"""
+	Times the view as an operation, whose stages are given in the Server-Timing header.
+	Streamed responses time themselves, and failed requests are not counted.
+	"""
+	def decorator(view: Callable[..., Response]) -> Callable[..., Response]:
+		@functools.wraps(view)
+		def view_timed(*args, **kwargs) -> Response:
+			with metrics.operation(operation_name) as timings:
+				response = view(*args, **kwargs)
+				timings.discarded = response.is_streamed or response.status_code >= 400
+			if not response.is_streamed:
+				response.headers['Server-Timing'] = timings.server_timing()
+			return response
+		return view_timed
+	return decorator
+
+
+def _render_template(template_name: str, **context) -> str:
+	with metrics.stage('templating'):
+		return render_template(template_name, **context)
+
+
 @api.route('/suggestions/<group_name>/<path:key>')
+@_timed('suggestions')
 def suggestions(group_name: str, key: str) -> Response:
 	timestamp_suggestions_requested = float(request.args.get('timestamp', time.time() * 1000))
 	dicts = current_app.extensions['dictionaries']
 	if not dicts.settings.group_exists(group_name):
 		response = make_response('<p>Group %s not found</p>' % group_name, 404)
 	else:
-		suggestions = dicts.suggestions(group_name, key)
+		suggestions = dicts.suggestions(group_name, key, request.args.get('after'))
 		response = jsonify({
 			'timestamp': timestamp_suggestions_requested,
 			'suggestions': suggestions
@@ -20,17 +48,67 @@ def suggestions(group_name: str, key: str) -> Response:
 	return response
 
 
+def _stream_query(group_name: str, key: str) -> Response:
+	"""
+	Newline-delimited JSON: one record per dictionary as soon as its article is ready,
+	{position (in the group), dictionary, display_name, html (the article block)},
+	then a last one {found, dictionaries, time_to_first_article, total_time (in seconds)},
+	with the suggestions as articles if nothing was found.
+	"""
+	dicts = current_app.extensions['dictionaries']
+	time_requested = time.perf_counter()
+
+	def records() -> Iterator[str]:
+		time_to_first_article = None
+		dictionaries = []
+		with metrics.operation('query'):
+			for position, dictionary_name, display_name, article in dicts.query_stream(group_name, key):
+				if time_to_first_article is None:
+					time_to_first_article = time.perf_counter() - time_requested
+				dictionaries.append((position, dictionary_name))
+				yield json.dumps({
+					'position': position,
+					'dictionary': dictionary_name,
+					'display_name': display_name,
+					'html': _render_template('articles.html', articles=[(dictionary_name, display_name, article)])
+				}, ensure_ascii=False) + '\n'
+			if len(dictionaries) > 0:
+				summary = {
+					'found': True,
+					'dictionaries': [dictionary_name for _, dictionary_name in sorted(dictionaries)]
+				}
+			else:
+				summary = {
+					'found': False,
+					'articles': _render_template('suggestions.html',
+												 key=key,
+												 group_name=group_name,
+												 suggestions=dicts.suggestions(group_name, key)),
+					'dictionaries': dicts.settings.dictionaries_of_group(group_name)
+				}
+			summary['time_to_first_article'] = time_to_first_article
+			summary['total_time'] = time.perf_counter() - time_requested
+		yield json.dumps(summary, ensure_ascii=False) + '\n'
+
+	response = Response(stream_with_context(records()), mimetype='application/x-ndjson')
+	response.headers['X-Accel-Buffering'] = 'no' # or nginx would hold the records back
+	return response
+
+
 @api.route('/query/<group_name>/<path:key>')
+@_timed('query')
 def query(group_name: str, key: str) -> Response:
 	dicts = current_app.extensions['dictionaries']
 	if not dicts.settings.group_exists(group_name):
 		response = make_response(f'<p>Group {group_name} not found</p>', 404)
+	elif request.args.get('stream', False):
+		response = _stream_query(group_name, key)
 	else:
 		articles = dicts.query(group_name, key)
 		including_dictionaries = request.args.get('dicts', False)
 		if len(articles) > 0:
 			if including_dictionaries:
-				articles_html = render_template('articles.html', articles=articles)
+				articles_html = _render_template('articles.html', articles=articles)
 				response = jsonify(
 					{
 						'found': True,
@@ -39,14 +117,14 @@ def query(group_name: str, key: str) -> Response:
 					}
 				)
 			else:  # used without the web interface
-				articles_html = render_template('articles_standalone.html', key=key, articles=articles)
+				articles_html = _render_template('articles_standalone.html', key=key, articles=articles)
 				response = make_response(articles_html)
 		else:
 			suggestions = dicts.suggestions(group_name, key)
-			suggestions_html = render_template('suggestions.html',
-									  			key=key,
-												group_name=group_name,
-												suggestions=suggestions)
+			suggestions_html = _render_template('suggestions.html',
+									  			 key=key,
+												 group_name=group_name,
+												 suggestions=suggestions)
 			if including_dictionaries:
 				response = jsonify(
 					{
@@ -61,6 +139,7 @@ def query(group_name: str, key: str) -> Response:
 
 
 @api.route('/anki/<group_name>/<path:word>')
+@_timed('query_anki')
 def anki(group_name: str, word: str) -> Response:
 	dicts = current_app.extensions['dictionaries']
 	if not dicts.settings.group_exists(group_name):
@@ -70,7 +149,7 @@ def anki(group_name: str, word: str) -> Response:
 		including_dictionaries = request.args.get('dicts', False)
 		if len(articles) > 0:
 			if including_dictionaries:
-				articles_html = render_template('anki.html', articles=articles)
+				articles_html = _render_template('anki.html', articles=articles)
 				response = jsonify(
 					{
 						'found': True,
@@ -79,7 +158,7 @@ def anki(group_name: str, word: str) -> Response:
 					}
 				)
 			else:
-				articles_html = render_template('anki_standalone.html', word=word, articles=articles)
+				articles_html = _render_template('anki_standalone.html', word=word, articles=articles)
 				response = make_response(articles_html)
 		else:
 			if including_dictionaries:
@@ -96,6 +175,67 @@ def anki(group_name: str, word: str) -> Response:
 	return response
 
 
+def _stream_batch(operation_name: str, records: Iterator[dict]) -> Response:
+	"""
+	The records are built as they are sent, so the operation is timed there, as with the streamed /query.
+	"""
+	def lines() -> Iterator[str]:
+		with metrics.operation(operation_name):
+			for record in records:
+				yield json.dumps(record, ensure_ascii=False) + '\n'
+
+	response = Response(stream_with_context(lines()), mimetype='application/x-ndjson')
+	response.headers['X-Accel-Buffering'] = 'no'
+	return response
+
+
+def _keys_of_batch() -> list[str] | None:
+	keys = request.get_json(silent=True)
+	if not isinstance(keys, list) or not all(isinstance(key, str) for key in keys):
+		return None
+	return keys
+
+
+@api.route('/query_batch/<group_name>', methods=['POST'])
+@_timed('query_batch')
+def query_batch(group_name: str) -> Response:
+	"""
+	The body is a JSON list of keys. Newline-delimited JSON: one record per key, in order,
+	{key, found, articles (HTML, empty if not found), dictionaries}.
+	Unlike /query, no suggestions are given and the keys are not added to the history.
+	"""
+	dicts = current_app.extensions['dictionaries']
+	if not dicts.settings.group_exists(group_name):
+		return make_response(f'<p>Group {group_name} not found</p>', 404)
+	if (keys := _keys_of_batch()) is None:
+		return make_response('<p>A JSON list of keys is expected</p>', 400)
+	return _stream_batch('query_batch', ({
+		'key': key,
+		'found': len(articles) > 0,
+		'articles': _render_template('articles.html', articles=articles) if len(articles) > 0 else '',
+		'dictionaries': [article[0] for article in articles]
+	} for key, articles in dicts.query_batch(group_name, keys)))
+
+
+@api.route('/anki_batch/<group_name>', methods=['POST'])
+@_timed('anki_batch')
+def anki_batch(group_name: str) -> Response:
+	"""
+	The body is a JSON list of words. Newline-delimited JSON as with /query_batch, the articles being those of /anki.
+	"""
+	dicts = current_app.extensions['dictionaries']
+	if not dicts.settings.group_exists(group_name):
+		return make_response(f'<p>Group {group_name} not found.</p>', 404)
+	if (words := _keys_of_batch()) is None:
+		return make_response('<p>A JSON list of words is expected.</p>', 400)
+	return _stream_batch('anki_batch', ({
+		'word': word,
+		'found': len(articles) > 0,
+		'articles': _render_template('anki.html', articles=articles) if len(articles) > 0 else '',
+		'dictionaries': [article[0] for article in articles]
+	} for word, articles in dicts.query_anki_batch(group_name, words)))
+
+
 @api.route('/lookup/<dictionary_name>/<path:key>')
 def lookup(dictionary_name: str, key: str) -> Response:
 	"""
@@ -114,6 +254,7 @@ def lookup(dictionary_name: str, key: str) -> Response:
 
 
 @api.route('/fts/<path:query>')
+@_timed('full_text_search')
 def full_text_search(query: str) -> Response:
 	dicts = current_app.extensions['dictionaries']
 	including_dictionaries = request.args.get('dicts', False)
@@ -133,7 +274,7 @@ def full_text_search(query: str) -> Response:
 		articles = dicts.full_text_search(query)
 		if len(articles) > 0:
 			if including_dictionaries:
-				articles_html = render_template(
+				articles_html = _render_template(
 					'articles.html',
 					articles=[
 						(f'{a[0]}__{a[1]}',
@@ -154,7 +295,7 @@ def full_text_search(query: str) -> Response:
 					}
 				)
 			else:  # used without the web interface
-				articles_html = render_template('articles_standalone.html', articles=articles)
+				articles_html = _render_template('articles_standalone.html', articles=articles)
 				response = make_response(articles_html)
 		else:
 			response_html = '<p>No result found.</p>'
@@ -1,6 +1,7 @@
-from flask import jsonify, current_app, request, Response
+from flask import jsonify, current_app, make_response, request, Response
 from . import api
 from .. import db_manager # Perhaps it's a sin to directly query the database here...
+from .. import metrics
 import logging
 
 logger = logging.getLogger(__name__)
@@ -234,13 +235,104 @@ def create_ngram_table() -> Response:
 	if TRUSTED == False:
 		raise PermissionError
 	dicts = current_app.extensions['dictionaries']
-	db_manager.create_ngram_table(dicts.settings.preferences['ngram_stores_keys'])
+	try:
+		db_manager.create_ngram_table(dicts.settings.preferences['ngram_stores_keys'])
+	except RuntimeError: # already being built, poll /management/ngram_table_progress
+		return make_response(jsonify({'success': False, 'progress': db_manager.ngram_table_progress()}), 409)
 	logger.info('Recreated ngram table')
 	dicts.settings.change_suggestions_mode_from_right_side_to_both_sides()
 	response = jsonify({'success': True})
 	return response
 
 
+@api.route('/management/ngram_table_progress')
+def ngram_table_progress() -> Response:
+	response = jsonify(db_manager.ngram_table_progress())
+	return response
+
+
+@api.route('/management/maintenance')
+def maintenance() -> Response:
+	if TRUSTED == False:
+		raise PermissionError
+	try:
+		report = db_manager.maintain()
+	except RuntimeError: # already running
+		return make_response(jsonify({'success': False}), 409)
+	response = jsonify({'success': True, 'report': report})
+	return response
+
+
+@api.route('/management/executors')
+def executors() -> Response:
+	response = jsonify(current_app.extensions['dictionaries'].executor_statistics())
+	return response
+
+
+@api.route('/management/article_cache')
+def article_cache() -> Response:
+	response = jsonify(current_app.extensions['dictionaries'].article_cache_statistics())
+	return response
+
+
+@api.route('/management/suggestion_cache')
+def suggestion_cache() -> Response:
+	response = jsonify(current_app.extensions['dictionaries'].suggestion_cache_statistics())
+	return response
+
+
+@api.after_request
+def count_request(response: Response) -> Response:
+	metrics.HTTP_REQUESTS.inc((request.endpoint or '', str(response.status_code)))
+	return response
+
+
+@api.route('/metrics')
+def get_metrics() -> Response:
+	"""
+	Prometheus text format: the histograms of the operations, their stages and dictionaries, the counters of requests
+	and of the caches, the executors and the readiness of the dictionaries.
+	"""
+	dicts = current_app.extensions['dictionaries']
+	executor_statistics = dicts.executor_statistics()
+	article_cache_statistics = dicts.article_cache_statistics()
+	suggestion_cache_statistics = dicts.suggestion_cache_statistics()
+	readiness = dicts.readiness()
+	texts = [metrics.exposition()]
+	for statistic, description in (('workers', 'Threads or processes of each executor.'),
+								   ('running', 'Tasks running in each executor.'),
+								   ('queued', 'Tasks waiting for a thread or process of each executor.')):
+		texts.append(metrics.format_metric(f'silverdict_executor_{statistic}', 'gauge', description, ('executor',),
+										   [((name,), statistics[statistic])
+											for name, statistics in executor_statistics.items()]))
+	texts.append(metrics.format_metric('silverdict_article_cache_lookups_total', 'counter',
+									   'Lookups of the article cache, by result.', ('result',),
+									   [(('hit',), article_cache_statistics['hits']),
+										(('disk_hit',), article_cache_statistics['disk_hits']),
+										(('miss',), article_cache_statistics['misses'])]))
+	texts.append(metrics.format_metric('silverdict_article_cache_articles', 'gauge',
+									   'Articles held in memory by the article cache.', (),
+									   [((), article_cache_statistics['articles'])]))
+	texts.append(metrics.format_metric('silverdict_article_cache_bytes', 'gauge',
+									   'Size of the article cache, in memory and on disk.', ('medium',),
+									   [(('memory',), article_cache_statistics['size']),
+										(('disk',), article_cache_statistics['disk_size'])]))
+	texts.append(metrics.format_metric('silverdict_suggestion_cache_lookups_total', 'counter',
+									   'Lookups of the suggestion cache, by result.', ('result',),
+									   [(('hit',), suggestion_cache_statistics['hits']),
+										(('miss',), suggestion_cache_statistics['misses'])]))
+	texts.append(metrics.format_metric('silverdict_suggestion_cache_windows', 'gauge',
+									   'Windows held by the suggestion cache.', (),
+									   [((), suggestion_cache_statistics['windows'])]))
+	states = ('ready', 'failed', 'indexing', 'opening', 'cold')
+	texts.append(metrics.format_metric('silverdict_dictionaries', 'gauge',
+									   'Dictionaries, by state of their readers.', ('state',),
+									   [((state,), sum(s == state for s in readiness['dictionaries'].values()))
+										for state in states]))
+	response = Response(''.join(texts), mimetype='text/plain; version=0.0.4')
+	return response
+
+
 @api.route('/management/create_xapian_index')
 def create_xapian_index() -> Response:
 	if TRUSTED == False:
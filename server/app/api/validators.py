@@ -1,4 +1,4 @@
-from flask import jsonify, current_app, request, Response
+from flask import jsonify, current_app, make_response, request, Response
 from . import api
 
 
@@ -22,7 +22,21 @@ def source_valid() -> Response:
 
 @api.route('/validator/test_connection')
 def test_connection() -> Response:
+	readiness = current_app.extensions['dictionaries'].readiness()
 	response = jsonify({
-		'success': True
+		'success': True,
+		'ready': readiness['ready'],
+		'total': readiness['total']
 	})
 	return response
+
+
+@api.route('/validator/readiness')
+def readiness() -> Response:
+	"""
+	503 while dictionaries are still being opened or indexed, for health checks.
+	"""
+	readiness = current_app.extensions['dictionaries'].readiness()
+	loading = any(state in ('cold', 'opening', 'indexing') for state in readiness['dictionaries'].values())
+	response = make_response(jsonify(readiness), 503 if loading else 200)
+	return response
@@ -0,0 +1,206 @@
+"""
+A cache of the articles rendered by Dictionaries.query(), per dictionary, since the same few thousand words
+make up most lookups. Articles are kept in memory up to a size, least recently used first out,
+and optionally in a compressed tier on disk, under Settings.ARTICLE_CACHE_DIR/<tier>/<dictionary name>/.
+The tier is named after the format of its files and a fingerprint of what the articles are rendered with
+(code, rules, preferences), and those of other names, left by previous runs, are removed at startup.
+
+Every dictionary has a generation, bumped by invalidate() when it is added, removed or re-indexed,
+which is part of the keys in memory, so that an article rendered while the dictionary changed is never served.
+Its files on disk are removed at the same time, as the generations start over on each run.
+"""
+
+import hashlib
+import os
+import shutil
+import sys
+import threading
+import zlib
+from collections import OrderedDict
+from typing import Hashable
+from .settings import Settings
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Fast rather than small: articles are compressed on the request path
+_COMPRESSION_LEVEL = 1
+# Of the files of the disk tier, to be bumped when they change
+_FORMAT_VERSION = 1
+
+
+class ArticleCache:
+	def __init__(self, max_size: int, disk_max_size: int, fingerprint: str = '') -> None:
+		"""
+		:param max_size: bytes of articles held in memory, 0 to disable the cache
+		:param disk_max_size: bytes of compressed articles stored on disk, 0 to disable the disk tier
+		:param fingerprint: of what the articles are rendered with, the disk tier of another one being stale
+		"""
+		self._max_size = max_size
+		self._disk_max_size = disk_max_size
+		self._root = os.path.join(Settings.ARTICLE_CACHE_DIR, f'v{_FORMAT_VERSION}-{fingerprint}')
+		self._remove_stale_tiers()
+		self._articles: OrderedDict[tuple, str] = OrderedDict()
+		self._size = 0
+		self._generations: dict[str, int] = dict()
+		self._lock = threading.Lock()
+		self._num_hits = 0
+		self._num_disk_hits = 0
+		self._num_misses = 0
+		self._disk_size = self._scan_disk_size() if disk_max_size > 0 else 0
+
+	def _remove_stale_tiers(self) -> None:
+		if not os.path.isdir(Settings.ARTICLE_CACHE_DIR):
+			return
+		paths = [os.path.join(Settings.ARTICLE_CACHE_DIR, name) for name in os.listdir(Settings.ARTICLE_CACHE_DIR)]
+		paths = [path for path in paths if path != self._root]
+		if len(paths) > 0:
+			logger.info('Removing the articles cached on disk by another version or with other settings.')
+		for path in paths:
+			if os.path.isdir(path):
+				shutil.rmtree(path, ignore_errors=True)
+			else:
+				try:
+					os.remove(path)
+				except OSError:
+					pass
+
+	def _scan_disk_size(self) -> int:
+		size = 0
+		for directory, _, filenames in os.walk(self._root):
+			for filename in filenames:
+				size += os.path.getsize(os.path.join(directory, filename))
+		return size
+
+	def _filename(self, dictionary_name: str, key: Hashable) -> str:
+		digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+		return os.path.join(self._root, dictionary_name, digest)
+
+	def get(self, dictionary_name: str, key: Hashable) -> str | None:
+		"""
+		key identifies the article within the dictionary, e.g. the keys looked up and the options of the rendering.
+		It must have a stable repr() for the disk tier.
+		"""
+		if self._max_size <= 0:
+			return None
+		with self._lock:
+			memory_key = (dictionary_name, self._generations.get(dictionary_name, 0), key)
+			if (article := self._articles.get(memory_key)) is not None:
+				self._articles.move_to_end(memory_key)
+				self._num_hits += 1
+				return article
+		if self._disk_max_size > 0:
+			try:
+				with open(self._filename(dictionary_name, key), 'rb') as f:
+					article = zlib.decompress(f.read()).decode('utf-8')
+			except (FileNotFoundError, zlib.error):
+				pass
+			else:
+				with self._lock:
+					self._num_disk_hits += 1
+				self._put_in_memory(memory_key, article)
+				return article
+		with self._lock:
+			self._num_misses += 1
+		return None
+
+	def _put_in_memory(self, memory_key: tuple, article: str) -> None:
+		size = sys.getsizeof(article)
+		if size > self._max_size:
+			return
+		with self._lock:
+			if memory_key[1] != self._generations.get(memory_key[0], 0): # invalidated in the meantime
+				return
+			if (previous := self._articles.pop(memory_key, None)) is not None:
+				self._size -= sys.getsizeof(previous)
+			self._articles[memory_key] = article
+			self._size += size
+			while self._size > self._max_size:
+				_, evicted = self._articles.popitem(last=False)
+				self._size -= sys.getsizeof(evicted)
+
+	def put(self, dictionary_name: str, key: Hashable, article: str, generation: int) -> None:
+		"""
+		generation is that of the dictionary before the article was rendered, see generation().
+		"""
+		if self._max_size <= 0:
+			return
+		self._put_in_memory((dictionary_name, generation, key), article)
+		if self._disk_max_size > 0:
+			self._put_on_disk(dictionary_name, key, article, generation)
+
+	def _put_on_disk(self, dictionary_name: str, key: Hashable, article: str, generation: int) -> None:
+		filename = self._filename(dictionary_name, key)
+		data = zlib.compress(article.encode('utf-8'), _COMPRESSION_LEVEL)
+		try:
+			os.makedirs(os.path.dirname(filename), exist_ok=True)
+			filename_temp = f'{filename}.{threading.get_ident()}.tmp'
+			with open(filename_temp, 'wb') as f:
+				f.write(data)
+			with self._lock:
+				if generation != self._generations.get(dictionary_name, 0):
+					os.remove(filename_temp)
+					return
+				os.replace(filename_temp, filename)
+				self._disk_size += len(data)
+				prunes = self._disk_size > self._disk_max_size
+		except OSError as e:
+			logger.warning(f'Could not write an article to the disk cache: {e}')
+			return
+		if prunes:
+			self._prune_disk()
+
+	def _prune_disk(self) -> None:
+		"""
+		Removes the least recently written files until the disk tier is down to 3/4 of its size.
+		"""
+		files = []
+		for directory, _, filenames in os.walk(self._root):
+			for filename in filenames:
+				path = os.path.join(directory, filename)
+				try:
+					stat = os.stat(path)
+				except FileNotFoundError:
+					continue
+				files.append((stat.st_mtime, stat.st_size, path))
+		files.sort()
+		size = sum(file[1] for file in files)
+		for _, file_size, path in files:
+			if size <= self._disk_max_size * 3 // 4:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			size -= file_size
+		with self._lock:
+			self._disk_size = size
+
+	def generation(self, dictionary_name: str) -> int:
+		with self._lock:
+			return self._generations.get(dictionary_name, 0)
+
+	def invalidate(self, dictionary_name: str) -> None:
+		"""
+		To be called when a dictionary is added, removed or re-indexed.
+		"""
+		with self._lock:
+			self._generations[dictionary_name] = self._generations.get(dictionary_name, 0) + 1
+			for memory_key in [memory_key for memory_key in self._articles.keys() if memory_key[0] == dictionary_name]:
+				self._size -= sys.getsizeof(self._articles.pop(memory_key))
+			directory = os.path.join(self._root, dictionary_name)
+			if os.path.isdir(directory):
+				shutil.rmtree(directory, ignore_errors=True)
+				self._disk_size = self._scan_disk_size()
+
+	def statistics(self) -> dict[str, int]:
+		with self._lock:
+			return {
+				'hits': self._num_hits,
+				'disk_hits': self._num_disk_hits,
+				'misses': self._num_misses,
+				'articles': len(self._articles),
+				'size': self._size,
+				'disk_size': self._disk_size
+			}
@@ -0,0 +1,89 @@
+"""
+Post-processing of the articles returned by the readers, compiled once per dictionary.
+The Chinese conversion takes a single pass over the article to set the API references aside and a single call to OpenCC,
+and the substitutions (legacy links rewritten, media removed for Anki, those registered by the transformation package)
+are then made in the order given, by str.replace() for literal rules and by the regular expression engine otherwise.
+Substitutions in one regular expression dispatched by Python would cost a call per match, which is slower for
+multi-megabyte articles than a pass of the engine for each of them, so only substitutions with the same replacement
+are worth combining, into one pattern.
+"""
+
+import re
+from typing import Callable, NamedTuple
+
+# Joins the pieces of text converted in one call, being ASCII, which OpenCC leaves alone
+_SEPARATOR = '!!@@SUBSTITUTION@@!!'
+
+Replacement = str | Callable[[re.Match, str], str]
+
+
+class Rule(NamedTuple):
+	"""
+	Made with literal() or regex(), which say how the pattern and the replacement are to be read.
+	"""
+	pattern: str
+	replacement: Replacement
+	is_literal: bool
+
+
+def literal(text: str, replacement: str) -> Rule:
+	"""
+	Every occurrence of text replaced by replacement, both taken as they are.
+	"""
+	return Rule(text, replacement, True)
+
+
+def regex(pattern: str, replacement: Replacement) -> Rule:
+	"""
+	The matches of the regular expression replaced as with re.sub(), the replacement being a template,
+	or a function of the match and the name of the group queried.
+	"""
+	return Rule(pattern, replacement, False)
+
+
+class ArticlePipeline:
+	"""
+	Rules are applied to the converted article, in order.
+	protected is the pattern of the text left alone by the Chinese conversion.
+	"""
+	def __init__(self, rules: list[Rule], protected: str | None = None) -> None:
+		self._steps: list[Callable[[str, str], str]] = [self._step(rule) for rule in rules]
+		self._protected = re.compile(protected) if protected is not None else None
+
+	@staticmethod
+	def _step(rule: Rule) -> Callable[[str, str], str]:
+		pattern, replacement = rule.pattern, rule.replacement
+		if rule.is_literal:
+			return lambda article, group_name: article.replace(pattern, replacement)
+		compiled = re.compile(pattern)
+		if isinstance(replacement, str):
+			return lambda article, group_name: compiled.sub(replacement, article)
+		return lambda article, group_name: compiled.sub(lambda match: replacement(match, group_name), article)
+
+	def _convert(self, article: str, convert: Callable[[str], str]) -> str:
+		if self._protected is None:
+			return convert(article)
+		# The text to convert and the protected text, alternately
+		pieces = []
+		position = 0
+		for match in self._protected.finditer(article):
+			pieces.append(article[position:match.start()])
+			pieces.append(match.group())
+			position = match.end()
+		pieces.append(article[position:])
+		texts = pieces[::2]
+		texts_converted = convert(_SEPARATOR.join(texts)).split(_SEPARATOR)
+		if len(texts_converted) != len(texts): # the separator is in the article
+			texts_converted = [convert(text) for text in texts]
+		pieces[::2] = texts_converted
+		return ''.join(pieces)
+
+	def process(self, article: str, group_name: str = '', convert: Callable[[str], str] | None = None) -> str:
+		"""
+		convert, if given, converts the Chinese text of the article.
+		"""
+		if convert is not None:
+			article = self._convert(article, convert)
+		for step in self._steps:
+			article = step(article, group_name)
+		return article
@@ -0,0 +1,25 @@
+"""
+The app served by an asyncio event loop (uvicorn) instead of waitress, with the 'asgi' server preference.
+Connections are handled by the event loop, so idle keep-alive connections cost no thread,
+and the requests run the same Flask app on two pools of threads: one for the suggestions, requested on every keystroke,
+and one for everything else (articles, full-text search, management), so that slow requests cannot hold up typing.
+Reading and converting the articles still runs on the executors of Dictionaries.
+Requires uvicorn and a2wsgi.
+"""
+
+from a2wsgi import WSGIMiddleware
+from flask import Flask
+from .settings import Settings
+
+
+def create_asgi_app(app: Flask):
+	suggestions = WSGIMiddleware(app, workers=Settings.ASGI_SUGGESTIONS_WORKERS)
+	others = WSGIMiddleware(app, workers=Settings.ASGI_WORKERS)
+
+	async def asgi_app(scope: dict, receive, send) -> None:
+		if scope['type'] == 'http' and scope['path'].startswith('/api/suggestions/'):
+			await suggestions(scope, receive, send)
+		else:
+			await others(scope, receive, send)
+
+	return asgi_app
@@ -5,12 +5,19 @@ After all, it is efficient, thread-safe, and easy to use.
 """
 """
 Performance note:
-dictionary_exists(): very good with idx_dictname
-get_entries(): very good with idx_key_dictname_word
+The entries of every dictionary are in a database of their own, <SQLITE_ENTRIES_DIR>/<dictionary name>.db,
+built in one go by add_entries() and only read afterwards. Removing or re-indexing a dictionary
+drops its file, which gives the space back at once and leaves the other dictionaries untouched.
+The shared database (SQLITE_DB_FILE) holds the registry of the dictionaries and the ngram table.
+Queries on several dictionaries are run on each of them, and their rows, in key order, are merged.
+
+dictionary_exists(), headword_count_of_dictionary(): a lookup in the registry (the dictionaries table)
+get_entries(): very good with idx_key_word
 select_entries_like(): I don't care, GoldenDict is also quite slow in this respect
-entry_exists_in_dictionary(), entry_exists_in_dictionaries(): very good with idx_key_dictname_word
+entry_exists_in_dictionary(), entry_exists_in_dictionaries(): very good with idx_key_word
+get_entries_with_headword(), headword_exists_in_dictionary(): very good with idx_word
 
-If idx_dictname exists, select_entries_beginning_with() would use it instead of idx_key_dictname_word(), which slows things down. Anyway dictionary_exists() is only used when initialising a dictionary reader, so it is not a big deal.
+word is only stored when it differs from key. Always select coalesce(word, key) (_WORD) as the word.
 
 ---
 
@@ -25,10 +32,60 @@ But now, experimentally, I am using a lazy approach: just key < "key𱍊" (U+313
 """
 
 import sqlite3
+import json
+import re
 import threading
+import queue
+import os
+import sys
+import struct
+import heapq
+import tempfile
+import time
+from array import array
+from bisect import bisect_left
+from contextlib import contextmanager, ExitStack
+from itertools import islice, groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Callable, ContextManager, Iterable, Iterator, Generator
 from .settings import Settings
-
-local_storage = threading.local()
+from . import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+_SCHEMA_VERSION = 4
+# entries.word is null when it is the same as key
+_WORD = 'coalesce(word, key)'
+
+# Rows written per executemany() call during bulk ingestion
+_INGESTION_BATCH_SIZE = 50000
+# Pragmas of the connection building the database of a dictionary
+_INGESTION_PRAGMAS = {
+	'auto_vacuum': 'INCREMENTAL', # before any table is created, so that maintain() can give free pages back
+	'journal_mode': 'OFF', # the database is built under a temporary name and discarded if anything goes wrong
+	'synchronous': 'OFF',
+	'cache_size': -262144, # 256 MiB
+	'temp_store': 'FILE' # the sorts of the index builds of a big dictionary would not fit into memory on small devices
+}
+# One dictionary is built at a time, which bounds the memory taken by the caches above
+_ingestion_lock = threading.Lock()
+# Whether the databases of the dictionaries carry an FTS5 index, see create_fts_table()
+_fts_enabled = False
+
+# Postings of the ngram table are arrays of 4-byte unsigned key ids, stored little-endian
+_POSTING_TYPECODE = 'I'
+_POSTING_ITEMSIZE = 4
+assert array(_POSTING_TYPECODE).itemsize == _POSTING_ITEMSIZE
+# When more postings than this are held in memory, they are spilled to a sorted run on disk (~4 bytes each)
+_NGRAM_MAX_POSTINGS_IN_MEMORY = 20_000_000
+_NGRAM_PROGRESS_INTERVAL = 10000
+# Number of candidate keys fetched and checked at a time by expand_key()
+_NGRAM_VERIFICATION_CHUNK_SIZE = 64
+_ngram_table_lock = threading.Lock()
+_ngram_table_progress = {'running': False, 'stage': None, 'processed': 0, 'total': None}
 
 # n-gram related helpers
 def _gen_ngrams(input: str, ngramlen: int) -> list[str]:
@@ -39,187 +96,798 @@ def _gen_ngrams(input: str, ngramlen: int) -> list[str]:
 	return ngrams
 
 
-def get_connection() -> sqlite3.Connection:
-	if not hasattr(local_storage, 'connection'):
-		local_storage.connection = sqlite3.connect(Settings.SQLITE_DB_FILE)
-	return local_storage.connection
+class _ReaderPool:
+	"""
+	A bounded pool of read-only connections to a database shared by the request threads.
+	In WAL mode they are never blocked by the writer.
+	The connections are closed when the pool is garbage-collected, i.e. once it is dropped and the queries using it are over.
+	"""
+	def __init__(self, filename: str, size: int, cache_size: int) -> None:
+		self._filename = filename
+		self._cache_size = cache_size
+		# Held by each connection lent, and given back after it, so that no more than size are ever opened
+		self._slots = threading.BoundedSemaphore(size)
+		self._idle_connections: queue.SimpleQueue[sqlite3.Connection] = queue.SimpleQueue()
+
+	def _open(self) -> sqlite3.Connection:
+		connection = sqlite3.connect(Path(self._filename).as_uri() + '?mode=ro',
+									 uri=True,
+									 check_same_thread=False)
+		try:
+			connection.execute(f'pragma mmap_size = {Settings.SQLITE_MMAP_SIZE}')
+			connection.execute(f'pragma cache_size = {self._cache_size}')
+		except Exception:
+			connection.close()
+			raise
+		return connection
+
+	@contextmanager
+	def cursor(self) -> Iterator[sqlite3.Cursor]:
+		"""
+		Lends a cursor of an idle connection, opening a new one if there is none,
+		or waiting for one to be given back if the pool is full.
+		If the connection cannot be opened (file missing or locked...), the error is raised and the slot freed.
+		"""
+		self._slots.acquire()
+		try:
+			try:
+				connection = self._idle_connections.get_nowait()
+			except queue.Empty:
+				connection = self._open()
+		except BaseException:
+			self._slots.release()
+			raise
+		cursor = connection.cursor()
+		try:
+			with metrics.stage('sqlite'):
+				yield cursor
+		finally:
+			cursor.close()
+			self._idle_connections.put(connection)
+			self._slots.release()
+
+
+_readers = _ReaderPool(Settings.SQLITE_DB_FILE, Settings.SQLITE_READ_CONNECTIONS, Settings.SQLITE_CACHE_SIZE)
+_reader = _readers.cursor
+
+# All writes to the shared database go through this connection, one at a time
+_writer_connection: sqlite3.Connection | None = None
+_writer_lock = threading.RLock()
+
+
+@contextmanager
+def _writer() -> Iterator[sqlite3.Connection]:
+	global _writer_connection
+	with _writer_lock:
+		if _writer_connection is None:
+			_writer_connection = sqlite3.connect(Settings.SQLITE_DB_FILE, check_same_thread=False)
+			# Only takes effect on a new database, so that maintain() can give free pages back
+			_writer_connection.execute('pragma auto_vacuum = INCREMENTAL')
+			_writer_connection.execute('pragma journal_mode = WAL')
+			_writer_connection.execute('pragma synchronous = NORMAL') # durable enough in WAL mode
+			_writer_connection.execute(f'pragma journal_size_limit = {Settings.SQLITE_JOURNAL_SIZE_LIMIT}')
+			_writer_connection.execute(f'pragma cache_size = {Settings.SQLITE_CACHE_SIZE}')
+		yield _writer_connection
+
+
+# dictionary name -> pool of connections to the database of its entries, filled on demand
+_entries_readers: dict[str, _ReaderPool] = dict()
+_entries_readers_lock = threading.Lock()
+
+
+def _entries_filename(dictionary_name: str) -> str:
+	return os.path.join(Settings.SQLITE_ENTRIES_DIR, dictionary_name + '.db')
+
+
+def _entries_reader_pool(dictionary_name: str) -> _ReaderPool | None:
+	"""
+	Returns None if the dictionary is not indexed.
+	"""
+	if (pool := _entries_readers.get(dictionary_name)) is None:
+		filename = _entries_filename(dictionary_name)
+		if not os.path.isfile(filename):
+			return None
+		with _entries_readers_lock:
+			if (pool := _entries_readers.get(dictionary_name)) is None:
+				pool = _entries_readers[dictionary_name] = _ReaderPool(filename,
+																	   Settings.SQLITE_READ_CONNECTIONS,
+																	   Settings.SQLITE_ENTRIES_CACHE_SIZE)
+	return pool
+
+
+def _forget_entries_readers(dictionary_name: str) -> None:
+	"""
+	To be called after the database of a dictionary is replaced or removed,
+	as the connections opened before would still read the previous file.
+	"""
+	with _entries_readers_lock:
+		_entries_readers.pop(dictionary_name, None)
 
 
-def get_cursor() -> sqlite3.Cursor:
-	if not hasattr(local_storage, 'cursor'):
-		local_storage.cursor = get_connection().cursor()
-	return local_storage.cursor
+@contextmanager
+def _entries_reader(dictionary_name: str) -> Iterator[sqlite3.Cursor | None]:
+	"""
+	Lends a cursor on the database of a dictionary, or None if it is not indexed.
+	"""
+	if (pool := _entries_reader_pool(dictionary_name)) is None:
+		yield None
+	else:
+		with pool.cursor() as cursor:
+			yield cursor
 
 
-def create_table_entries() -> None:
-	cursor = get_cursor()
-	cursor.execute('''create table if not exists entries (
+@contextmanager
+def _entries_readers_of(names_dictionaries: list[str]) -> Iterator[list[tuple[str, sqlite3.Cursor]]]:
+	"""
+	Lends a cursor on the database of each dictionary, in the order given, leaving out those not indexed.
+	The connections are taken in name order, so that two threads can never wait for each other's.
+	"""
+	pools = {name: pool
+			 for name in dict.fromkeys(names_dictionaries)
+			 if (pool := _entries_reader_pool(name)) is not None}
+	with ExitStack() as stack:
+		cursors = {name: stack.enter_context(pools[name].cursor()) for name in sorted(pools.keys())}
+		yield [(name, cursors[name]) for name in pools.keys()]
+
+
+def _merge_rows(rows_of_dictionaries: list[Iterable[tuple[str, str]]]) -> Iterator[tuple[str, str]]:
+	"""
+	Merges the (key, word) rows of the dictionaries, each in key order, into one stream in key order.
+	The rows are compared as tuples, which is faster than with a key function and keeps the key order
+	even though the words of a key are not sorted.
+	"""
+	return heapq.merge(*rows_of_dictionaries)
+
+
+def _first_words(rows_of_dictionaries: list[Iterable[tuple[str, str]]], num_words: int) -> list[str]:
+	"""
+	Returns the first num_words distinct words of the merged (key, word) rows of the dictionaries.
+	"""
+	words = dict() # insertion-ordered set
+	if num_words <= 0:
+		return []
+	for _, word in _merge_rows(rows_of_dictionaries):
+		words[word] = None
+		if len(words) >= num_words:
+			break
+	return list(words)
+
+
+def _create_registry(cursor: sqlite3.Cursor) -> None:
+	# The registry of the dictionaries, kept up to date by add_entries() and delete_dictionary()
+	cursor.execute('''create table if not exists dictionaries (
+		id integer primary key,
+		name text unique not null, -- identifying name of the dictionary
+		num_entries integer not null default 0,
+		file_modified_time real -- modification time of the file when it was indexed
+	)''')
+
+
+def _create_table_entries(cursor: sqlite3.Cursor) -> None:
+	cursor.execute('''create table entries (
 		key text, -- the entry in lowercase and without accents
-		dictionary_name text, -- identifying name of the dictionary
-		word text, -- the entry as it appears in the dictionary
+		word text, -- the entry as it appears in the dictionary, null if the same as key
 		offset integer, -- offset of the entry in the dictionary file
 		size integer -- size of the definition in bytes
 	)''')
 
 
+def _create_indexes(cursor: sqlite3.Cursor) -> None:
+	# Covering for suggestions and existence checks
+	cursor.execute('create index idx_key_word on entries (key, word)')
+	cursor.execute(f'create index idx_word on entries ({_WORD})')
+
+
+def _create_fts_table(cursor: sqlite3.Cursor) -> None:
+	cursor.execute('''create virtual table entries_fts using fts5 (
+		key, content = 'entries', content_rowid = 'rowid', tokenize = 'trigram'
+	)''')
+	cursor.execute("insert into entries_fts (entries_fts) values ('rebuild')")
+
+
+def _build_entries_database(dictionary_name: str, entries: Iterable[tuple[str, str, int, int]]) -> int:
+	"""
+	Writes the (key, word, offset, size) of a dictionary to a new database under a temporary name,
+	indexes them, and moves the file into place, replacing that of a previous indexing if any.
+	Returns the number of rows written.
+	"""
+	filename = _entries_filename(dictionary_name)
+	filename_temp = filename + '.tmp'
+	if os.path.exists(filename_temp): # left over by an interrupted build
+		os.remove(filename_temp)
+	num_rows = 0
+	connection = sqlite3.connect(filename_temp)
+	try:
+		cursor = connection.cursor()
+		for pragma, value in _INGESTION_PRAGMAS.items():
+			cursor.execute(f'pragma {pragma} = {value}')
+		_create_table_entries(cursor)
+		for batch in _batched(entries, _INGESTION_BATCH_SIZE):
+			cursor.executemany('insert into entries (key, word, offset, size) values (?1, nullif(?2, ?1), ?3, ?4)',
+							   batch)
+			num_rows += len(batch)
+		# Indexes built from all the rows at once are faster to create and more compact than maintained ones
+		_create_indexes(cursor)
+		if _fts_enabled:
+			_create_fts_table(cursor)
+		connection.commit()
+	except BaseException:
+		connection.close()
+		os.remove(filename_temp)
+		raise
+	connection.close()
+	os.replace(filename_temp, filename)
+	return num_rows
+
+
+def _names_of_dictionaries(cursor: sqlite3.Cursor) -> list[str]:
+	return [row[0] for row in cursor.execute('select name from dictionaries order by name')]
+
+
+def _indexed_dictionaries() -> list[str]:
+	with _reader() as cursor:
+		names_dictionaries = _names_of_dictionaries(cursor)
+	return [name for name in names_dictionaries if os.path.isfile(_entries_filename(name))]
+
+
+@contextmanager
+def _entries_writer(dictionary_name: str) -> Iterator[sqlite3.Connection]:
+	"""
+	A connection to modify the database of a dictionary once built, closed afterwards.
+	"""
+	with _ingestion_lock:
+		connection = sqlite3.connect(_entries_filename(dictionary_name))
+		try:
+			yield connection
+		finally:
+			connection.close()
+
+
+def _update_entries_databases(update: Callable[[sqlite3.Cursor], None]) -> None:
+	"""
+	Applies update() to the database of every dictionary in its own transaction.
+	"""
+	for dictionary_name in _indexed_dictionaries():
+		with _entries_writer(dictionary_name) as connection:
+			update(connection.cursor())
+			connection.commit()
+
+
+def _migrate_to_separate_databases(connection: sqlite3.Connection, schema_version: int) -> None:
+	"""
+	v1: entries (key, dictionary_name, word, offset, size), with the full name and word in every row.
+	v2: entries (key, dictionary_id, word, offset, size), word null if the same as key, and dictionaries (id, name).
+	v3: v2 plus the number of entries, rowid range and file modification time of each dictionary in the registry.
+	The entries of each dictionary are copied to a database of its own, then the shared table is dropped.
+	"""
+	cursor = connection.cursor()
+	if schema_version < 2:
+		rows = cursor.execute('''select dictionary_name, key, word, offset, size from entries
+			order by dictionary_name, rowid''')
+	else:
+		rows = cursor.execute(f'''select d.name, e.key, coalesce(e.word, e.key), e.offset, e.size
+			from entries e join dictionaries d on d.id = e.dictionary_id
+			order by e.dictionary_id, e.rowid''')
+	registry = []
+	for dictionary_name, entries in groupby(rows, key=itemgetter(0)):
+		num_entries = _build_entries_database(dictionary_name,
+											  ((key, word, offset, size) for _, key, word, offset, size in entries))
+		registry.append((dictionary_name, num_entries))
+		logger.info(f'Entries of {dictionary_name} moved to their own database.')
+	file_modified_times = dict()
+	if schema_version >= 3:
+		file_modified_times = dict(cursor.execute('select name, file_modified_time from dictionaries').fetchall())
+
+	try:
+		cursor.execute('begin') # DDL is not transactional otherwise
+		cursor.execute('drop table if exists entries_fts')
+		cursor.execute('drop table entries') # and its indexes
+		if _table_exists(cursor, 'ngrams') and not _table_exists(cursor, 'ngram_keys') and\
+			cursor.execute("select 1 from ngrams where idxs glob '*[^0-9,]*' limit 1").fetchone() is None:
+			# Built by an old version, it refers to rowids of the dropped table
+			cursor.execute('drop table ngrams')
+			logger.warning('The ngram table has to be recreated.')
+		cursor.execute('drop table if exists dictionaries')
+		_create_registry(cursor)
+		cursor.executemany('insert into dictionaries (name, num_entries, file_modified_time) values (?, ?, ?)',
+						   [(dictionary_name, num_entries, file_modified_times.get(dictionary_name))
+							for dictionary_name, num_entries in registry])
+		cursor.execute(f'pragma user_version = {_SCHEMA_VERSION}')
+		connection.commit()
+	except Exception:
+		connection.rollback()
+		raise
+	cursor.execute('pragma auto_vacuum = INCREMENTAL') # takes effect with the vacuum
+	cursor.execute('vacuum') # give the space back
+	cursor.execute('pragma wal_checkpoint(truncate)') # which has gone through the WAL
+
+
+def create_table_entries() -> None:
+	"""
+	Creates the registry of the dictionaries, whose entries are added to databases of their own by add_entries().
+	A database of an older schema version (PRAGMA user_version), with all the entries in one table,
+	is migrated first.
+	"""
+	with _writer() as connection:
+		cursor = connection.cursor()
+		schema_version = cursor.execute('pragma user_version').fetchone()[0]
+		if schema_version > _SCHEMA_VERSION:
+			raise ValueError(f'Database schema version {schema_version} is newer than this version of SilverDict.')
+		if schema_version < _SCHEMA_VERSION:
+			if _table_exists(cursor, 'entries'):
+				logger.info('Migrating the database to schema version %d, this may take a while.', _SCHEMA_VERSION)
+				_migrate_to_separate_databases(connection, schema_version)
+				logger.info('Database migrated to schema version %d.', _SCHEMA_VERSION)
+			cursor.execute(f'pragma user_version = {_SCHEMA_VERSION}')
+		_create_registry(cursor)
+		connection.commit()
+
+
+def _table_exists(cursor: sqlite3.Cursor, table_name: str) -> bool:
+	return cursor.execute("select 1 from sqlite_master where name = ?", (table_name,)).fetchone() is not None
+
+
 def dictionary_exists(dictionary_name: str) -> bool:
-	cursor = get_cursor()
-	# cursor.execute('select count(*) from entries where dictionary_name = ?', (dictionary_name,))
-	# return cursor.fetchone()[0] > 0
-	cursor.execute('select key from entries where dictionary_name = ? limit 1', (dictionary_name,))
-	return cursor.fetchone() is not None  # This is faster
+	with _reader() as cursor:
+		return cursor.execute('select 1 from dictionaries where name = ?', (dictionary_name,)).fetchone() is not None\
+			and os.path.isfile(_entries_filename(dictionary_name))
+
+
+def dictionary_modification_time(dictionary_name: str) -> float | None:
+	"""
+	Returns the modification time recorded with set_dictionary_modification_time().
+	"""
+	with _reader() as cursor:
+		row = cursor.execute('select file_modified_time from dictionaries where name = ?',
+							 (dictionary_name,)).fetchone()
+		return row[0] if row else None
+
+
+def set_dictionary_modification_time(dictionary_name: str, file_modified_time: float) -> None:
+	"""
+	Records the modification time of the file the entries of the dictionary were indexed from.
+	"""
+	with _writer() as connection:
+		connection.execute('update dictionaries set file_modified_time = ? where name = ?',
+						   (file_modified_time, dictionary_name))
+		connection.commit()
+
+
+def _batched(iterable: Iterable, n: int) -> Iterator[list]:
+	iterator = iter(iterable)
+	while batch := list(islice(iterator, n)):
+		yield batch
+
+
+def add_entries(entries: Iterable[tuple[str, str, str, int, int]]) -> int:
+	"""
+	Bulk-inserts (key, dictionary_name, word, offset, size) tuples, which may come from a generator.
+	The entries of each dictionary, which must come one after another, are written to a new database,
+	which replaces that of a previous indexing, and the dictionary is then registered.
+	Returns the number of rows written.
+	"""
+	num_rows = 0
+	for dictionary_name, entries_of_dictionary in groupby(entries, key=itemgetter(1)):
+		with _ingestion_lock:
+			num_entries = _build_entries_database(dictionary_name,
+												  ((key, word, offset, size)
+												   for key, _, word, offset, size in entries_of_dictionary))
+		_forget_entries_readers(dictionary_name)
+		with _writer() as connection:
+			connection.execute('''insert into dictionaries (name, num_entries) values (?, ?)
+				on conflict (name) do update set num_entries = excluded.num_entries''', (dictionary_name, num_entries))
+			connection.commit()
+		num_rows += num_entries
+	return num_rows
+
+
+def _encode_postings(postings: array) -> bytes:
+	if sys.byteorder != 'little':
+		postings = array(_POSTING_TYPECODE, postings)
+		postings.byteswap()
+	return postings.tobytes()
+
+
+def _decode_postings(blob: bytes) -> array:
+	postings = array(_POSTING_TYPECODE)
+	postings.frombytes(blob)
+	if sys.byteorder != 'little':
+		postings.byteswap()
+	return postings
+
+
+def _write_ngram_run(postings_of_ngrams: dict[str, array]) -> str:
+	"""
+	Dumps the in-memory postings, sorted by ngram, to a temporary file and returns its path.
+	Record layout: ngram length (2 bytes), ngram (UTF-8), number of postings (4 bytes), postings.
+	"""
+	fd, run_filename = tempfile.mkstemp(prefix='ngrams_', suffix='.run', dir=Settings.APP_RESOURCES_ROOT)
+	with os.fdopen(fd, 'wb') as f:
+		for ngram in sorted(postings_of_ngrams.keys()):
+			ngram_encoded = ngram.encode('utf-8')
+			postings = postings_of_ngrams[ngram]
+			f.write(struct.pack('<HI', len(ngram_encoded), len(postings)))
+			f.write(ngram_encoded)
+			f.write(_encode_postings(postings))
+	return run_filename
+
+
+def _read_ngram_run(run_filename: str) -> Generator[tuple[str, bytes], None, None]:
+	with open(run_filename, 'rb') as f:
+		while header := f.read(6):
+			ngram_length, num_postings = struct.unpack('<HI', header)
+			ngram = f.read(ngram_length).decode('utf-8')
+			yield ngram, f.read(num_postings * _POSTING_ITEMSIZE)
+
+
+def _merge_ngram_runs(run_filenames: list[str]) -> Generator[tuple[str, bytes], None, None]:
+	"""
+	k-way merges the sorted runs and yields every ngram once with its complete postings.
+	Runs are produced in key order, so concatenating the postings of an ngram in run order keeps them sorted.
+	heapq.merge() is stable, i.e. equal ngrams come out in the order of the runs.
+	"""
+	runs = [_read_ngram_run(run_filename) for run_filename in run_filenames]
+	for ngram, group in groupby(heapq.merge(*runs, key=lambda record: record[0]), key=lambda record: record[0]):
+		yield ngram, b''.join(postings for _, postings in group)
+
+
+def _set_ngram_table_progress(**kwargs) -> None:
+	_ngram_table_progress.update(kwargs)
+
+
+def ngram_table_progress() -> dict[str, str | int | bool]:
+	"""
+	Returns the state of the (last) ngram table build: running, stage, processed, total.
+	"""
+	return dict(_ngram_table_progress)
+
+
+def _count_keys(names_dictionaries: list[str]) -> int:
+	"""
+	Sums the numbers of distinct keys of the dictionaries, which is at least that of their union.
+	"""
+	num_keys = 0
+	with _entries_readers_of(names_dictionaries) as cursors:
+		for _, cursor in cursors:
+			num_keys += cursor.execute('select count(distinct key) from entries').fetchone()[0]
+	return num_keys
+
+
+def _distinct_keys(names_dictionaries: list[str]) -> Generator[str, None, None]:
+	"""
+	Yields the distinct keys of all the dictionaries, sorted.
+	The index on key makes each of them a sorted scan, and the scans are merged.
+	"""
+	with _entries_readers_of(names_dictionaries) as cursors:
+		for (key,), _ in groupby(heapq.merge(*(cursor.execute('select distinct key from entries order by key')
+											   for _, cursor in cursors))):
+			yield key
 
 
-def add_entry(key: str,
-			  dictionary_name: str,
-			  word: str,
-			  offset: int,
-			  size: int) -> None:
-	"Commit manually!"
-	cursor = get_cursor()
-	cursor.execute('insert into entries values (?, ?, ?, ?, ?)', (key, dictionary_name, word, offset, size))
+def _create_ngram_table_storing_keys(cursor: sqlite3.Cursor) -> None:
+	cursor.execute('drop table if exists ngrams_new')
+	cursor.execute('create table ngrams_new (ngram text, idxs text)')
+	names_dictionaries = _names_of_dictionaries(cursor)
+	num_keys = _count_keys(names_dictionaries)
+	_set_ngram_table_progress(stage='indexing keys', processed=0, total=num_keys)
 
+	def ngram_key_pairs() -> Generator[tuple[str, str], None, None]:
+		for i, key in enumerate(_distinct_keys(names_dictionaries), 1):
+			for ngram in set(_gen_ngrams(key, Settings.NGRAM_LEN)):
+				yield ngram, key
+			if i % _NGRAM_PROGRESS_INTERVAL == 0:
+				_set_ngram_table_progress(processed=i)
 
-def commit() -> None:
-	get_connection().commit()
+	for batch in _batched(ngram_key_pairs(), _INGESTION_BATCH_SIZE):
+		cursor.executemany('insert into ngrams_new (ngram, idxs) values (?, ?)', batch)
+	_set_ngram_table_progress(stage='creating index', processed=num_keys)
+	cursor.execute('create index ngrams_new_ngram on ngrams_new (ngram)')
+
+
+def _create_ngram_table_with_postings(cursor: sqlite3.Cursor) -> None:
+	"""
+	Walks the distinct keys in order, numbering them in ngram_keys, and aggregates the numbers into
+	one posting list per ngram in memory (spilling sorted runs to disk when there are too many postings).
+	Each ngram is then written once, its postings being a sorted array('I') blob.
+	"""
+	cursor.execute('drop table if exists ngrams_new')
+	cursor.execute('drop table if exists ngram_keys_new')
+	cursor.execute('create table ngrams_new (ngram text primary key, idxs blob) without rowid')
+	cursor.execute('create table ngram_keys_new (key text)')
+	names_dictionaries = _names_of_dictionaries(cursor)
+	num_keys = _count_keys(names_dictionaries)
+	_set_ngram_table_progress(stage='collecting ngrams', processed=0, total=num_keys)
+
+	postings_of_ngrams: dict[str, array] = dict()
+	num_postings_in_memory = 0
+	run_filenames = []
+	keys_to_write = []
+	try:
+		# Key ids are assigned in key order, so postings are sorted
+		for key_id, key in enumerate(_distinct_keys(names_dictionaries), 1):
+			keys_to_write.append((key_id, key))
+			if len(keys_to_write) >= _INGESTION_BATCH_SIZE:
+				cursor.executemany('insert into ngram_keys_new (rowid, key) values (?, ?)', keys_to_write)
+				keys_to_write.clear()
+			for ngram in set(_gen_ngrams(key, Settings.NGRAM_LEN)):
+				if (postings := postings_of_ngrams.get(ngram)) is None:
+					postings = postings_of_ngrams[ngram] = array(_POSTING_TYPECODE)
+				postings.append(key_id)
+				num_postings_in_memory += 1
+			if num_postings_in_memory >= _NGRAM_MAX_POSTINGS_IN_MEMORY:
+				run_filenames.append(_write_ngram_run(postings_of_ngrams))
+				postings_of_ngrams.clear()
+				num_postings_in_memory = 0
+			if key_id % _NGRAM_PROGRESS_INTERVAL == 0:
+				_set_ngram_table_progress(processed=key_id)
+		cursor.executemany('insert into ngram_keys_new (rowid, key) values (?, ?)', keys_to_write)
+
+		if run_filenames:
+			if postings_of_ngrams:
+				run_filenames.append(_write_ngram_run(postings_of_ngrams))
+				postings_of_ngrams.clear()
+			ngrams = _merge_ngram_runs(run_filenames)
+			num_ngrams_total = None # unknown until the runs are merged
+		else:
+			ngrams = ((ngram, _encode_postings(postings_of_ngrams[ngram]))
+					  for ngram in sorted(postings_of_ngrams.keys()))
+			num_ngrams_total = len(postings_of_ngrams)
+
+		_set_ngram_table_progress(stage='writing ngrams', processed=0, total=num_ngrams_total)
+		num_ngrams = 0
+		for batch in _batched(ngrams, _INGESTION_BATCH_SIZE):
+			cursor.executemany('insert into ngrams_new (ngram, idxs) values (?, ?)', batch)
+			num_ngrams += len(batch)
+			_set_ngram_table_progress(processed=num_ngrams)
+	finally:
+		for run_filename in run_filenames:
+			os.remove(run_filename)
 
 
 def create_ngram_table(stores_keys: bool) -> None:
-	cursor = get_cursor()
-	cursor.execute('drop index if exists ngrams_ngram')
-	cursor.execute('drop table if exists ngrams')
-	cursor.execute('create table ngrams (ngram text, idxs text)')
-	cursor.execute('create index ngrams_ngram on ngrams (ngram)')
-
-	if stores_keys:
-		rows = cursor.execute('select distinct key from entries')
-
-		# Get another cursor for the ngrams table
-		c1 = get_connection().cursor()
-		for row in rows:
-			key = row[0]
-			if len(key) >= Settings.NGRAM_LEN:
-				ngrams = _gen_ngrams(key, Settings.NGRAM_LEN)
-				for ngram in ngrams:
-					c1.execute('insert into ngrams (ngram, idxs) values (?, ?)', (ngram, key))
-	else:
-		# Walk the whole entries table. For each row, generate ngrams from the key, and either create a row
-		# in the ngrams table, with the ngram and rowid, or append the rowid to an existing ngram record
-		# This is relatively slow (maybe 1/2 hour for a 5 million entries dict on a laptop).
-		rows = cursor.execute('select key, rowid from entries')
-
-		# Get another cursor for the ngrams table
-		c1 = get_connection().cursor()
-		for row in rows:
-			key = row[0]
-			rowid = str(row[1])
-			if len(key) >= Settings.NGRAM_LEN:
-				ngrams = _gen_ngrams(key, Settings.NGRAM_LEN)
-				for ngram in ngrams:
-					c1.execute('select idxs from ngrams where ngram = ?', (ngram,))
-					row = c1.fetchone()
-					if row:
-						idxs = row[0]
-						idxs += "," + rowid
-						c1.execute('update ngrams set idxs = ? where ngram = ?', (idxs, ngram))
-					else:
-						c1.execute('insert into ngrams (idxs, ngram) values (?, ?)', (rowid, ngram))
-
-	get_connection().commit()
+	"""
+	(Re)builds the ngram table that backs 'contains' suggestions.
+	The new table is built alongside the old one, which is only replaced at the end,
+	so that both-sides suggestions keep working in the meantime.
+	Progress can be followed with ngram_table_progress() from other threads.
+	"""
+	if not _ngram_table_lock.acquire(blocking=False):
+		raise RuntimeError('The ngram table is being built.')
+	try:
+		with _writer() as connection:
+			_create_ngram_table(connection, stores_keys)
+	finally:
+		_set_ngram_table_progress(running=False)
+		_ngram_table_lock.release()
+
+
+def _create_ngram_table(connection: sqlite3.Connection, stores_keys: bool) -> None:
+	cursor = connection.cursor()
+	try:
+		_set_ngram_table_progress(running=True, stage='starting', processed=0, total=None)
+		if stores_keys:
+			_create_ngram_table_storing_keys(cursor)
+		else:
+			_create_ngram_table_with_postings(cursor)
+		cursor.execute('drop index if exists ngrams_ngram')
+		cursor.execute('drop table if exists ngrams')
+		cursor.execute('drop table if exists ngram_keys')
+		cursor.execute('alter table ngrams_new rename to ngrams')
+		if stores_keys:
+			cursor.execute('drop index ngrams_new_ngram')
+			cursor.execute('create index ngrams_ngram on ngrams (ngram)')
+		else:
+			cursor.execute('alter table ngram_keys_new rename to ngram_keys')
+		connection.commit()
+		_set_ngram_table_progress(stage='done')
+	except Exception:
+		connection.rollback()
+		_set_ngram_table_progress(stage='failed')
+		raise
 
 
 def get_entries(key: str, dictionary_name: str) -> list[tuple[str, int, int]]:
 	"""
 	Returns a list of (word, offset, size).
 	"""
-	cursor = get_cursor()
-	cursor.execute('select word, offset, size from entries where key = ? and dictionary_name = ?',
-				   (key, dictionary_name))
-	return cursor.fetchall()
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return []
+		cursor.execute(f'select {_WORD}, offset, size from entries where key = ?', (key,))
+		return cursor.fetchall()
+
+
+def get_entries_of_keys(keys: list[str], names_dictionaries: list[str]) -> list[tuple[str, str, str, int, int]]:
+	"""
+	Returns a list of (dictionary_name, key, word, offset, size) for all the keys in all the dictionaries,
+	with a single query per dictionary.
+	"""
+	entries = []
+	for dictionary_name in names_dictionaries:
+		with _entries_reader(dictionary_name) as cursor:
+			if cursor is None:
+				continue
+			cursor.execute(
+				'''select e.key, coalesce(e.word, e.key), e.offset, e.size
+					from json_each(?) k cross join entries e
+					where e.key = k.value''',
+				(json.dumps(keys),))
+			entries.extend((dictionary_name, *row) for row in cursor)
+	return entries
+
+
+def get_entries_with_headword_of_dictionaries(word: str,
+											  names_dictionaries: list[str]) -> list[tuple[str, int, int]]:
+	"""
+	Returns a list of (dictionary_name, offset, size) for the headword in all the dictionaries.
+	"""
+	entries = []
+	for dictionary_name in names_dictionaries:
+		with _entries_reader(dictionary_name) as cursor:
+			if cursor is None:
+				continue
+			cursor.execute(f'select offset, size from entries where {_WORD} = ?', (word,))
+			entries.extend((dictionary_name, *row) for row in cursor)
+	return entries
+
+
+def get_entries_with_headwords_of_dictionaries(words: list[str],
+											   names_dictionaries: list[str]) -> list[tuple[str, str, int, int]]:
+	"""
+	Returns a list of (dictionary_name, word, offset, size) for all the headwords in all the dictionaries,
+	with a single query per dictionary.
+	"""
+	entries = []
+	for dictionary_name in names_dictionaries:
+		with _entries_reader(dictionary_name) as cursor:
+			if cursor is None:
+				continue
+			cursor.execute(
+				'''select k.value, e.offset, e.size
+					from json_each(?) k cross join entries e
+					where coalesce(e.word, e.key) = k.value''',
+				(json.dumps(words),))
+			entries.extend((dictionary_name, *row) for row in cursor)
+	return entries
 
 
 def headword_count_of_dictionary(dictionary_name: str) -> int:
-	cursor = get_cursor()
-	cursor.execute('select count(*) from entries where dictionary_name = ?', (dictionary_name,))
-	return cursor.fetchone()[0]
+	with _reader() as cursor:
+		row = cursor.execute('select num_entries from dictionaries where name = ?', (dictionary_name,)).fetchone()
+		return row[0] if row else 0
 
 
 def get_entries_with_headword(word: str, dictionary_name: str) -> list[tuple[int, int]]:
 	"""
 	Returns a list of (offset, size)
 	"""
-	cursor = get_cursor()
-	cursor.execute('select offset, size from entries where word = ? and dictionary_name = ?',
-				   (word, dictionary_name))
-	return cursor.fetchall()
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return []
+		cursor.execute(f'select offset, size from entries where {_WORD} = ?', (word,))
+		return cursor.fetchall()
 
 
 def get_entries_all(dictionary_name: str) -> list[tuple[str, str, int, int]]:
 	"""
 	Returns a list of (key, word, offset, size).
 	"""
-	cursor = get_cursor()
-	cursor.execute('select key, word, offset, size from entries where dictionary_name = ? order by offset',
-				   (dictionary_name,))
-	return cursor.fetchall()
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return []
+		cursor.execute(f'select key, {_WORD}, offset, size from entries order by offset')
+		return cursor.fetchall()
 
 
-def delete_dictionary(dictionary_name: str) -> None:
-	cursor = get_cursor()
-	cursor.execute('delete from entries where dictionary_name = ?', (dictionary_name,))
-	get_connection().commit()
+def get_keys_and_words(dictionary_name: str) -> Generator[tuple[str, str], None, None]:
+	"""
+	Yields the distinct (key, word) of a dictionary, sorted.
+	"""
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return
+		yield from cursor.execute(f'select distinct key, {_WORD} from entries order by key, {_WORD}')
 
 
-def create_index() -> None:
-	cursor = get_cursor()
-	# cursor.execute('create index idx_dictname on entries (dictionary_name)') # This helps with dictionary_exists()
-	cursor.execute('create index idx_key_dictname on entries (key, dictionary_name)')
-	# cursor.execute('create index idx_key on entries (key)')
-	# cursor.execute('create index idx_key_dictname_word on entries (key, dictionary_name, word)')
-	cursor.execute('create index idx_word_dictname on entries (word, dictionary_name)')
+def delete_dictionary(dictionary_name: str) -> None:
+	"""
+	Unregisters the dictionary and removes the database of its entries.
+	"""
+	with _writer() as connection:
+		connection.execute('delete from dictionaries where name = ?', (dictionary_name,))
+		connection.commit()
+	_forget_entries_readers(dictionary_name) # so that the idle connections are closed first (on Windows)
+	try:
+		os.remove(_entries_filename(dictionary_name))
+	except FileNotFoundError:
+		pass
+	except PermissionError: # still open on Windows, it will be replaced when the dictionary is indexed again
+		logger.warning(f'Could not remove the database of the entries of {dictionary_name}.')
+	_forget_entries_readers(dictionary_name) # in case a query has opened it in the meantime
 
 
-def drop_index() -> None:
-	cursor = get_cursor()
-	# For backwards compatibility
-	cursor.execute('drop index if exists idx_dictname')
-	cursor.execute('drop index if exists idx_key_dictname_word')
-	cursor.execute('drop index if exists idx_key')
-	####
-	cursor.execute('drop index if exists idx_key_dictname')
-	cursor.execute('drop index if exists idx_word_dictname')
+def select_words_of_dictionary(dictionary_name: str) -> list[str]:
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return []
+		cursor.execute(f'select distinct {_WORD} from entries')
+		return [row[0] for row in cursor.fetchall()]
 
 
-def select_words_of_dictionary(dictionary_name: str) -> list[str]:
-	cursor = get_cursor()
-	cursor.execute('select distinct word from entries where dictionary_name = ?', (dictionary_name,))
-	return [row[0] for row in cursor.fetchall()]
+def _disjoint_prefixes(keys: list[str]) -> list[str]:
+	"""
+	Sorts the prefixes and drops those within the range of another one (e.g. 'abc' if 'ab' is there).
+	"""
+	prefixes = []
+	for key in sorted(set(keys)):
+		if not prefixes or not key.startswith(prefixes[-1]):
+			prefixes.append(key)
+	return prefixes
+
+
+# One range of idx_key_word per prefix, in ascending order. The order by is that of the index, so it costs no sort
+# and the scan can stop at any time. The same statements whatever the words to exclude, prepared once per connection.
+_STATEMENTS_ENTRIES_BEGINNING_WITH = {
+	inclusive: f'''select key, {_WORD} from entries
+		where key {'>=' if inclusive else '>'} ?1 and key < ?2
+		and {_WORD} not in (select value from json_each(?3))
+		order by key'''
+	for inclusive in (True, False)
+}
+
+
+def _rows_beginning_with(cursor: sqlite3.Cursor,
+						 ranges: list[tuple[str, bool, str]],
+						 words_already_found: str) -> Iterator[tuple[str, str]]:
+	"""
+	The (key, word) rows in the ranges (lower bound, whether inclusive, upper bound), one after the other.
+	"""
+	for lower_bound, inclusive, upper_bound in ranges:
+		yield from cursor.execute(_STATEMENTS_ENTRIES_BEGINNING_WITH[inclusive],
+								  (lower_bound, upper_bound, words_already_found))
 
 
 def select_entries_beginning_with(keys: list[str],
 								  names_dictionaries: list[str],
 								  words_already_found: list[str],
-								  limit: int) -> list[str]:
+								  limit: int,
+								  after: str | None = None,
+								  with_keys: bool = False) -> list[str] | list[tuple[str, str]]:
 	"""
-	Return the first ten entries (word) in the dictionaries that begin with the given keys.
-	"""
-	limit -= len(words_already_found)
-	cursor = get_cursor()
-	result = []
-	for key in keys:
-		cursor.execute(
-			f'''select distinct word from entries
-				where key >= ? and key < ?
-				and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-				and word not in ({','.join('?' * len(words_already_found))})
-				order by key
-				limit ?''',
-			(key, key + '\U0003134A', *names_dictionaries, *words_already_found, limit))
-		result.extend([row[0] for row in cursor.fetchall()])
-		limit = limit - len(result)
-		if limit <= 0:
-			break
-	return result
+	Return the first limit - len(words_already_found) entries (word) in the dictionaries
+	that begin with any of the given keys, in key order.
+	For keyset pagination, after is the key of the last entry of the previous page, possibly empty:
+	only entries with greater keys are returned. A page never ends in the middle of the words sharing a key.
+	With with_keys, the distinct (key, word) of the page are returned instead, in key order.
+	"""
+	num_words = limit - len(words_already_found)
+	if num_words <= 0 or not keys:
+		return []
+	ranges = []
+	for prefix in _disjoint_prefixes(keys):
+		upper_bound = prefix + '\U0003134A'
+		if after is not None and after >= upper_bound:
+			continue
+		if after is not None and after >= prefix:
+			ranges.append((after, False, upper_bound))
+		else:
+			ranges.append((prefix, True, upper_bound))
+	if not ranges:
+		return []
+	words_already_found = json.dumps(words_already_found)
+	with _entries_readers_of(names_dictionaries) as cursors:
+		words = dict() # insertion-ordered set
+		keys_and_words = dict()
+		last_key = None
+		for key, word in _merge_rows([_rows_beginning_with(cursor, ranges, words_already_found)
+									  for _, cursor in cursors]):
+			if len(words) >= num_words and key != last_key:
+				break
+			words[word] = None
+			if with_keys:
+				keys_and_words[(key, word)] = None
+			last_key = key
+		return list(keys_and_words) if with_keys else list(words)
 
 
 def select_entries_containing(key: str,
@@ -230,115 +898,324 @@ def select_entries_containing(key: str,
 	Return the first num_suggestions - len(words_already_found) entries (word)
 	in the dictionaries that contain key.
 	"""
-	num_words = limit - len(words_already_found)
-	cursor = get_cursor()
-	cursor.execute(
-		f'''select distinct word from entries
-			where key like ?
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-			and word not in ({','.join('?' * len(words_already_found))})
-			order by key
-			limit ?''',
-		(f'%{key}%', *names_dictionaries, *words_already_found, num_words))
-	return [row[0] for row in cursor.fetchall()]
-
-
-def expand_key(input: str, stores_keys: bool) -> list[str]:
-	ngrams = _gen_ngrams(input, Settings.NGRAM_LEN)
-	if len(ngrams) == 0:
-		return []
+	with _entries_readers_of(names_dictionaries) as cursors:
+		return _first_words([cursor.execute(f'''select key, {_WORD} from entries
+								where key like ?
+								and {_WORD} not in (select value from json_each(?))
+								order by key''', (f'%{key}%', json.dumps(words_already_found)))
+							 for _, cursor in cursors],
+							limit - len(words_already_found))
 
-	cursor = get_cursor()
-	statement = f'select idxs from ngrams where ngram in ({",".join("?" * len(ngrams))})'
-	rows = cursor.execute(statement, ngrams)
 
-	if stores_keys:
-		selected_keys = list(set((row[0] for row in rows)))
-		selected_keys = [key for key in selected_keys if key.find(input) != -1]
-		if len(selected_keys) > Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
-			selected_keys = selected_keys[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
-	else:
-		# Intersect the lists yielded by the different ngrams
-		selected_idxs = None
-		for row in rows:
-			if selected_idxs is None:
-				selected_idxs = set(row[0].split(','))
-			else:
-				selected_idxs = selected_idxs & set(row[0].split(','))
-
-		if not selected_idxs:
-			return []
+def _intersect_postings(postings_lists: list[array]) -> Generator[int, None, None]:
+	"""
+	Lazily yields the ids common to all the sorted posting lists, in ascending order.
+	The rarest list is walked and the others are binary-searched from where the previous search stopped,
+	so the cost depends on the length of the rarest list, not on that of the most common ngram.
+	"""
+	postings_lists = sorted(postings_lists, key=len)
+	rarest, others = postings_lists[0], postings_lists[1:]
+	positions = [0] * len(others)
+	for idx in rarest:
+		for i, postings in enumerate(others):
+			position = bisect_left(postings, idx, positions[i])
+			if position == len(postings):
+				return
+			positions[i] = position
+			if postings[position] != idx:
+				break
+		else:
+			yield idx
+
+
+def _expand_key_with_postings(cursor: sqlite3.Cursor,
+							  input: str,
+							  postings_lists: list[array],
+							  names_dictionaries: list[str] | None,
+							  words_already_found: list[str],
+							  limit: int | None) -> list[str]:
+	"""
+	Key ids follow key order, so the intersection yields candidate keys in the order suggestions are sorted in.
+	Candidates are verified in chunks, and the walk stops as soon as the verified keys carry enough new words
+	for select_entries_with_keys(), which therefore returns exactly what it would with all candidate keys.
+	"""
+	num_words = None if limit is None else limit - len(words_already_found)
+	words_already_found = set(words_already_found)
+	words_selected = set()
+	selected_keys = []
+	verifies_keys = names_dictionaries is not None and num_words is not None
+	with _entries_readers_of(names_dictionaries if verifies_keys else []) as entries_cursors:
+		for chunk in _batched(_intersect_postings(postings_lists), _NGRAM_VERIFICATION_CHUNK_SIZE):
+			statement = f'select key from ngram_keys where rowid in ({",".join("?" * len(chunk))}) order by rowid'
+			# Only select the keys where the input is found (ngrams contiguous in the right order)
+			keys = [row[0] for row in cursor.execute(statement, chunk) if row[0].find(input) != -1]
+			if not verifies_keys:
+				selected_keys.extend(keys)
+			elif keys:
+				# The ngram table is global, so check that the keys are in the group and yield words not shown yet
+				words_of_keys: dict[str, set[str]] = dict()
+				for _, entries_cursor in entries_cursors:
+					for key, word in entries_cursor.execute(
+						f'select key, {_WORD} from entries where key in (select value from json_each(?))',
+						(json.dumps(keys),)):
+						if word not in words_already_found:
+							words_of_keys.setdefault(key, set()).add(word)
+				for key in keys:
+					if key in words_of_keys:
+						selected_keys.append(key)
+						words_selected.update(words_of_keys[key])
+						if len(words_selected) >= num_words:
+							return selected_keys
+			if len(selected_keys) >= Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
+				return selected_keys[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
+	return selected_keys
 
-		if len(selected_idxs) > Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
-			selected_idxs = list(selected_idxs)[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
-		# Get the keys corresponding to the selected rowids
-		statement = f'select key from entries where rowid in ({",".join("?" * len(selected_idxs))})'
-		rows = cursor.execute(statement, [int(idx) for idx in selected_idxs])
-		selected_keys = [row[0] for row in rows]
 
-		# Only select the keys where the input is found (ngrams contiguous in the right order)
-		# Actually this usually filters nothing
-		selected_keys = [key for key in selected_keys if key.find(input) != -1]
+def expand_key(input: str,
+			   stores_keys: bool,
+			   names_dictionaries: list[str] | None = None,
+			   words_already_found: list[str] | None = None,
+			   limit: int | None = None) -> list[str]:
+	"""
+	Returns keys that contain input, to be passed to select_entries_with_keys().
+	If names_dictionaries and limit are given, stops as soon as the keys returned are enough
+	for select_entries_with_keys() with the same arguments.
+	"""
+	ngrams = list(dict.fromkeys(_gen_ngrams(input, Settings.NGRAM_LEN)))
+	if len(ngrams) == 0:
+		return []
 
-	return selected_keys
+	with _reader() as cursor:
+		if not _table_exists(cursor, 'ngrams'): # dropped by a migration, until it is recreated
+			return []
+		statement = f'select idxs from ngrams where ngram in ({",".join("?" * len(ngrams))})'
+		rows = cursor.execute(statement, ngrams)
+
+		if stores_keys:
+			selected_keys = list(set((row[0] for row in rows)))
+			selected_keys = [key for key in selected_keys if key.find(input) != -1]
+			if len(selected_keys) > Settings.SQLITE_LIMIT_VARIABLE_NUMBER:
+				selected_keys = selected_keys[:Settings.SQLITE_LIMIT_VARIABLE_NUMBER]
+			return selected_keys
+
+		rows = rows.fetchall()
+		if len(rows) < len(ngrams): # some ngram occurs in no key at all
+			return []
+		return _expand_key_with_postings(cursor,
+										 input,
+										 [_decode_postings(row[0]) for row in rows],
+										 names_dictionaries,
+										 words_already_found or [],
+										 limit)
 
 
 def select_entries_with_keys(keys: list[str],
 							 names_dictionaries: list[str],
 							 words_already_found: list[str],
 							 limit: int) -> list[str]:
-	num_words = limit - len(words_already_found)
-	cursor = get_cursor()
-	cursor.execute(
-		f'''select distinct word from entries
-			where key in ({','.join('?' * len(keys))})
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-			and word not in ({','.join('?' * len(words_already_found))})
-			order by key
-			limit ?''',
-		(*keys, *names_dictionaries, *words_already_found, num_words))
-	return [row[0] for row in cursor.fetchall()]
+	with _entries_readers_of(names_dictionaries) as cursors:
+		return _first_words([cursor.execute(f'''select key, {_WORD} from entries
+								where key in (select value from json_each(?))
+								and {_WORD} not in (select value from json_each(?))
+								order by key''', (json.dumps(keys), json.dumps(words_already_found)))
+							 for _, cursor in cursors],
+							limit - len(words_already_found))
+
+
+def set_fts_enabled(enabled: bool) -> None:
+	"""
+	Sets whether the databases built by add_entries() get the FTS5 index, leaving those of other dictionaries alone:
+	for the processes indexing new dictionaries, the main process having created or dropped the others' already.
+	"""
+	global _fts_enabled
+	_fts_enabled = enabled
 
 
-def select_entries_like(key: str, names_dictionaries: list[str], limit: int) -> list[str]:
+def create_fts_table() -> None:
+	"""
+	Creates the FTS5 trigram index of the keys that backs 'contains' suggestions in both-sides-fts mode
+	in the database of every dictionary, where it does not exist yet.
+	It indexes the keys stored in entries (external content) by rowid.
+	Databases built afterwards by add_entries() get one too.
+	"""
+	set_fts_enabled(True)
+
+	def create(cursor: sqlite3.Cursor) -> None:
+		if not _table_exists(cursor, 'entries_fts'):
+			_create_fts_table(cursor)
+
+	_update_entries_databases(create)
+
+
+def drop_fts_table() -> None:
+	set_fts_enabled(False)
+
+	def drop(cursor: sqlite3.Cursor) -> None:
+		if _table_exists(cursor, 'entries_fts'):
+			cursor.execute('drop table entries_fts')
+
+	_update_entries_databases(drop)
+
+
+def select_entries_containing_fts(key: str,
+								  names_dictionaries: list[str],
+								  words_already_found: list[str],
+								  limit: int) -> list[str]:
+	"""
+	Same as select_entries_containing(), with the FTS5 trigram index for keys of three characters or more.
+	"""
+	if len(key) < 3:
+		return select_entries_containing(key, names_dictionaries, words_already_found, limit)
+	with _entries_readers_of(names_dictionaries) as cursors:
+		return _first_words([cursor.execute('''select e.key, coalesce(e.word, e.key)
+								from entries_fts f cross join entries e on e.rowid = f.rowid
+								where f.key like ?
+								and coalesce(e.word, e.key) not in (select value from json_each(?))
+								order by e.key''', (f'%{key}%', json.dumps(words_already_found)))
+							 for _, cursor in cursors],
+							limit - len(words_already_found))
+
+
+def _ngram_table_exists() -> bool:
+	with _reader() as cursor:
+		return _table_exists(cursor, 'ngrams')
+
+
+def select_entries_like(key: str,
+						names_dictionaries: list[str],
+						limit: int,
+						stores_keys: bool | None = None) -> list[str]:
 	"""
 	Return the first ten entries matched.
+	The literal prefix of the pattern, if any, becomes a range on idx_key_word,
+	the whole pattern only filtering the keys within it.
+	Otherwise, if stores_keys is given (i.e. the ngram table is in use), the candidates are the keys
+	containing the longest literal part of the pattern, provided it is long enough for the ngrams.
 	"""
-	cursor = get_cursor()
-	cursor.execute(
-		f'''select distinct word from entries
-			where key like ?
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-			order by key
-			limit ?''',
-		(key, *names_dictionaries, limit))
-	return [row[0] for row in cursor.fetchall()]
+	literals = re.split('[%_]', key)
+	longest_literal = max(literals, key=len)
+	candidate_keys = None
+	if not literals[0] and stores_keys is not None and len(longest_literal) >= Settings.NGRAM_LEN\
+		and _ngram_table_exists():
+		candidate_keys = expand_key(longest_literal, stores_keys)
+		if len(candidate_keys) >= Settings.SQLITE_LIMIT_VARIABLE_NUMBER: # possibly truncated
+			candidate_keys = None
+
+	if literals[0]:
+		condition = 'key >= ? and key < ? and key like ?'
+		parameters = (literals[0], literals[0] + '\U0003134A', key)
+	elif candidate_keys is not None:
+		condition = 'key in (select value from json_each(?)) and key like ?'
+		parameters = (json.dumps(candidate_keys), key)
+	else:
+		condition = 'key like ?'
+		parameters = (key,)
+	with _entries_readers_of(names_dictionaries) as cursors:
+		return _first_words([cursor.execute(f'select key, {_WORD} from entries where {condition} order by key',
+											parameters)
+							 for _, cursor in cursors],
+							limit)
 
 
 def entry_exists_in_dictionary(key: str, dictionary_name: str) -> bool:
-	cursor = get_cursor()
-	# cursor.execute('select count(*) from entries where key = ? and dictionary_name = ?', (key, dictionary_name))
-	# return cursor.fetchone()[0] > 0
-	cursor.execute('select key from entries where key = ? and dictionary_name = ? limit 1',
-				   (key, dictionary_name))
-	return cursor.fetchone() is not None
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return False
+		cursor.execute('select 1 from entries where key = ? limit 1', (key,))
+		return cursor.fetchone() is not None
 
 
 def headword_exists_in_dictionary(word: str, dictionary_name: str) -> bool:
-	cursor = get_cursor()
-	cursor.execute('select word from entries where word = ? and dictionary_name = ? limit 1',
-				   (word, dictionary_name))
-	return cursor.fetchone() is not None
+	with _entries_reader(dictionary_name) as cursor:
+		if cursor is None:
+			return False
+		cursor.execute(f'select 1 from entries where {_WORD} = ? limit 1', (word,))
+		return cursor.fetchone() is not None
 
 
 def entry_exists_in_dictionaries(key: str, names_dictionaries: list[str]) -> bool:
-	cursor = get_cursor()
-	# cursor.execute('select count(*) from entries where key = ? and dictionary_name in (%s)' % ','.join('?' * len(names_dictionaries)), (key, *names_dictionaries))
-	# return cursor.fetchone()[0] > 0
-	cursor.execute(
-		f'''select key from entries
-			where key = ?
-			and dictionary_name in ({','.join('?' * len(names_dictionaries))})
-			limit 1''',
-		(key, *names_dictionaries))
-	return cursor.fetchone() is not None
+	return any(entry_exists_in_dictionary(key, dictionary_name) for dictionary_name in names_dictionaries)
+
+
+_maintenance_lock = threading.Lock()
+
+
+def _database_statistics(cursor: sqlite3.Cursor) -> dict[str, int]:
+	return {pragma: cursor.execute(f'pragma {pragma}').fetchone()[0]
+			for pragma in ('page_size', 'page_count', 'freelist_count')}
+
+
+def _maintain_database(writer: Callable[[], ContextManager[sqlite3.Connection]]) -> dict:
+	"""
+	Every step takes the writer on its own, and the free pages are given back
+	SQLITE_VACUUM_STEP_PAGES at a time, so that other writes are never held up for long.
+	Readers are not blocked in WAL mode, and only during the short commits otherwise.
+	"""
+	report = {'times': dict()}
+
+	def run_step(step: str, statement: str) -> list[tuple]:
+		start = time.perf_counter()
+		with writer() as connection:
+			rows = connection.execute(statement).fetchall()
+			connection.commit()
+		report['times'][step] = round(time.perf_counter() - start, 3)
+		return rows
+
+	with writer() as connection:
+		report['before'] = _database_statistics(connection.cursor())
+		auto_vacuum = connection.execute('pragma auto_vacuum').fetchone()[0]
+		journal_mode = connection.execute('pragma journal_mode').fetchone()[0]
+
+	run_step('analyze', 'analyze')
+	run_step('optimize', 'pragma optimize')
+	if auto_vacuum == 2: # incremental
+		start = time.perf_counter()
+		num_steps = 0
+		while True:
+			with writer() as connection:
+				if connection.execute('pragma freelist_count').fetchone()[0] == 0:
+					break
+				# Frees one page per step of the statement, which execute() would only take once
+				connection.executescript(f'pragma incremental_vacuum({Settings.SQLITE_VACUUM_STEP_PAGES})')
+			num_steps += 1
+			time.sleep(Settings.SQLITE_VACUUM_STEP_PAUSE)
+		report['times']['incremental_vacuum'] = round(time.perf_counter() - start, 3)
+		report['incremental_vacuum_steps'] = num_steps
+	elif report['before']['freelist_count'] > 0:
+		# Created before auto_vacuum was enabled: rebuilt once by a full vacuum, which also enables it
+		with writer() as connection:
+			connection.execute('pragma auto_vacuum = INCREMENTAL')
+		run_step('vacuum', 'vacuum')
+	if journal_mode == 'wal':
+		report['checkpoint'] = run_step('checkpoint', 'pragma wal_checkpoint(truncate)')[0]
+	report['integrity'] = [row[0] for row in run_step('quick_check', 'pragma quick_check')]
+
+	with writer() as connection:
+		report['after'] = _database_statistics(connection.cursor())
+		try:
+			report['sizes'] = dict(connection.execute('select name, sum(pgsize) from dbstat group by name').fetchall())
+		except sqlite3.OperationalError: # SQLite built without the dbstat virtual table
+			report['sizes'] = None
+	return report
+
+
+def maintain() -> dict:
+	"""
+	Runs ANALYZE and PRAGMA optimize on the shared database and on the database of every dictionary,
+	gives their free pages back with an incremental vacuum, and checks them with PRAGMA quick_check.
+	Returns a report per database: page statistics before and after, sizes of the tables and indexes,
+	result of the check and time taken by each step.
+	"""
+	if not _maintenance_lock.acquire(blocking=False):
+		raise RuntimeError('The database is being maintained.')
+	try:
+		start = time.perf_counter()
+		report = {'shared': _maintain_database(_writer), 'dictionaries': dict()}
+		for dictionary_name in _indexed_dictionaries():
+			report['dictionaries'][dictionary_name] =\
+				_maintain_database(lambda dictionary_name=dictionary_name: _entries_writer(dictionary_name))
+		report['time'] = round(time.perf_counter() - start, 3)
+		logger.info(f'Database maintained in {report["time"]} seconds.')
+		return report
+	finally:
+		_maintenance_lock.release()
@@ -1,11 +1,25 @@
 from flask import Flask
 import concurrent.futures
+import functools
+import glob
+import hashlib
+import importlib.metadata
+import itertools
+import multiprocessing
 import os
 import shutil
-import re
+import time
+from typing import Iterator
 import threading # FIXME: lock all list operations in case of the GIL being ditched
 from .settings import Settings
 from . import db_manager
+from . import prefix_engine
+from .executors import BoundedExecutor, ProcessExecutor
+from .reader_handles import ReaderHandle
+from .article_cache import ArticleCache
+from .article_pipeline import ArticlePipeline, regex
+from . import metrics
+from .suggestion_cache import SuggestionCache
 from .dicts import BaseReader, DSLReader, StarDictReader, MDictReader
 from .langs import is_lang, transliterate, stem, spelling_suggestions, orthographic_forms, convert_chinese
 from . import transformation
@@ -38,72 +52,135 @@ except ImportError:
 	xapian_found = False
 
 
+# What the articles are rendered with, besides the dictionaries and the keys of the article cache:
+# source files of the package, libraries if installed and preferences
+_RENDERING_SOURCES = ('dictionaries.py', 'article_pipeline.py', 'dicts/**/*.py', 'transformation/**/*.py')
+_RENDERING_LIBRARIES = ('dsl2html', 'xdxf2html', 'opencc', 'lxml')
+_RENDERING_PREFERENCES = ('stardict_load_syns', 'chinese_preference', 'running_mode')
+
+
+def _rendering_fingerprint(preferences: dict) -> str:
+	"""
+	Changes with the code of the readers, the article pipeline and the transformation rules, the versions of the
+	libraries converting the articles and the preferences they depend on, so that the disk tier of the article cache
+	left by a previous run is not served afterwards.
+	"""
+	digest = hashlib.sha1()
+	package_dir = os.path.dirname(os.path.abspath(__file__))
+	for pattern in _RENDERING_SOURCES:
+		for filename in sorted(glob.glob(os.path.join(package_dir, pattern), recursive=True)):
+			with open(filename, 'rb') as f:
+				digest.update(f.read())
+	for library in _RENDERING_LIBRARIES:
+		try:
+			version = importlib.metadata.version(library)
+		except importlib.metadata.PackageNotFoundError:
+			version = None
+		digest.update(repr((library, version)).encode('utf-8'))
+	digest.update(repr([preferences[preference] for preference in _RENDERING_PREFERENCES]).encode('utf-8'))
+	return digest.hexdigest()[:16]
+
+
+def _create_reader(dictionary_info: dict,
+				   preferences: dict,
+				   load_content_into_memory: bool,
+				   executor: BoundedExecutor | None) -> BaseReader:
+	match dictionary_info['dictionary_format']:
+		case 'MDict (.mdx)':
+			return MDictReader(dictionary_info['dictionary_name'],
+							   dictionary_info['dictionary_filename'],
+							   dictionary_info['dictionary_display_name'],
+							   load_content_into_memory=load_content_into_memory,
+							   executor=executor)
+		case 'StarDict (.ifo)':
+			return StarDictReader(dictionary_info['dictionary_name'],
+								  dictionary_info['dictionary_filename'],
+								  dictionary_info['dictionary_display_name'],
+								  load_synonyms=preferences['stardict_load_syns'],
+								  load_content_into_memory=load_content_into_memory,
+								  # Most StarDicts are too cheap to convert to be worth a thread, but XDXF converted without xdxf2html
+								  # is worth a process
+								  executor=executor if isinstance(executor, ProcessExecutor) else None)
+		case 'DSL (.dsl/.dsl.dz)':
+			if preferences['running_mode'] == 'normal':
+				return DSLReader(dictionary_info['dictionary_name'],
+								 dictionary_info['dictionary_filename'],
+								 dictionary_info['dictionary_display_name'],
+								 load_content_into_memory=load_content_into_memory,
+								 executor=executor)
+			elif preferences['running_mode'] == 'preparation':
+				return DSLReader(dictionary_info['dictionary_name'],
+								 dictionary_info['dictionary_filename'],
+								 dictionary_info['dictionary_display_name'],
+								 True,
+								 True,
+								 executor=executor)
+			else:  # 'server' mode
+				return DSLReader(dictionary_info['dictionary_name'],
+								 dictionary_info['dictionary_filename'],
+								 dictionary_info['dictionary_display_name'],
+								 executor=executor)
+		case _:
+			raise ValueError(f'Dictionary format {dictionary_info["dictionary_format"]} not supported.')
+
+
+def _index_dictionary(dictionary_info: dict, preferences: dict, fts_enabled: bool) -> float:
+	"""
+	Runs in a process of its own at startup. Opening a reader indexes the dictionary and prepares its files
+	(converted DSL, extracted resources, pickles), so the reader opened afterwards by the main process finds them ready.
+	fts_enabled tells whether its database gets the FTS5 index, as in the main process.
+	Returns the time taken.
+	"""
+	time_started = time.perf_counter()
+	db_manager.set_fts_enabled(fts_enabled)
+	_create_reader(dictionary_info, preferences, False, None)
+	return time.perf_counter() - time_started
+
+
 class Dictionaries:
-	_re_legacy_lookup_api = re.compile(r'/api/lookup/([^/]+)/([^/]+)')
-	_re_cache_api = re.compile(r'/api/cache/([^/]+)/([^/]+)')
-	_REPLACEMENT_TEXT = '!!@@SUBSTITUTION@@!!'
-	_re_img = re.compile(r'<img[^>]*>')
-	_re_audio = re.compile(r'<audio.*?>.*?</audio>')
-	_re_video = re.compile(r'<video.*?>.*?</video>')
-	_re_link_opening = re.compile(r'<a[^>]*>')
-	_re_link_closing = re.compile('</a>')
-	_re_headword = re.compile(r'<h3 class="headword">([^<]+)</h3>')
+	# Of the article pipelines
+	_PATTERN_CACHE_API = r'/api/cache/([^/]+)/([^/]+)' # left alone by the Chinese conversion
+	_RULE_LEGACY_LOOKUP_API = regex(r'/api/lookup/([^/]+)/([^/]+)',
+									lambda match, group_name: f'/api/query/{group_name}/{match.group(2)}')
+	# Media, links and headword removed for Anki, in one pass. Audio comes before links, as <a[^>]*> matches <audio>.
+	_RULE_ANKI = regex('|'.join([r'<img[^>]*>',
+								 r'<audio.*?>.*?</audio>',
+								 r'<video.*?>.*?</video>',
+								 r'<a[^>]*>',
+								 '</a>',
+								 r'<h3 class="headword">([^<]+)</h3>']),
+					   '')
 
 	_XAPIAN_DICTNAME_WORD_SEP = '_*_'
 
-	def _load_dictionary(self, dictionary_info: dict) -> None:
-		# First check if the dictionary file has changed. If so, re-index it.
-		# Won't do if running under 'server' mode
-		if self.settings.preferences['running_mode'] != 'server':
-			prev_time_modified =\
-				self.settings.saved_dictionary_modification_time(dictionary_info['dictionary_name'])
-			cur_time_modified = os.path.getmtime(dictionary_info['dictionary_filename'])
-			if prev_time_modified and prev_time_modified < cur_time_modified:
-				db_manager.delete_dictionary(dictionary_info['dictionary_name'])
-				logger.info(f'Entries of {dictionary_info["dictionary_display_name"]} deleted from database,'
-							'ready for re-indexing.')
-
-		match dictionary_info['dictionary_format']:
-			case 'MDict (.mdx)':
-				self._dictionaries[dictionary_info['dictionary_name']] =\
-					MDictReader(dictionary_info['dictionary_name'],
-				 				dictionary_info['dictionary_filename'],
-								dictionary_info['dictionary_display_name'],
-								load_content_into_memory=self.settings.dictionary_is_in_group(
-									dictionary_info['dictionary_name'],
-									Settings.NAME_GROUP_LOADED_INTO_MEMORY))
-			case 'StarDict (.ifo)':
-				self._dictionaries[dictionary_info['dictionary_name']] =\
-					StarDictReader(dictionary_info['dictionary_name'],
-								   dictionary_info['dictionary_filename'],
-								   dictionary_info['dictionary_display_name'],
-								   load_synonyms=self.settings.preferences['stardict_load_syns'],
-								   load_content_into_memory=self.settings.dictionary_is_in_group(
-									   dictionary_info['dictionary_name'],
-									   Settings.NAME_GROUP_LOADED_INTO_MEMORY))
-			case 'DSL (.dsl/.dsl.dz)':
-				if self.settings.preferences['running_mode'] == 'normal':
-					self._dictionaries[dictionary_info['dictionary_name']] =\
-						DSLReader(dictionary_info['dictionary_name'],
-								  dictionary_info['dictionary_filename'],
-								  dictionary_info['dictionary_display_name'],
-								  load_content_into_memory=self.settings.dictionary_is_in_group(
-									dictionary_info['dictionary_name'],
-									Settings.NAME_GROUP_LOADED_INTO_MEMORY))
-				elif self.settings.preferences['running_mode'] == 'preparation':
-					self._dictionaries[dictionary_info['dictionary_name']] =\
-						DSLReader(dictionary_info['dictionary_name'],
-								  dictionary_info['dictionary_filename'],
-								  dictionary_info['dictionary_display_name'],
-								  True,
-								  True)
-				else:  # 'server' mode
-					self._dictionaries[dictionary_info['dictionary_name']] =\
-						DSLReader(dictionary_info['dictionary_name'],
-								  dictionary_info['dictionary_filename'],
-								  dictionary_info['dictionary_display_name'])
-			case _:
-				raise ValueError(f'Dictionary format {dictionary_info["dictionary_format"]} not supported.')
+	def _discard_if_modified(self, dictionary_info: dict) -> float | None:
+		"""
+		Checks if the dictionary file has changed since it was indexed. If so, deletes its entries to re-index it.
+		Returns the modification time recorded at the previous indexing, if any.
+		Won't do if running under 'server' mode.
+		"""
+		if self.settings.preferences['running_mode'] == 'server':
+			return None
+		prev_time_modified =\
+			db_manager.dictionary_modification_time(dictionary_info['dictionary_name']) or\
+			self.settings.saved_dictionary_modification_time(dictionary_info['dictionary_name'])
+		cur_time_modified = os.path.getmtime(dictionary_info['dictionary_filename'])
+		if prev_time_modified and prev_time_modified < cur_time_modified:
+			db_manager.delete_dictionary(dictionary_info['dictionary_name'])
+			prefix_engine.discard(dictionary_info['dictionary_name'])
+			self._article_cache.invalidate(dictionary_info['dictionary_name'])
+			self._suggestion_cache.clear()
+			logger.info(f'Entries of {dictionary_info["dictionary_display_name"]} deleted from database,'
+						'ready for re-indexing.')
+		return prev_time_modified
+
+	def _open_dictionary(self, dictionary_info: dict, prev_time_modified: float | None) -> BaseReader:
+		time_started = time.perf_counter()
+		reader = _create_reader(dictionary_info,
+								self.settings.preferences,
+								self.settings.dictionary_is_in_group(dictionary_info['dictionary_name'],
+																	 Settings.NAME_GROUP_LOADED_INTO_MEMORY),
+								self._conversion_executor or self._cpu_executor)
 
 		if self.settings.preferences['running_mode'] != 'server':
 			if dictionary_info['dictionary_filename'].endswith('.dsl'):
@@ -112,30 +189,192 @@ class Dictionaries:
 			if prev_time_modified and prev_time_modified < cur_time_modified:
 				self.settings.update_dictionary_modification_time(dictionary_info['dictionary_name'],
 																  cur_time_modified)
+			if prev_time_modified != cur_time_modified:
+				db_manager.set_dictionary_modification_time(dictionary_info['dictionary_name'], cur_time_modified)
+
+		if self._prefix_engine is not None:
+			self._prefix_engine.add(dictionary_info['dictionary_name'])
+		# Suggestions cached before the dictionary was indexed lack its words
+		self._suggestion_cache.clear()
+		logger.info(f'{dictionary_info["dictionary_display_name"]} loaded in {time.perf_counter() - time_started:.2f}s')
+		return reader
+
+	def _load_dictionary(self, dictionary_info: dict) -> None:
+		handle = ReaderHandle(functools.partial(self._open_dictionary,
+												dictionary_info,
+												self._discard_if_modified(dictionary_info)))
+		handle.reader() # raises if it cannot be opened
+		self._dictionaries[dictionary_info['dictionary_name']] = handle
+
+	def _reader(self, dictionary_name: str) -> BaseReader:
+		return self._dictionaries[dictionary_name].reader()
+
+	def _dictionaries_in_group_order(self) -> list[dict]:
+		"""
+		The dictionaries in the order of the groups they are in, those in no group last.
+		"""
+		names_in_group_order = dict.fromkeys(dictionary_name
+											 for group in self.settings.get_groups()
+											 for dictionary_name in self.settings.dictionaries_of_group(group['name']))
+		positions = {dictionary_name: i for i, dictionary_name in enumerate(names_in_group_order)}
+		return sorted(self.settings.dictionaries_list,
+					  key=lambda dictionary_info: positions.get(dictionary_info['dictionary_name'], len(positions)))
+
+	def _schedule_dictionaries(self) -> None:
+		"""
+		Creates the handles of the readers, which the server does not wait for, and starts warming them up.
+		Dictionaries not indexed yet are indexed in a pool of processes, as indexing is CPU-bound Python.
+		"""
+		prev_times_modified = dict()
+		for dictionary_info in self.settings.dictionaries_list:
+			try:
+				prev_times_modified[dictionary_info['dictionary_name']] = self._discard_if_modified(dictionary_info)
+			except OSError: # reported when it fails to open
+				prev_times_modified[dictionary_info['dictionary_name']] = None
+		dictionaries_to_index = [dictionary_info for dictionary_info in self.settings.dictionaries_list
+								 if not db_manager.dictionary_exists(dictionary_info['dictionary_name'])]
+		num_processes = min(self.settings.preferences['cpu_workers'], len(dictionaries_to_index))
+
+		indexers = None
+		indexing: dict[concurrent.futures.Future, dict] = dict()
+		if num_processes >= 2: # otherwise indexed as they are opened
+			try:
+				# Not forked, as the connections to the databases of this process must not be shared
+				indexers = concurrent.futures.ProcessPoolExecutor(num_processes,
+																  mp_context=multiprocessing.get_context('spawn'))
+				fts_enabled = self.settings.preferences['suggestions_mode'] == 'both-sides-fts'
+				indexing = {indexers.submit(_index_dictionary,
+											dictionary_info,
+											self.settings.preferences,
+											fts_enabled): dictionary_info for dictionary_info in dictionaries_to_index}
+			except (OSError, NotImplementedError, ImportError) as e: # e.g. no processes on iOS
+				logger.warning(f'Indexing in the main process: {e}')
+				if indexers is not None:
+					indexers.shutdown(wait=False, cancel_futures=True)
+				indexers = None
+				indexing = dict()
+		futures_of_dictionaries = {dictionary_info['dictionary_name']: future
+								   for future, dictionary_info in indexing.items()}
+
+		for dictionary_info in self.settings.dictionaries_list:
+			self._dictionaries[dictionary_info['dictionary_name']] =\
+				ReaderHandle(functools.partial(self._open_dictionary,
+											   dictionary_info,
+											   prev_times_modified[dictionary_info['dictionary_name']]),
+							 futures_of_dictionaries.get(dictionary_info['dictionary_name']))
+
+		threading.Thread(target=self._warm_up, args=(indexers, indexing), name='warm-up', daemon=True).start()
+
+	def _warm_up(self,
+				 indexers: concurrent.futures.ProcessPoolExecutor | None,
+				 indexing: dict[concurrent.futures.Future, dict]) -> None:
+		"""
+		Opens the readers in group order, by at most startup_io_workers threads,
+		as reading many files at once would confuse the I/O scheduler of a hard disk.
+		Those being indexed are opened as soon as their process is done.
+		"""
+		time_started = time.perf_counter()
+
+		def open_reader(dictionary_info: dict) -> None:
+			if (handle := self._dictionaries.get(dictionary_info['dictionary_name'])) is None: # removed meanwhile
+				return
+			try:
+				handle.reader()
+			except Exception:
+				logger.exception(f'Failed to load {dictionary_info["dictionary_display_name"]}')
+
+		with concurrent.futures.ThreadPoolExecutor(self.settings.preferences['startup_io_workers'],
+												   thread_name_prefix='warm-up') as loaders:
+			for dictionary_info in self._dictionaries_in_group_order():
+				if dictionary_info not in indexing.values():
+					loaders.submit(open_reader, dictionary_info)
+			if indexers is not None:
+				with indexers:
+					for future in concurrent.futures.as_completed(indexing.keys()):
+						dictionary_info = indexing[future]
+						try:
+							logger.info(f'{dictionary_info["dictionary_display_name"]} indexed in {future.result():.2f}s')
+						except Exception:
+							# Opening it indexes it here
+							logger.exception(f'Failed to index {dictionary_info["dictionary_display_name"]} '
+											 'in a separate process')
+						loaders.submit(open_reader, dictionary_info)
+		logger.info(f'Dictionaries loaded in {time.perf_counter() - time_started:.2f}s.')
 
 	def __init__(self, app: Flask) -> None:
 		app.extensions['dictionaries'] = self
 
 		self.settings = Settings()
 
-		db_manager.create_table_entries()
+		# Shared by all requests: reading the articles of a group, and cleaning up or converting them
+		self._io_executor = BoundedExecutor('io', self.settings.preferences['io_workers'])
+		self._cpu_executor = BoundedExecutor('cpu', self.settings.preferences['cpu_workers'])
+		self._conversion_executor = None
+		if self.settings.preferences['conversion_processes'] > 0:
+			try:
+				self._conversion_executor = ProcessExecutor('conversion',
+															self.settings.preferences['conversion_processes'])
+			except (OSError, NotImplementedError, ImportError) as e: # e.g. no processes on iOS
+				logger.warning(f'Converting articles in threads: {e}')
+		self._article_cache = ArticleCache(self.settings.preferences['article_cache_size'] * 1024 * 1024,
+										   self.settings.preferences['article_disk_cache_size'] * 1024 * 1024,
+										   _rendering_fingerprint(self.settings.preferences))
+		self._suggestion_cache = SuggestionCache(Settings.SUGGESTIONS_CACHE_WINDOWS,
+												 Settings.SUGGESTIONS_CACHE_WINDOW_SIZE)
+		# By (dictionary name, whether for Anki), built on first use
+		self._article_pipelines: dict[tuple[str, bool], ArticlePipeline] = dict()
 
-		self._dictionaries: dict[str, BaseReader] = dict()
-		# on HDD it would confuse the I/O scheduler to load the dictionaries in parallel
-		if len(self.settings.dictionaries_of_group(Settings.NAME_GROUP_LOADED_INTO_MEMORY)) > 0:
-			for dictionary_info in self.settings.dictionaries_list:
-				self._load_dictionary(dictionary_info)
+		db_manager.create_table_entries()
+		# Created before loading the dictionaries, so that the databases of new ones are built with it
+		if self.settings.preferences['suggestions_mode'] == 'both-sides-fts':
+			db_manager.create_fts_table()
 		else:
-			with concurrent.futures.ThreadPoolExecutor() as executor:
-				executor.map(self._load_dictionary, self.settings.dictionaries_list)
+			db_manager.drop_fts_table() # would otherwise slow down indexing for nothing
 
-		logger.info('Dictionaries loaded.')
+		# Filled as the dictionaries are opened, the database answering for those not in it yet
+		self._prefix_engine = prefix_engine.PrefixEngine() if self.settings.preferences['in_memory_suggestions']\
+			else None
+
+		self._dictionaries: dict[str, ReaderHandle] = dict()
+		self._schedule_dictionaries()
 
 		self._xapian_indexing_lock = threading.Lock()
 
+	def readiness(self) -> dict[str, int | dict[str, str]]:
+		"""
+		Number of dictionaries whose readers are open, and the state of each dictionary (see ReaderHandle.state).
+		"""
+		states = {dictionary_name: handle.state for dictionary_name, handle in list(self._dictionaries.items())}
+		return {
+			'ready': sum(state == 'ready' for state in states.values()),
+			'total': len(states),
+			'dictionaries': states
+		}
+
+	def executor_statistics(self) -> dict[str, dict[str, int]]:
+		"""
+		Number of threads (or processes), of running tasks and of tasks waiting for a thread of each shared executor.
+		"""
+		return {executor.name: executor.statistics()
+				for executor in (self._io_executor, self._cpu_executor, self._conversion_executor)
+				if executor is not None}
+
+	def article_cache_statistics(self) -> dict[str, int]:
+		"""
+		Hits in memory and on disk, misses, and the number and size of the articles held by the article cache.
+		"""
+		return self._article_cache.statistics()
+
+	def suggestion_cache_statistics(self) -> dict[str, int]:
+		"""
+		Keys answered from the window of one of their prefixes (hits) or from the index (misses), and windows held.
+		"""
+		return self._suggestion_cache.statistics()
+
 	def add_dictionary(self, dictionary_info: dict) -> None:
 		dictionary_info['dictionary_filename'] =\
 			self.settings.parse_path_with_env_variables(dictionary_info['dictionary_filename'])
+		self._article_cache.invalidate(dictionary_info['dictionary_name'])
 		self._load_dictionary(dictionary_info)
 		self.settings.add_dictionary(dictionary_info)
 		logger.info('Added dictionary %s' % dictionary_info['dictionary_name'])
@@ -144,6 +383,11 @@ class Dictionaries:
 		self.settings.remove_dictionary(dictionary_info)
 		self._dictionaries.pop(dictionary_info['dictionary_name'])
 		db_manager.delete_dictionary(dictionary_info['dictionary_name'])
+		if self._prefix_engine is not None:
+			self._prefix_engine.remove(dictionary_info['dictionary_name'])
+		prefix_engine.discard(dictionary_info['dictionary_name'])
+		self._article_cache.invalidate(dictionary_info['dictionary_name'])
+		self._suggestion_cache.clear()
 		logger.info('Removed dictionary %s' % dictionary_info['dictionary_name'])
 
 	def reload_dictionaries(self, dictionaries_info: list[dict]) -> None:
@@ -201,7 +445,7 @@ class Dictionaries:
 
 			for dict_name in self.settings.dictionaries_of_group(self.settings.XAPIAN_GROUP_NAME):
 				for word in db_manager.select_words_of_dictionary(dict_name):
-					article = self._dictionaries[dict_name].get_definition_by_word(word)
+					article = self._reader(dict_name).get_definition_by_word(word)
 					if lxml_found:
 						article = lxml.html.fromstring(article).text_content()
 					doc = xapian.Document()
@@ -247,46 +491,31 @@ class Dictionaries:
 		enquire.set_query(query)
 		matches = enquire.get_mset(0, self.settings.XAPIAN_MAX_RESULTS)
 
-		def replace_legacy_lookup_api(match: re.Match) -> str:
-			return f'/api/query/{self.settings.XAPIAN_GROUP_NAME}/{match.group(2)}'
-
 		group_lang = self.settings.group_lang(self.settings.XAPIAN_GROUP_NAME)
 		autoplay_found = False
+		autoplay_lock = threading.Lock()
 		articles = []
 
 		def extract_article(m: xapian.MSetItem) -> None:
 			nonlocal autoplay_found
 			dict_name, word = m.document.get_data().decode('utf-8').split(self._XAPIAN_DICTNAME_WORD_SEP)
-			article = self._dictionaries[dict_name].get_definition_by_word(word)
+			with metrics.dictionary(dict_name):
+				article = self._reader(dict_name).get_definition_by_word(word)
+				if article:
+					article = self._finish_article(self.settings.XAPIAN_GROUP_NAME, group_lang, dict_name, article)
 			if article:
-				if 'zh' in group_lang:
-					article = self._safely_convert_chinese_article(article)
-				article = self._re_legacy_lookup_api.sub(replace_legacy_lookup_api, article)
-				if dict_name in transformation.transform.keys():
-					article = transformation.transform[dict_name](article)
-				if not autoplay_found and (pos_autoplay := article.find('autoplay')) != -1:
-					autoplay_found = True
-					# Only preserve the first autoplay
-					pos_autoplay += len('autoplay')
-					article = article[:pos_autoplay] + article[pos_autoplay:].replace('autoplay', '')
-					articles.append(
-						(m.rank,
-						dict_name,
-						word,
-						self.settings.display_name_of_dictionary(dict_name),
-						article))
-				else:
-					articles.append(
-						(m.rank,
-						dict_name,
-						word,
-						self.settings.display_name_of_dictionary(dict_name),
-						article.replace('autoplay', '')))
+				with autoplay_lock:
+					article, autoplay_found = self._preserve_first_autoplay(article, autoplay_found)
+				articles.append(
+					(m.rank,
+					dict_name,
+					word,
+					self.settings.display_name_of_dictionary(dict_name),
+					article))
 				
 				self.settings.add_to_history(word)
 		
-		with concurrent.futures.ThreadPoolExecutor() as executor:
-			executor.map(extract_article, matches)
+		self._io_executor.run(extract_article, matches)
 		
 		xapian_db.close()
 
@@ -295,23 +524,67 @@ class Dictionaries:
 
 		return articles
 
-	def _safely_convert_chinese_article(self, article: str) -> str:
+	def _convert_chinese(self, text: str) -> str:
+		convert = functools.partial(convert_chinese, preference=self.settings.preferences['chinese_preference'])
+		with metrics.stage('opencc'):
+			if self._conversion_executor is not None: # OpenCC holds the GIL
+				return self._conversion_executor.map(convert, [text])[0]
+			return convert(text)
+
+	def _article_pipeline(self, dictionary_name: str, for_anki: bool) -> ArticlePipeline:
 		"""
-		A direct call to convert_chinese() converts things like API references.
-		Now only cache API calls are protected.
+		The removals of Anki or the rewriting of legacy links, then the rules of the dictionary in the transformation package.
 		"""
-		# First replace all API calls with the substitution string, then convert the article, and finally restore the API calls
-		matches = self._re_cache_api.findall(article)
-		article = self._re_cache_api.sub(self._REPLACEMENT_TEXT, article)
-		article = convert_chinese(article, self.settings.preferences['chinese_preference'])
-		for match in matches:
-			article = article.replace(self._REPLACEMENT_TEXT, '/api/cache/%s/%s' % match, 1)
-		return article
-
-	def suggestions(self, group_name: str, key: str) -> list[str]:
+		if (pipeline := self._article_pipelines.get((dictionary_name, for_anki))) is None:
+			rules = [self._RULE_ANKI if for_anki else self._RULE_LEGACY_LOOKUP_API]
+			rules.extend(transformation.rules.get(dictionary_name, []))
+			# Articles for Anki are converted whole, as they always were
+			pipeline = self._article_pipelines[(dictionary_name, for_anki)] = ArticlePipeline(
+				rules, None if for_anki else self._PATTERN_CACHE_API)
+		return pipeline
+
+	def _finish_article(self, group_name: str, group_lang: set[str], dictionary_name: str, article: str,
+						for_anki: bool = False) -> str:
+		"""
+		Chinese conversion, legacy links pointed to the group (or media, links and headword removed for Anki)
+		and the transformation rules of the dictionary, then its transformation function if any.
+		"""
+		with metrics.stage('postprocess'):
+			article = self._article_pipeline(dictionary_name, for_anki).process(
+				article, group_name, self._convert_chinese if 'zh' in group_lang else None)
+			if dictionary_name in transformation.transform.keys():
+				article = transformation.transform[dictionary_name](article)
+			return article
+
+	def _entry_exists_in_dictionaries(self, key: str, names_dictionaries: list[str]) -> bool:
+		if self._prefix_engine is not None and self._prefix_engine.covers(names_dictionaries):
+			return self._prefix_engine.entry_exists_in_dictionaries(key, names_dictionaries)
+		return db_manager.entry_exists_in_dictionaries(key, names_dictionaries)
+
+	def _select_entries_beginning_with(self,
+									   keys: list[str],
+									   names_dictionaries: list[str],
+									   words_already_found: list[str],
+									   limit: int,
+									   after: str | None = None) -> list[str]:
+		select = self._prefix_engine.select_entries_beginning_with\
+			if self._prefix_engine is not None and self._prefix_engine.covers(names_dictionaries)\
+			else db_manager.select_entries_beginning_with
+		# Typing goes through the prefixes of the key, which the cache narrows down in memory
+		if len(keys) == 1 and after is None:
+			return self._suggestion_cache.select_entries_beginning_with(keys[0],
+																		names_dictionaries,
+																		words_already_found,
+																		limit,
+																		select)
+		return select(keys, names_dictionaries, words_already_found, limit, after)
+
+	def suggestions(self, group_name: str, key: str, after: str | None = None) -> list[str]:
 		"""
 		Return matched headwords if the key is found;
 		Otherwise return spelling suggestions or word stems.
+		If after (the last suggestion shown) is given, return the next page of headwords beginning with key
+		(ignored for wildcard searches).
 		"""
 		names_dictionaries_of_group = self.settings.dictionaries_of_group(group_name)
 		group_lang = self.settings.group_lang(group_name)
@@ -325,9 +598,18 @@ class Dictionaries:
 			key_simplified = Settings.transform_wildcards(key_simplified)
 			suggestions = db_manager.select_entries_like(key_simplified,
 														 names_dictionaries_of_group,
-														 self.settings.misc_configs['num_suggestions'])
+														 self.settings.misc_configs['num_suggestions'],
+														 self.settings.preferences['ngram_stores_keys']
+														 if self.settings.preferences['suggestions_mode'] == 'both-sides'
+														 else None)
 		else:
 			keys = self._transliterate_key(key_simplified, group_lang)
+			if after is not None:
+				return self._select_entries_beginning_with(keys,
+														   names_dictionaries_of_group,
+														   [],
+														   self.settings.misc_configs['num_suggestions'],
+														   simplify(after))
 
 			# First determine if any of the keys is a headword in an inflected form
 			suggestions = set()
@@ -335,28 +617,39 @@ class Dictionaries:
 				key_orthographic_forms = [w
 							  			  for w in orthographic_forms(key_simplified_transliterated,
 										  							  group_lang)
-										  if any(db_manager.entry_exists_in_dictionaries(
+										  if any(self._entry_exists_in_dictionaries(
 											  simplify(w_stem),
 											  names_dictionaries_of_group) for w_stem in stem(w, group_lang))]
 				suggestions.update(key_orthographic_forms)
 			suggestions = list(suggestions)
 
 			# Then search for entries beginning with `key`, as is common sense
-			suggestions.extend(db_manager.select_entries_beginning_with(keys,
-															   			names_dictionaries_of_group,
-																		suggestions,
-																		self.settings.misc_configs['num_suggestions']))
+			suggestions.extend(self._select_entries_beginning_with(keys,
+																   names_dictionaries_of_group,
+																   suggestions,
+																   self.settings.misc_configs['num_suggestions']))
 			
 			if self.settings.preferences['suggestions_mode'] == 'both-sides' and\
 				len(suggestions) < self.settings.misc_configs['num_suggestions']:
 				keys_expanded = []
 				for key_simplified in keys:
 					keys_expanded.extend(db_manager.expand_key(key_simplified,
-															   self.settings.preferences['ngram_stores_keys']))
+															   self.settings.preferences['ngram_stores_keys'],
+															   names_dictionaries_of_group,
+															   suggestions,
+															   self.settings.misc_configs['num_suggestions']))
 				suggestions.extend(db_manager.select_entries_with_keys(keys_expanded,
 														   			   names_dictionaries_of_group,
 																	   suggestions,
 																	   self.settings.misc_configs['num_suggestions']))
+			elif self.settings.preferences['suggestions_mode'] == 'both-sides-fts':
+				for key_simplified in keys:
+					if len(suggestions) >= self.settings.misc_configs['num_suggestions']:
+						break
+					suggestions.extend(db_manager.select_entries_containing_fts(key_simplified,
+																				names_dictionaries_of_group,
+																				suggestions,
+																				self.settings.misc_configs['num_suggestions']))
 			if len(suggestions) == 0:
 				# Now try some spelling suggestions, which is slower than the above
 				suggestions = self.get_spelling_suggestions(group_name, key)
@@ -368,61 +661,144 @@ class Dictionaries:
 		Returns HTML article
 		"""
 		self.settings.add_to_history(key)
-		return self._dictionaries[dictionary_name].get_definition_by_key(key)
+		return self._reader(dictionary_name).get_definition_by_key(key)
 
-	def query(self, group_name: str, key: str) -> list[tuple[str, str, str]]:
+	def _keys_to_look_up(self, key: str, group_lang: set[str]) -> list[str]:
 		"""
-		Returns a list of tuples (dictionary name, dictionary display name, HTML article)
+		The simplified key, its stems and its transliterations.
+		"""
+		keys = [simplify(s) for s in stem(key, group_lang)] + self._transliterate_key(simplify(key), group_lang)
+		return list(set(keys))
+
+	@staticmethod
+	def _preserve_first_autoplay(article: str, autoplay_found: bool) -> tuple[str, bool]:
+		"""
+		Removes the autoplay attributes of the article, except the first one if none was found before it.
+		Returns the article and whether an autoplay has been found.
+		"""
+		if not autoplay_found and (pos_autoplay := article.find('autoplay')) != -1:
+			pos_autoplay += len('autoplay')
+			return article[:pos_autoplay] + article[pos_autoplay:].replace('autoplay', ''), True
+		return article.replace('autoplay', ''), autoplay_found
+
+	def query_stream(self, group_name: str, key: str) -> Iterator[tuple[int, str, str, str]]:
+		"""
+		Yields tuples (position of the dictionary in the group, dictionary name, dictionary display name, HTML article)
+		as soon as the article of each dictionary is ready, those of the article cache first.
 		"""
-		key_simplified = simplify(key)
 		names_dictionaries_of_group = self.settings.dictionaries_of_group(group_name)
 		group_lang = self.settings.group_lang(group_name)
-		keys = [simplify(s) for s in stem(key, group_lang)] + self._transliterate_key(key_simplified, group_lang)
-		keys = list(set(keys))
+		keys = self._keys_to_look_up(key, group_lang)
+
+		# Articles are cached as rendered before the autoplay handling, which depends on the other dictionaries,
+		# empty ones included, as most dictionaries of a group do not have most words.
+		# The group is part of the key because of the rewriting of legacy links.
+		cache_key = (group_name,
+					 tuple(sorted(keys)),
+					 self.settings.preferences['chinese_preference'] if 'zh' in group_lang else None)
+		generations = {dictionary_name: self._article_cache.generation(dictionary_name)
+					   for dictionary_name in names_dictionaries_of_group}
+		articles_cached = {dictionary_name: article
+						   for dictionary_name in names_dictionaries_of_group
+						   if (article := self._article_cache.get(dictionary_name, cache_key)) is not None}
+		names_dictionaries_to_render = [dictionary_name
+										for dictionary_name in names_dictionaries_of_group
+										if dictionary_name not in articles_cached]
+
+		# All the locations at once, grouped by dictionary and then by key
+		locations_of_dictionaries: dict[str, dict[str, list[tuple[str, int, int]]]] = dict()
+		if len(names_dictionaries_to_render) > 0:
+			for dictionary_name, key_found, word, offset, size in db_manager.get_entries_of_keys(
+				keys, names_dictionaries_to_render):
+				locations_of_dictionaries.setdefault(dictionary_name, dict())\
+					.setdefault(key_found, []).append((word, offset, size))
+
+		@metrics.timed_by_dictionary
+		def render_article_of_dictionary(dictionary_name: str) -> str:
+			locations_of_keys = locations_of_dictionaries.get(dictionary_name, dict())
+			if len(locations_of_keys) == 0 and not self._dictionaries[dictionary_name].ready:
+				# Not worth waiting for the reader, which may still be indexing: nothing to cache either
+				return ''
+			article = self._reader(dictionary_name).get_definitions_by_locations(
+				[locations_of_keys[key] for key in keys if key in locations_of_keys])
+			if article:
+				article = self._finish_article(group_name, group_lang, dictionary_name, article)
+			self._article_cache.put(dictionary_name, cache_key, article or '', generations[dictionary_name])
+			return article
+
+		# Only the articles to render are worth a thread
+		articles_ready = itertools.chain(articles_cached.items(),
+										 self._io_executor.as_completed(render_article_of_dictionary,
+																		names_dictionaries_to_render))
+		positions = {dictionary_name: i for i, dictionary_name in enumerate(names_dictionaries_of_group)}
 		autoplay_found = False
-		articles = []
+		found = False
+		for dictionary_name, article in articles_ready:
+			if not article:
+				continue
+			if not found:
+				found = True
+				self.settings.add_to_history(key)
+			article, autoplay_found = self._preserve_first_autoplay(article, autoplay_found)
+			yield (positions[dictionary_name],
+				   dictionary_name,
+				   self.settings.display_name_of_dictionary(dictionary_name),
+				   article)
 
-		def replace_legacy_lookup_api(match: re.Match) -> str:
-			return '/api/query/%s/%s' % (group_name, match.group(2))
+	def query(self, group_name: str, key: str) -> list[tuple[str, str, str]]:
+		"""
+		Returns a list of tuples (dictionary name, dictionary display name, HTML article)
+		"""
+		# The articles come in the order they are ready, so we reorder them by the order of dictionaries in the group
+		return [(dictionary_name, display_name, article)
+				for _, dictionary_name, display_name, article in sorted(self.query_stream(group_name, key))]
 
-		def extract_articles_from_dictionary(dictionary_name: str) -> None:
-			nonlocal autoplay_found
-			keys_found = [key for key in keys if db_manager.entry_exists_in_dictionary(key, dictionary_name)]
-			article = self._dictionaries[dictionary_name].get_definitions_by_keys(keys_found)
-			if article:
-				if 'zh' in group_lang:
-					article = self._safely_convert_chinese_article(article)
-				article = self._re_legacy_lookup_api.sub(replace_legacy_lookup_api, article)
-				if dictionary_name in transformation.transform.keys():
-					article = transformation.transform[dictionary_name](article)
-				if not autoplay_found and (pos_autoplay := article.find('autoplay')) != -1:
-					autoplay_found = True
-					# Only preserve the first autoplay
-					pos_autoplay += len('autoplay')
-					article = article[:pos_autoplay] + article[pos_autoplay:].replace('autoplay', '')
-					articles.append(
-						(dictionary_name,
-	   					self.settings.display_name_of_dictionary(dictionary_name),
-						article))
-				else:
-					articles.append(
-						(dictionary_name,
-	   					self.settings.display_name_of_dictionary(dictionary_name),
-						article.replace('autoplay', '')))
-
-		with concurrent.futures.ThreadPoolExecutor(len(names_dictionaries_of_group)) as executor:
-			executor.map(extract_articles_from_dictionary, names_dictionaries_of_group)
-
-		if len(articles) > 0:
-			self.settings.add_to_history(key)
-
-		# The articles may be out of order after parellel processing,
-		# so we reorder them by the order of dictionaries in the group
-		articles = [article
-			  		for dictionary_name in names_dictionaries_of_group
-					for article in articles
-					if article[0] == dictionary_name]
-		return articles
+	def query_batch(self, group_name: str, keys: list[str]) -> Iterator[tuple[str, list[tuple[str, str, str]]]]:
+		"""
+		Yields (key, articles as returned by query()) for each key, in order, for exports of many entries.
+		The keys are taken Settings.BATCH_LOOKUP_CHUNK_SIZE at a time: their locations are fetched with one query
+		per dictionary, and each dictionary reads all of its records in one pass, in the order of their offsets.
+		Neither the article cache nor the history is used, as an export would flush the one and flood the other.
+		"""
+		names_dictionaries_of_group = self.settings.dictionaries_of_group(group_name)
+		group_lang = self.settings.group_lang(group_name)
+		for start in range(0, len(keys), Settings.BATCH_LOOKUP_CHUNK_SIZE):
+			chunk = keys[start:start+Settings.BATCH_LOOKUP_CHUNK_SIZE]
+			keys_to_look_up = [self._keys_to_look_up(key, group_lang) for key in chunk]
+			locations_of_dictionaries: dict[str, dict[str, list[tuple[str, int, int]]]] = dict()
+			for dictionary_name, key_found, word, offset, size in db_manager.get_entries_of_keys(
+				list(set(itertools.chain.from_iterable(keys_to_look_up))), names_dictionaries_of_group):
+				locations_of_dictionaries.setdefault(dictionary_name, dict())\
+					.setdefault(key_found, []).append((word, offset, size))
+
+			def render_articles_of_dictionary(dictionary_name: str) -> list[str]:
+				locations_of_keys = locations_of_dictionaries.get(dictionary_name, dict())
+				# One definition per key found, joined into the article of each key as get_definitions_by_locations() does
+				locations_of_articles = [[locations_of_keys[key] for key in keys if key in locations_of_keys]
+										 for keys in keys_to_look_up]
+				if not any(locations_of_articles):
+					return [''] * len(chunk)
+				definitions = iter(self._reader(dictionary_name).get_definitions_in_batch(
+					list(itertools.chain.from_iterable(locations_of_articles))))
+				articles = [BaseReader._ARTICLE_SEPARATOR.join([next(definitions) for _ in locations])
+							for locations in locations_of_articles]
+				return [self._finish_article(group_name, group_lang, dictionary_name, article) if article else ''
+						for article in articles]
+
+			# Those which failed are left out
+			articles_of_dictionaries = {dictionary_name: [''] * len(chunk)
+										for dictionary_name in names_dictionaries_of_group} |\
+				dict(self._io_executor.as_completed(render_articles_of_dictionary, names_dictionaries_of_group))
+			for i, key in enumerate(chunk):
+				articles = []
+				autoplay_found = False
+				for dictionary_name in names_dictionaries_of_group:
+					if article := articles_of_dictionaries[dictionary_name][i]:
+						article, autoplay_found = self._preserve_first_autoplay(article, autoplay_found)
+						articles.append((dictionary_name,
+										 self.settings.display_name_of_dictionary(dictionary_name),
+										 article))
+				yield key, articles
 
 	def query_anki(self, group_name: str, word: str) -> list[tuple[str, str]]:
 		"""
@@ -436,24 +812,21 @@ class Dictionaries:
 		group_lang = self.settings.group_lang(group_name)
 		articles = []
 
+		locations_of_dictionaries: dict[str, list[tuple[str, int, int]]] = dict()
+		for dictionary_name, offset, size in db_manager.get_entries_with_headword_of_dictionaries(
+			word, names_dictionaries_of_group):
+			locations_of_dictionaries.setdefault(dictionary_name, []).append((word, offset, size))
+
+		@metrics.timed_by_dictionary
 		def extract_article_from_dictionary(dictionary_name: 'str') -> 'None':
-			if db_manager.headword_exists_in_dictionary(word, dictionary_name):
-				article = self._dictionaries[dictionary_name].get_definition_by_word(word)
+			if dictionary_name in locations_of_dictionaries:
+				article = self._reader(dictionary_name).get_definition_by_locations(
+					locations_of_dictionaries[dictionary_name])
 				if article:
-					article = self._re_img.sub('', article)
-					article = self._re_audio.sub('', article)
-					article = self._re_video.sub('', article)
-					article = self._re_link_opening.sub('', article)
-					article = self._re_link_closing.sub('', article)
-					article = self._re_headword.sub('', article)
-					if 'zh' in group_lang:
-						article = convert_chinese(article, self.settings.preferences['chinese_preference'])
-					if dictionary_name in transformation.transform.keys():
-						article = transformation.transform[dictionary_name](article)
+					article = self._finish_article(group_name, group_lang, dictionary_name, article, for_anki=True)
 					articles.append((article, dictionary_name))
 
-		with concurrent.futures.ThreadPoolExecutor(len(names_dictionaries_of_group)) as executor:
-			executor.map(extract_article_from_dictionary, names_dictionaries_of_group)
+		self._io_executor.run(extract_article_from_dictionary, names_dictionaries_of_group)
 
 		# Sort the articles by the order of dictionaries in the group (only the articles are preserved)
 		articles = [(article[1], article[0])
@@ -461,3 +834,36 @@ class Dictionaries:
 					for article in articles if article[1] == dictionary_name]
 
 		return articles
+
+	def query_anki_batch(self, group_name: str, words: list[str]) -> Iterator[tuple[str, list[tuple[str, str]]]]:
+		"""
+		Yields (word, articles as returned by query_anki()) for each word, in order, in chunks as query_batch() does.
+		"""
+		names_dictionaries_of_group = self.settings.dictionaries_of_group(group_name)
+		group_lang = self.settings.group_lang(group_name)
+		for start in range(0, len(words), Settings.BATCH_LOOKUP_CHUNK_SIZE):
+			chunk = words[start:start+Settings.BATCH_LOOKUP_CHUNK_SIZE]
+			locations_of_dictionaries: dict[str, dict[str, list[tuple[str, int, int]]]] = dict()
+			for dictionary_name, word, offset, size in db_manager.get_entries_with_headwords_of_dictionaries(
+				list(set(chunk)), names_dictionaries_of_group):
+				locations_of_dictionaries.setdefault(dictionary_name, dict())\
+					.setdefault(word, []).append((word, offset, size))
+
+			def extract_articles_from_dictionary(dictionary_name: str) -> list[str]:
+				locations_of_words = locations_of_dictionaries.get(dictionary_name, dict())
+				if len(locations_of_words) == 0:
+					return [''] * len(chunk)
+				definitions = self._reader(dictionary_name).get_definitions_in_batch(
+					[locations_of_words.get(word, []) for word in chunk])
+				return [self._finish_article(group_name, group_lang, dictionary_name, article, for_anki=True)
+						if article else ''
+						for article in definitions]
+
+			# Those which failed are left out
+			articles_of_dictionaries = {dictionary_name: [''] * len(chunk)
+										for dictionary_name in names_dictionaries_of_group} |\
+				dict(self._io_executor.as_completed(extract_articles_from_dictionary, names_dictionaries_of_group))
+			for i, word in enumerate(chunk):
+				yield word, [(dictionary_name, articles_of_dictionaries[dictionary_name][i])
+							 for dictionary_name in names_dictionaries_of_group
+							 if articles_of_dictionaries[dictionary_name][i]]
@@ -1,6 +1,10 @@
 import abc
 import unicodedata
+from typing import Callable, Iterable
 from ..settings import Settings
+from ..executors import BoundedExecutor
+from .. import db_manager
+from .. import metrics
 
 
 class BaseReader(abc.ABC):
@@ -9,6 +13,7 @@ class BaseReader(abc.ABC):
 	"""
 	_CACHE_ROOT = Settings.CACHE_ROOT
 	_ARTICLE_SEPARATOR = '\n<hr />\n'
+	_CONVERSION_STAGE = 'convert' # the stage of _map() in the metrics
 
 	@staticmethod
 	def strip_diacritics(text: str) -> str:
@@ -42,23 +47,43 @@ class BaseReader(abc.ABC):
 	def __init__(self,
 				 name: str,
 				 filename: str,
-				 display_name: str) -> None:
+				 display_name: str,
+				 executor: BoundedExecutor | None = None) -> None:
 		"""
 		:param name: the name of the dictionary, deduced by removing the extension(s) from the filename, used internally
 		:param filename: the name of the main file of the dictionary with extension(s)
 		:param display_name: the name of the dictionary as it should be displayed to the user
+		:param executor: the executor shared by the application for CPU-bound work on the records,
+		or None to do it in the calling thread
 		"""
 		self.name = name
 		self.filename = filename
 		self.display_name = display_name
+		self._executor = executor
+
+	def _map(self, function: Callable, items: Iterable) -> list:
+		"""
+		Applies function to the items in the shared executor if any, returning the results in order.
+		"""
+		with metrics.stage(self._CONVERSION_STAGE):
+			if self._executor is None:
+				return [function(item) for item in items]
+			return self._executor.map(function, items)
 
 	@abc.abstractmethod
+	def get_definition_by_locations(self, locations: list[tuple[str, int, int]]) -> str:
+		"""
+		:param locations: (word, offset, size) of the entries to read, as returned by db_manager.get_entries()
+		:return: the definition made of the given entries.
+		"""
+		pass
+
 	def get_definition_by_key(self, entry: str) -> str:
 		"""
 		:param entry: the entry to look up, must be simplified
 		:return: the definition of the given entry (match by key only; that is, ignore case and diacritics).
 		"""
-		pass
+		return self.get_definition_by_locations(db_manager.get_entries(entry, self.name))
 
 	def get_definitions_by_keys(self, entries: list[str]) -> list[str]:
 		"""
@@ -67,6 +92,41 @@ class BaseReader(abc.ABC):
 		"""
 		return self._ARTICLE_SEPARATOR.join([self.get_definition_by_key(entry) for entry in entries])
 
+	def get_definitions_by_locations(self, locations_of_entries: list[list[tuple[str, int, int]]]) -> str:
+		"""
+		:param locations_of_entries: the locations of each entry, already fetched from the database
+		:return: the definitions of the given entries, as get_definitions_by_keys() would return.
+		"""
+		return self._ARTICLE_SEPARATOR.join([self.get_definition_by_locations(locations)
+											 for locations in locations_of_entries])
+
+	def _get_records_of_locations(self, locations: list[tuple[str, int, int]]) -> list[list[str]]:
+		"""
+		:param locations: (word, offset, size) of the entries to read
+		:return: the converted records of each location, in the order given.
+		"""
+		return [[self.get_definition_by_locations([location])] for location in locations]
+
+	def get_definitions_in_batch(self, locations_of_definitions: list[list[tuple[str, int, int]]]) -> list[str]:
+		"""
+		:param locations_of_definitions: the locations of each definition, as given to get_definition_by_locations()
+		:return: the definitions, as get_definition_by_locations() would return them. The records of all of them are read
+		in one pass, in the order of their offsets, so that exporting many entries does not open the file
+		or decompress the same blocks again for each one.
+		"""
+		locations = [(location, i, j)
+					 for i, locations in enumerate(locations_of_definitions)
+					 for j, location in enumerate(locations)]
+		locations.sort(key=lambda item: item[0][1])
+		records = self._get_records_of_locations([location for location, _, _ in locations])
+		records_of_definitions = [[None] * len(locations) for locations in locations_of_definitions]
+		for (_, i, j), records_of_location in zip(locations, records):
+			records_of_definitions[i][j] = records_of_location
+		return [self._ARTICLE_SEPARATOR.join([record
+											  for records_of_location in records_of_definition
+											  for record in records_of_location])
+				for records_of_definition in records_of_definitions]
+
 	@abc.abstractmethod
 	def get_definition_by_word(self, headword: str) -> str:
 		"""
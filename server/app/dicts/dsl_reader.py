@@ -4,9 +4,11 @@ import shutil
 import idzip
 from json import detect_encoding
 from pathlib import Path
-import concurrent.futures
+from typing import Generator
 from .base_reader import BaseReader
+from ..executors import BoundedExecutor
 from .. import db_manager
+from .. import metrics
 from .dsl import DSLConverter
 import logging
 
@@ -30,6 +32,7 @@ class DSLReader(BaseReader):
 	- name_abrv.dsl: some useless abbreviations, usually compressed (.dz) (unused)
 	"""
 	_NON_PRINTING_CHARS_PATTERN = re.compile(r'[\x00-\x08\x0b\x0c\x0e-\x1f\x7f-\x9f]')
+	_CONVERSION_STAGE = 'convert_dsl'
 
 	@staticmethod
 	def _cleanup_text(text: str) -> str:
@@ -94,6 +97,52 @@ class DSLReader(BaseReader):
 				f.seek(offset)
 				return offset
 
+	def _entries_to_index(self, f) -> Generator[tuple[str, str, str, int, int], None, None]:
+		"""
+		Walks the cleaned-up DSL file and yields (key, dictionary_name, headword, offset, size) for every headword.
+		"""
+		headwords = []
+		while True:
+			offset = f.tell()
+			l = f.readline()
+			if l == '':
+				# EOF
+				break
+			if l[0] == '#' or l[0] == '\n':
+				# Header or separator
+				continue
+			if l[0] != ' ' and l[0] != '\t':
+				# Headword, could be separated by ' and '
+				headwords.append(l.strip())
+				if ' and ' in l:
+					headwords.extend(l.split(' and '))
+				# There also could be multiple headwords spanning several lines that share the same definition
+				while True:
+					offset = f.tell()
+					# Test a single char, if it is a space, then we have hit the beginning of the definition
+					char = f.read(1)
+					f.seek(offset)
+					if char == ' ' or char == '\t':
+						break
+					l = f.readline()
+					# There cannot be a comment or an EOF here
+					# Disproved by Greek Patristic Lexicon, ha ha
+					if l == '':
+						# EOF
+						break
+					headwords.append(l.strip())
+					if ' and ' in l:
+						headwords.extend(l.split(' and '))
+				# We have reached the beginning of the definition
+				# Read the definition
+				# print('#', headwords, f.tell(), '\nEND HEADWORD')
+				content_end_offset = self._read_content_end_offset(f)
+				# print('#', content_end_offset, '\n##', f.tell(), '\nEND CONTENT')
+				size = content_end_offset - offset
+				for headword in headwords:
+					yield self.simplify(headword), self.name, headword, offset, size
+				headwords.clear()
+
 	def __init__(self,
 				 name: str,
 				 filename: str, # .dsl/.dsl.dz
@@ -101,8 +150,9 @@ class DSLReader(BaseReader):
 				 performs_cleanup: bool = True, # Make sure your dsl is already cleaned up if it is False
 				 extract_resources: bool = False,
 				 remove_resources_after_extraction: bool = True,
-				 load_content_into_memory: bool = False) -> 'None':
-		super().__init__(name, filename, display_name)
+				 load_content_into_memory: bool = False,
+				 executor: BoundedExecutor | None = None) -> 'None':
+		super().__init__(name, filename, display_name, executor)
 		filename_no_extension, extension = os.path.splitext(filename)
 		is_compressed = extension == '.dz'
 
@@ -110,7 +160,6 @@ class DSLReader(BaseReader):
 			# !!! Back up before transformation
 			shutil.copyfile(filename, filename + '.old')
 			from idzip.command import _compress as idzip_compress, _decompress as idzip_decompress
-			db_manager.drop_index()
 			if is_compressed:
 				idzip_decompress(filename, Options)
 				# filename_no_extension is name.dsl
@@ -123,49 +172,7 @@ class DSLReader(BaseReader):
 					self._clean_up(filename)
 				f = open(filename, 'r', encoding='utf-8')
 			with f:
-				headwords = []
-				while True:
-					offset = f.tell()
-					l = f.readline()
-					if l == '':
-						# EOF
-						break
-					if l[0] == '#' or l[0] == '\n':
-						# Header or separator
-						continue
-					if l[0] != ' ' and l[0] != '\t':
-						# Headword, could be separated by ' and '
-						headwords.append(l.strip())
-						if ' and ' in l:
-							headwords.extend(l.split(' and '))
-						# There also could be multiple headwords spanning several lines that share the same definition
-						while True:
-							offset = f.tell()
-							# Test a single char, if it is a space, then we have hit the beginning of the definition
-							char = f.read(1)
-							f.seek(offset)
-							if char == ' ' or char == '\t':
-								break
-							l = f.readline()
-							# There cannot be a comment or an EOF here
-							# Disproved by Greek Patristic Lexicon, ha ha
-							if l == '':
-								# EOF
-								break
-							headwords.append(l.strip())
-							if ' and ' in l:
-								headwords.extend(l.split(' and '))
-						# We have reached the beginning of the definition
-						# Read the definition
-						# print('#', headwords, f.tell(), '\nEND HEADWORD')
-						content_end_offset = self._read_content_end_offset(f)
-						# print('#', content_end_offset, '\n##', f.tell(), '\nEND CONTENT')
-						size = content_end_offset - offset
-						for headword in headwords:
-							db_manager.add_entry(self.simplify(headword), self.name, headword, offset, size)
-						headwords.clear()
-			db_manager.commit()
-			db_manager.create_index()
+				db_manager.add_entries(self._entries_to_index(f))
 			logger.info(f'Entries of dictionary {self.name} added to database')
 			# Whether compressed originally or not, we need to compress it now
 			if is_compressed:
@@ -222,35 +229,37 @@ class DSLReader(BaseReader):
 		The headword is used for the article heading and the offset is needed for sorting.
 		"""
 		records = []
-		if self._loaded_content_into_memory:
-			# for word, offset, size in locations:
-			# 	records.append((self._get_record_from_cache(offset, size), word))
-			with concurrent.futures.ThreadPoolExecutor(len(locations)) as executor:
-				executor.map(lambda location: records.append((self._get_record_from_cache(location[1],
-																			  			  location[2]),
-															  location[0],
-															  location[1])),
-							 locations)
-		else:
-			with idzip.open(self.filename) as f:
+		with metrics.stage('read'): # including the decompression of dictzip
+			if self._loaded_content_into_memory:
+				# Slicing the content is too cheap to be worth handing over to other threads
 				for word, offset, size in locations:
-					records.append((self._get_record(f, offset, size), word, offset))
+					records.append((self._get_record_from_cache(offset, size), word, offset))
+			else:
+				with idzip.open(self.filename) as f:
+					for word, offset, size in locations:
+						records.append((self._get_record(f, offset, size), word, offset))
 		return records
 
-	def get_definition_by_key(self, entry: str) -> str:
-		locations = db_manager.get_entries(entry, self.name)
+	def get_definition_by_locations(self, locations: list[tuple[str, int, int]]) -> str:
 		records = self._get_records_in_batch(locations)
 		# records = [self._converter.convert(*record) for record in records]
 		# DSL parsing is expensive, so we'd better parallelise it
-		with concurrent.futures.ThreadPoolExecutor(len(records)) as executor:
-			records = list(executor.map(self._converter.convert, records))
+		records = self._map(self._converter.convert, records)
 		articles = [record[0] for record in sorted(records, key=lambda article: article[1])]
 		return self._ARTICLE_SEPARATOR.join(articles)
 
+	def _get_records_of_locations(self, locations: list[tuple[str, int, int]]) -> list[list[str]]:
+		records = self._get_records_in_batch(locations)
+		return [[article] for article, _ in self._map(self._converter.convert, records)]
+
+	def get_definitions_in_batch(self, locations_of_definitions: list[list[tuple[str, int, int]]]) -> list[str]:
+		# The records of a definition are in the order of their offsets, as with get_definition_by_locations()
+		return super().get_definitions_in_batch([sorted(locations, key=lambda location: location[1])
+												 for locations in locations_of_definitions])
+
 	def get_definition_by_word(self, headword: str) -> str:
 		locations = db_manager.get_entries_with_headword(headword, self.name)
 		records = self._get_records_in_batch([(headword, *location) for location in locations])
-		with concurrent.futures.ThreadPoolExecutor(len(records)) as executor:
-			records = list(executor.map(self._converter.convert, records))
+		records = self._map(self._converter.convert, records)
 		articles = [record[0] for record in records] # order shouldn't matter here
 		return self._ARTICLE_SEPARATOR.join(articles)
@@ -4,15 +4,17 @@ import os
 from pathlib import Path
 import pickle
 import io
+from typing import Generator
 try:
 	import lzo
 	lzo_is_c = True
 except ImportError:
 	from .mdict import lzo
 	lzo_is_c = False
-import concurrent.futures
 from .base_reader import BaseReader
+from ..executors import BoundedExecutor
 from .. import db_manager
+from .. import metrics
 from .mdict import MDX, MDD, HTMLCleaner
 import logging
 
@@ -22,6 +24,7 @@ logger.setLevel(logging.INFO)
 
 class MDictReader(BaseReader):
 	FILENAME_MDX_PICKLE = 'mdx.pickle'
+	_CONVERSION_STAGE = 'clean_html'
 
 	def _write_to_cache_dir(self, resource_filename: str, data: bytes) -> None:
 		absolute_path = os.path.join(self._resources_dir, resource_filename)
@@ -36,11 +39,12 @@ class MDictReader(BaseReader):
 				 display_name: str,
 				 extract_resources: bool = True,
 				 remove_resources_after_extraction: bool = False,
-				 load_content_into_memory: bool = False) -> 'None':
+				 load_content_into_memory: bool = False,
+				 executor: BoundedExecutor | None = None) -> 'None':
 		"""
 		It is recommended to set remove_resources_after_extraction to True on a server when you have local backup.
 		"""
-		super().__init__(name, filename, display_name)
+		super().__init__(name, filename, display_name, executor)
 		filename_no_extension, extension = os.path.splitext(filename)
 		self._resources_dir = os.path.join(self._CACHE_ROOT, name)
 		Path(self._resources_dir).mkdir(parents=True, exist_ok=True)
@@ -58,20 +62,7 @@ class MDictReader(BaseReader):
 			self._mdict = MDX(filename)
 
 		if not db_manager.dictionary_exists(self.name):
-			db_manager.drop_index()
-			for i in range(len(self._mdict._key_list)):
-				offset, key = self._mdict._key_list[i]
-				if i + 1 < len(self._mdict._key_list):
-					length = self._mdict._key_list[i + 1][0] - offset
-				else:
-					length = -1
-				db_manager.add_entry(self.simplify(key.decode('UTF-8')),
-						 			 self.name,
-									 key.decode('UTF-8'),
-									 offset,
-									 length)
-			db_manager.commit()
-			db_manager.create_index()
+			db_manager.add_entries(self._entries_to_index())
 			logger.info(f'Entries of dictionary {self.name} added to database')
 
 		if not mdx_pickled:
@@ -119,13 +110,31 @@ class MDictReader(BaseReader):
 				for mdd in resources:
 					os.remove(mdd._fname)
 
-	def _get_record(self, mdict_fp, offset: int, length: int) -> str:
+	def _entries_to_index(self) -> Generator[tuple[str, str, str, int, int], None, None]:
+		"""
+		Yields (key, dictionary_name, word, offset, length) for every entry of the MDX key list.
+		"""
+		key_list = self._mdict._key_list
+		for i in range(len(key_list)):
+			offset, key = key_list[i]
+			if i + 1 < len(key_list):
+				length = key_list[i + 1][0] - offset
+			else:
+				length = -1
+			word = key.decode('UTF-8')
+			yield self.simplify(word), self.name, word, offset, length
+
+	def _get_record(self, mdict_fp, offset: int, length: int, record_blocks: dict[int, bytes]) -> str:
+		"""
+		record_blocks keeps the last record block decompressed, keyed by its offset,
+		as consecutive records are often in the same block.
+		"""
 		if self._mdict._version >= 3:
-			return self._get_record_v3(mdict_fp, offset, length)
+			return self._get_record_v3(mdict_fp, offset, length, record_blocks)
 		else:
-			return self._get_record_v1v2(mdict_fp, offset, length)
+			return self._get_record_v1v2(mdict_fp, offset, length, record_blocks)
 
-	def _get_record_v3(self, f, offset: int, length: int) -> str:
+	def _get_record_v3(self, f, offset: int, length: int, record_blocks: dict[int, bytes]) -> str:
 		f.seek(self._mdict._record_block_offset)
 
 		num_record_blocks = self._mdict._read_int32(f)
@@ -140,8 +149,12 @@ class MDictReader(BaseReader):
 			decompressed_offset += decompressed_size
 			f.seek(compressed_size, 1)
 
-		block_compressed = f.read(compressed_size)
-		record_block = self._mdict._decode_block(block_compressed, decompressed_size)
+		if (record_block := record_blocks.get(decompressed_offset)) is None:
+			block_compressed = f.read(compressed_size)
+			with metrics.stage('decompress'):
+				record_block = self._mdict._decode_block(block_compressed, decompressed_size)
+			record_blocks.clear()
+			record_blocks[decompressed_offset] = record_block
 
 		record_start = offset - decompressed_offset
 		if length > 0:
@@ -151,7 +164,7 @@ class MDictReader(BaseReader):
 
 		return record_null.strip().decode(self._mdict._encoding)
 
-	def _get_record_v1v2(self, f, offset: int, length: int) -> str:
+	def _get_record_v1v2(self, f, offset: int, length: int, record_blocks: dict[int, bytes]) -> str:
 		f.seek(self._mdict._record_block_offset)
 
 		num_record_blocks = self._mdict._read_number(f)
@@ -171,28 +184,34 @@ class MDictReader(BaseReader):
 			decompressed_offset += decompressed_size
 			compressed_offset += compressed_size
 
-		f.seek(compressed_offset)
-		block_compressed = f.read(compressed_size)
-		block_type = block_compressed[:4]
-		adler32 = struct.unpack('>I', block_compressed[4:8])[0]
-		# no compression
-		if block_type == b'\x00\x00\x00\x00':
-			record_block = block_compressed[8:]
-		# lzo compression
-		elif block_type == b'\x01\x00\x00\x00':
-			# LZO compression is used for engine version < 2.0
-			if lzo_is_c:
-				header = b'\xf0' + struct.pack('>I', decompressed_size)
-				record_block = lzo.decompress(header + block_compressed[8:])
-			else:
-				record_block = lzo.decompress(block_compressed[8:], initSize=decompressed_size, blockSize=1308672)
-		# zlib compression
-		elif block_type == b'\x02\x00\x00\x00':
-			# decompress
-			record_block = zlib.decompress(block_compressed[8:])
-		# notice that adler32 return signed value
-		assert (adler32 == zlib.adler32(record_block) & 0xffffffff)
-		assert (len(record_block) == decompressed_size)
+		if (record_block := record_blocks.get(decompressed_offset)) is None:
+			f.seek(compressed_offset)
+			block_compressed = f.read(compressed_size)
+			block_type = block_compressed[:4]
+			adler32 = struct.unpack('>I', block_compressed[4:8])[0]
+			with metrics.stage('decompress'):
+				# no compression
+				if block_type == b'\x00\x00\x00\x00':
+					record_block = block_compressed[8:]
+				# lzo compression
+				elif block_type == b'\x01\x00\x00\x00':
+					# LZO compression is used for engine version < 2.0
+					if lzo_is_c:
+						header = b'\xf0' + struct.pack('>I', decompressed_size)
+						record_block = lzo.decompress(header + block_compressed[8:])
+					else:
+						record_block = lzo.decompress(block_compressed[8:],
+													  initSize=decompressed_size,
+													  blockSize=1308672)
+				# zlib compression
+				elif block_type == b'\x02\x00\x00\x00':
+					# decompress
+					record_block = zlib.decompress(block_compressed[8:])
+				# notice that adler32 return signed value
+				assert (adler32 == zlib.adler32(record_block) & 0xffffffff)
+			assert (len(record_block) == decompressed_size)
+			record_blocks.clear()
+			record_blocks[decompressed_offset] = record_block
 
 		record_start = offset - decompressed_offset
 		if length > 0:
@@ -206,24 +225,27 @@ class MDictReader(BaseReader):
 			mdict_fp = self._content
 		else:
 			mdict_fp = open(self.filename, 'rb')
-		records = [self._get_record(mdict_fp, offset, length) for offset, length in locations]
+		record_blocks = dict()
+		with metrics.stage('read'): # less the decompression of the record blocks
+			records = [self._get_record(mdict_fp, offset, length, record_blocks) for offset, length in locations]
 		if not self._loaded_content_into_memory:
 			mdict_fp.close()
 		return records
 
-	def get_definition_by_key(self, entry: str) -> str:
-		locations = db_manager.get_entries(entry, self.name)
+	def get_definition_by_locations(self, locations: list[tuple[str, int, int]]) -> str:
 		# word is not used in mdict, which is present in the article itself.
 		locations = [(offset, length) for word, offset, length in locations]
 		records = self._get_records_in_batch(locations)
 		# Cleaning up HTML actually takes some time to complete
-		with concurrent.futures.ThreadPoolExecutor(len(records)) as executor:
-			records = list(executor.map(self.html_cleaner.clean, records))
+		records = self._map(self.html_cleaner.clean, records)
 		return self._ARTICLE_SEPARATOR.join(records)
 
+	def _get_records_of_locations(self, locations: list[tuple[str, int, int]]) -> list[list[str]]:
+		records = self._get_records_in_batch([(offset, length) for word, offset, length in locations])
+		return [[record] for record in self._map(self.html_cleaner.clean, records)]
+
 	def get_definition_by_word(self, headword: str) -> str:
 		locations = db_manager.get_entries_with_headword(headword, self.name)
 		records = self._get_records_in_batch([(offset, length) for offset, length in locations])
-		with concurrent.futures.ThreadPoolExecutor(len(records)) as executor:
-			records = list(executor.map(self.html_cleaner.clean, records))
+		records = self._map(self.html_cleaner.clean, records)
 		return self._ARTICLE_SEPARATOR.join(records)
@@ -15,6 +15,16 @@ class XdxfCleaner:
 
 		self._transformer = XdxfTransformer(encoding='utf-8')
 
+	def __getstate__(self) -> dict:
+		# The XSLT transformer cannot be pickled, so a conversion process makes its own
+		state = self.__dict__.copy()
+		del state['_transformer']
+		return state
+
+	def __setstate__(self, state: dict) -> None:
+		self.__dict__.update(state)
+		self._transformer = XdxfTransformer(encoding='utf-8')
+
 	def clean(self, xdxf: str) -> str:
 		"""
 		Returns HTML that should be further cleaned.
@@ -1,7 +1,11 @@
+import itertools
 import os
 import pickle
+from typing import Generator
 from .base_reader import BaseReader
+from ..executors import BoundedExecutor
 from .. import db_manager
+from .. import metrics
 from .stardict import IdxFileReader, IfoFileReader, SynFileReader, DictFileReader, HtmlCleaner
 import logging
 
@@ -18,11 +22,44 @@ except ImportError:
 	from .stardict import XdxfCleaner
 
 
+class _MarkupConverter:
+	"""
+	Converts the records to HTML according to their cttype, without the synonyms, which the reader adds.
+	Kept apart from the reader, so that it can be sent to the conversion processes.
+	"""
+	def __init__(self, name: str, html_cleaner: HtmlCleaner) -> None:
+		self._name = name
+		self._html_cleaner = html_cleaner
+		if not xdxf2html_found:
+			self._xdxf_cleaner = XdxfCleaner()
+
+	def convert(self, record: tuple[str, str, str]) -> str:
+		"""
+		Takes a tuple (cttype, article, headword) and returns valid HTML.
+		"""
+		cttype, article, headword = record
+		match cttype:
+			case 'm' | 't' | 'y':
+				# text, wrap in <p>
+				return f'<h3 class="headword">{headword}</h3>' +\
+					'<p>' + article.replace('\n', '<br/>') + '</p>'
+			case 'x':
+				if xdxf2html_found:
+					return xdxf2html.convert(article, self._name)
+				else:
+					return self._html_cleaner.clean(self._xdxf_cleaner.clean(article), headword)
+			case 'h' | 'g':
+				return self._html_cleaner.clean(article, headword)
+			case _:
+				raise ValueError(f'Unknown cttype {cttype}')
+
+
 class StarDictReader(BaseReader):
 	"""
 	Adapted from stardictutils.py by J.F. Dockes.
 	"""
 	CTTYPES = ['m', 't', 'y', 'g', 'x', 'h']
+	_CONVERSION_STAGE = 'convert_markup'
 
 	@staticmethod
 	def _stardict_filenames(base_filename: str) -> tuple[str, str, str, str]:
@@ -39,23 +76,17 @@ class StarDictReader(BaseReader):
 				 filename: str, # .ifo
 				 display_name: str,
 				 load_synonyms: bool = False,
-				 load_content_into_memory: bool = False) -> None:
-		super().__init__(name, filename, display_name)
+				 load_content_into_memory: bool = False,
+				 executor: BoundedExecutor | None = None) -> None:
+		super().__init__(name, filename, display_name, executor)
 		filename_no_extension, extension = os.path.splitext(filename)
 		self._ifofile, idxfile, self._dictfile, synfile = self._stardict_filenames(filename_no_extension)
 		self._syn_pickle_filename = os.path.join(self._CACHE_ROOT, self.name + '.syn')
 		self._load_synonyms = load_synonyms
 
 		if not db_manager.dictionary_exists(self.name):
-			db_manager.drop_index()
 			idx_reader = IdxFileReader(idxfile)
-			for word_str in idx_reader._word_idx:
-				spans = idx_reader.get_index_by_word(word_str)
-				word_decoded = word_str.decode('utf-8')
-				for offset, size in spans:
-					db_manager.add_entry(self.simplify(word_decoded), self.name, word_decoded, offset, size)
-			db_manager.commit()
-			db_manager.create_index()
+			db_manager.add_entries(self._entries_to_index(idx_reader))
 			logger.info(f'Entries of dictionary {self.name} added to database')
 
 		if not os.path.isfile(self._syn_pickle_filename):
@@ -85,9 +116,21 @@ class StarDictReader(BaseReader):
 			self._content_dictfile = DictFileReader(self._dictfile, self._ifo_reader, None, True)
 
 		# The constructor of the html cleaner will link the resources directory
-		self._html_cleaner = HtmlCleaner(self.name, os.path.dirname(self.filename), self._resources_dir)
-		if not xdxf2html_found:
-			self._xdxf_cleaner = XdxfCleaner()
+		self._markup_converter = _MarkupConverter(self.name,
+												  HtmlCleaner(self.name,
+															  os.path.dirname(self.filename),
+															  self._resources_dir))
+
+	def _entries_to_index(self, idx_reader: IdxFileReader) -> Generator[tuple[str, str, str, int, int], None, None]:
+		"""
+		Yields (key, dictionary_name, word, offset, size) for every span in the .idx file.
+		"""
+		for word_str in idx_reader._word_idx:
+			spans = idx_reader.get_index_by_word(word_str)
+			word_decoded = word_str.decode('utf-8')
+			key = self.simplify(word_decoded)
+			for offset, size in spans:
+				yield key, self.name, word_decoded, offset, size
 
 	def _get_records(self, dict_reader: DictFileReader, offset: int, size: int) -> list[tuple[str, str]]:
 		"""
@@ -119,47 +162,38 @@ class StarDictReader(BaseReader):
 									 			for synonym in self._synonyms[word]]) + '</div>'
 		return ''
 
-	def _clean_up_markup(self, record: tuple[str, str], headword: str) -> str:
-		"""
-		Cleans up the markup according the cttype and returns valid HTML.
-		"""
-		cttype, article = record
-		match cttype:
-			case 'm' | 't' | 'y':
-				# text, wrap in <p>
-				return f'<h3 class="headword">{headword}</h3>' +\
-					'<p>' + article.replace('\n', '<br/>') + '</p>'
-			case 'x':
-				if xdxf2html_found:
-					return xdxf2html.convert(article, self.name) + self._get_synonyms(headword)
-				else:
-					return self._html_cleaner.clean(self._xdxf_cleaner.clean(article), headword) +\
-						self._get_synonyms(headword)
-			case 'h' | 'g':
-				return self._html_cleaner.clean(article, headword) + self._get_synonyms(headword)
-			case _:
-				raise ValueError(f'Unknown cttype {cttype}')
-
-	def _get_records_in_batch(self, locations: list[tuple[str, int, int]]) -> list[str]:
+	def _get_records_of_locations(self, locations: list[tuple[str, int, int]]) -> list[list[str]]:
 		if not os.path.isfile(self._dictfile): # it is possible that it is not dictzipped
 			from idzip.command import _compress
 			class Options:
 				suffix = '.dz'
 				keep = False
 			_compress(self._dictfile[:-len(Options.suffix)], Options)
-		if self._loaded_content_into_memory:
-			dict_reader = self._content_dictfile
-		else:
-			dict_reader = DictFileReader(self._dictfile, self._ifo_reader, None)
 		records = []
-		for word, offset, size in locations:
-			records.extend([self._clean_up_markup(r, word) for r in self._get_records(dict_reader, offset, size)])
-		if not self._loaded_content_into_memory:
-			dict_reader.close()
-		return records
-
-	def get_definition_by_key(self, entry: str) -> str:
-		locations = db_manager.get_entries(entry, self.name)
+		nums_records = []
+		with metrics.stage('read'): # including the decompression of dictzip
+			if self._loaded_content_into_memory:
+				dict_reader = self._content_dictfile
+			else:
+				dict_reader = DictFileReader(self._dictfile, self._ifo_reader, None)
+			for word, offset, size in locations:
+				records_of_location = self._get_records(dict_reader, offset, size)
+				records.extend([(cttype, article, word) for cttype, article in records_of_location])
+				nums_records.append(len(records_of_location))
+			if not self._loaded_content_into_memory:
+				dict_reader.close()
+		articles = self._map(self._markup_converter.convert, records)
+		articles = [article + self._get_synonyms(headword) if cttype in ('x', 'h', 'g') else article
+					for (cttype, _, headword), article in zip(records, articles)]
+		ends = list(itertools.accumulate(nums_records))
+		return [articles[end - num_records:end] for end, num_records in zip(ends, nums_records)]
+
+	def _get_records_in_batch(self, locations: list[tuple[str, int, int]]) -> list[str]:
+		return [article
+				for articles_of_location in self._get_records_of_locations(locations)
+				for article in articles_of_location]
+
+	def get_definition_by_locations(self, locations: list[tuple[str, int, int]]) -> str:
 		records = self._get_records_in_batch(locations)
 		return self._ARTICLE_SEPARATOR.join(records)
 
@@ -0,0 +1,203 @@
+"""
+Thread pools shared by all the requests, created once by Dictionaries, instead of one pool per request.
+The tasks run in the context of the submitting thread, so that their stages are timed for its operation (see metrics).
+Tasks of the I/O executor (reading the articles of the dictionaries of a group) may wait for tasks of the CPU executor
+(cleaning up and converting the records), never the other way round, so that the bounded pools cannot deadlock.
+The CPU executor can be replaced by a pool of processes (ProcessExecutor), for the conversion to use more than one core.
+"""
+
+import concurrent.futures
+import concurrent.futures.process
+import itertools
+import multiprocessing
+import pickle
+import threading
+import types
+import weakref
+from collections import OrderedDict
+from typing import Callable, Iterable, Iterator, TypeVar
+from . import metrics
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+class BoundedExecutor:
+	"""
+	A fixed number of threads, and the count of the tasks waiting for one of them (the queue depth).
+	"""
+	def __init__(self, name: str, max_workers: int) -> None:
+		self.name = name
+		self.max_workers = max_workers
+		self._executor = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix=name)
+		self._num_queued = 0
+		self._num_running = 0
+		self._lock = threading.Lock()
+
+	def _run(self, function: Callable[[T], R], item: T) -> R:
+		with self._lock:
+			self._num_queued -= 1
+			self._num_running += 1
+		try:
+			return function(item)
+		finally:
+			with self._lock:
+				self._num_running -= 1
+
+	def _submit_all(self, function: Callable[[T], R], items: list[T]) -> list[concurrent.futures.Future]:
+		with self._lock:
+			self._num_queued += len(items)
+		return [self._executor.submit(metrics.task_context().run, self._run, function, item) for item in items]
+
+	def map(self, function: Callable[[T], R], items: Iterable[T]) -> list[R]:
+		"""
+		Returns the results in the order of the items, raising the exception of the first failed item if any.
+		A single item is processed in the calling thread.
+		"""
+		items = list(items)
+		if len(items) < 2:
+			return [function(item) for item in items]
+		return [future.result() for future in self._submit_all(function, items)]
+
+	def run(self, function: Callable[[T], None], items: Iterable[T]) -> None:
+		"""
+		Applies function to the items for its side effects and waits for all of them.
+		Failures are logged, so that one dictionary cannot make a whole query fail.
+		A single item is processed in the calling thread.
+		"""
+		items = list(items)
+		if len(items) < 2:
+			for item in items:
+				try:
+					function(item)
+				except Exception:
+					logger.exception(f'Task of the {self.name} executor failed')
+			return
+		for future in self._submit_all(function, items):
+			if (exception := future.exception()) is not None:
+				logger.error(f'Task of the {self.name} executor failed', exc_info=exception)
+
+	def as_completed(self, function: Callable[[T], R], items: Iterable[T]) -> Iterator[tuple[T, R]]:
+		"""
+		Yields (item, result) as soon as each item is processed, failures being logged and skipped as with run().
+		A single item is processed in the calling thread.
+		"""
+		items = list(items)
+		if len(items) < 2:
+			for item in items:
+				try:
+					yield item, function(item)
+				except Exception:
+					logger.exception(f'Task of the {self.name} executor failed')
+			return
+		futures = dict(zip(self._submit_all(function, items), items))
+		for future in concurrent.futures.as_completed(futures.keys()):
+			if (exception := future.exception()) is not None:
+				logger.error(f'Task of the {self.name} executor failed', exc_info=exception)
+			else:
+				yield futures[future], future.result()
+
+	def statistics(self) -> dict[str, int]:
+		with self._lock:
+			return {'workers': self.max_workers, 'running': self._num_running, 'queued': self._num_queued}
+
+	def shutdown(self) -> None:
+		self._executor.shutdown(wait=True)
+
+
+# Converters unpickled by a conversion process, by token, the least recently used first.
+# Bounded, as the tokens of the converters collected in the main process are never seen again.
+_MAX_CONVERTERS = 64
+_converters: OrderedDict[int, object] = OrderedDict()
+
+
+def _started() -> None:
+	pass
+
+
+def _convert(token: int, converter_state: bytes, method_name: str, items: list) -> list:
+	"""
+	Runs in a conversion process, which unpickles each converter the first time it receives it.
+	"""
+	if (converter := _converters.get(token)) is None:
+		converter = _converters[token] = pickle.loads(converter_state)
+		if len(_converters) > _MAX_CONVERTERS:
+			_converters.popitem(last=False)
+	else:
+		_converters.move_to_end(token)
+	method = getattr(converter, method_name)
+	return [method(item) for item in items]
+
+
+def _apply(function: Callable[[T], R], items: list[T]) -> list[R]:
+	return [function(item) for item in items]
+
+
+class ProcessExecutor:
+	"""
+	Stands in for the CPU executor in the readers (map() only), converting the records in processes, outside the GIL.
+	The function must be picklable: a module-level function (or a partial of one), or a method of a converter
+	(DSLConverter, HTMLCleaner...). A converter is pickled once, and each process keeps the first copy it receives,
+	so that afterwards only the records and the HTML travel between the processes.
+	"""
+	def __init__(self, name: str, max_workers: int) -> None:
+		self.name = name
+		self.max_workers = max_workers
+		# Not forked, as the connections to the databases of this process must not be shared
+		self._executor = concurrent.futures.ProcessPoolExecutor(max_workers,
+																mp_context=multiprocessing.get_context('spawn'))
+		self._states: weakref.WeakKeyDictionary[object, tuple[int, bytes]] = weakref.WeakKeyDictionary()
+		self._tokens = itertools.count()
+		self._num_chunks = 0
+		self._broken = False
+		self._lock = threading.Lock()
+		# Started now, as each process imports the app, rather than by the first queries
+		for _ in range(max_workers):
+			self._executor.submit(_started)
+
+	def _task(self, function: Callable[[T], R]) -> tuple[Callable, tuple]:
+		converter = getattr(function, '__self__', None)
+		if converter is None or isinstance(converter, types.ModuleType):
+			return _apply, (function,)
+		with self._lock:
+			if (state := self._states.get(converter)) is None:
+				state = self._states[converter] = (next(self._tokens), pickle.dumps(converter))
+		return _convert, (*state, function.__name__)
+
+	def map(self, function: Callable[[T], R], items: Iterable[T]) -> list[R]:
+		"""
+		Returns the results in the order of the items, raising the exception of the first failed item if any.
+		The items are sent in one chunk per process, as sending each one would cost more than converting it.
+		If the processes died, the items are processed in the calling thread.
+		"""
+		items = list(items)
+		if len(items) == 0 or self._broken:
+			return [function(item) for item in items]
+		task, arguments = self._task(function)
+		chunk_size = -(-len(items) // self.max_workers)
+		chunks = [items[i:i+chunk_size] for i in range(0, len(items), chunk_size)]
+		with self._lock:
+			self._num_chunks += len(chunks)
+		try:
+			futures = [self._executor.submit(task, *arguments, chunk) for chunk in chunks]
+			return [result for future in futures for result in future.result()]
+		except concurrent.futures.process.BrokenProcessPool:
+			logger.exception(f'Processes of the {self.name} executor died, converting in threads from now on')
+			self._broken = True
+			return [function(item) for item in items]
+		finally:
+			with self._lock:
+				self._num_chunks -= len(chunks)
+
+	def statistics(self) -> dict[str, int]:
+		with self._lock:
+			return {'workers': self.max_workers,
+					'running': min(self._num_chunks, self.max_workers),
+					'queued': max(self._num_chunks - self.max_workers, 0)}
+
+	def shutdown(self) -> None:
+		self._executor.shutdown(wait=True)
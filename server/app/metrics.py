@@ -0,0 +1,242 @@
+"""
+Lightweight timers of the stages of the lookups (SQLite, file reads, decompression, conversion, OpenCC, templating...)
+and of each dictionary, aggregated into histograms by operation, which /api/metrics exposes in the Prometheus text format
+together with the counters of requests and caches and the depths of the queues of the executors.
+The timings of an operation are held in a context variable, which the executors copy into the threads of its tasks,
+so that the stages run there are counted in the operation they belong to. Outside operations, the timers do nothing.
+"""
+
+import bisect
+import contextvars
+import threading
+import time
+from typing import Callable, Iterable, TypeVar
+from .settings import Settings
+
+R = TypeVar('R')
+
+
+def _escape(label_value: str) -> str:
+	return label_value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(label_names: Iterable[str], label_values: Iterable[str]) -> str:
+	labels = ','.join(f'{name}="{_escape(str(value))}"' for name, value in zip(label_names, label_values))
+	return '{' + labels + '}' if labels else ''
+
+
+def format_metric(name: str, kind: str, description: str, label_names: tuple[str, ...],
+				  samples: Iterable[tuple[tuple, float]]) -> str:
+	"""
+	The text of a counter or gauge, each sample being (label values, value).
+	"""
+	lines = [f'# HELP {name} {description}', f'# TYPE {name} {kind}']
+	lines.extend(f'{name}{_labels(label_names, label_values)} {value}' for label_values, value in samples)
+	return '\n'.join(lines) + '\n'
+
+
+class Counter:
+	def __init__(self, name: str, description: str, label_names: tuple[str, ...]) -> None:
+		self.name = name
+		self.description = description
+		self.label_names = label_names
+		self._values: dict[tuple[str, ...], int] = dict()
+		self._lock = threading.Lock()
+
+	def inc(self, label_values: tuple[str, ...], amount: int = 1) -> None:
+		with self._lock:
+			self._values[label_values] = self._values.get(label_values, 0) + amount
+
+	def exposition(self) -> str:
+		with self._lock:
+			samples = sorted(self._values.items())
+		return format_metric(self.name, 'counter', self.description, self.label_names, samples)
+
+
+class Histogram:
+	"""
+	Observations counted in buckets by upper bound (in seconds), by the values of the labels.
+	"""
+	def __init__(self, name: str, description: str, label_names: tuple[str, ...],
+				 buckets: tuple[float, ...] = Settings.METRICS_BUCKETS) -> None:
+		self.name = name
+		self.description = description
+		self.label_names = label_names
+		self.buckets = buckets
+		# label values -> [counts of the buckets (+Inf last), not cumulated, sum]
+		self._series: dict[tuple[str, ...], list] = dict()
+		self._lock = threading.Lock()
+
+	def observe(self, label_values: tuple[str, ...], value: float) -> None:
+		i = bisect.bisect_left(self.buckets, value)
+		with self._lock:
+			if (series := self._series.get(label_values)) is None:
+				series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+			series[0][i] += 1
+			series[1] += value
+
+	def exposition(self) -> str:
+		with self._lock:
+			series = sorted((label_values, list(counts), total)
+							for label_values, (counts, total) in self._series.items())
+		lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+		label_names_bucket = self.label_names + ('le',)
+		for label_values, counts, total in series:
+			count = 0
+			for upper_bound, count_of_bucket in zip(self.buckets + (float('inf'),), counts):
+				count += count_of_bucket
+				le = '+Inf' if upper_bound == float('inf') else repr(upper_bound)
+				lines.append(f'{self.name}_bucket{_labels(label_names_bucket, label_values + (le,))} {count}')
+			lines.append(f'{self.name}_sum{_labels(self.label_names, label_values)} {total}')
+			lines.append(f'{self.name}_count{_labels(self.label_names, label_values)} {count}')
+		return '\n'.join(lines) + '\n'
+
+
+OPERATION_SECONDS = Histogram('silverdict_operation_seconds',
+							  'Time taken by the operations '
+							  '(query, suggestions, query_anki, query_batch, anki_batch, full_text_search).',
+							  ('operation',))
+STAGE_SECONDS = Histogram('silverdict_stage_seconds',
+						  'Time spent in each stage of an operation, summed over its threads.',
+						  ('operation', 'stage'))
+DICTIONARY_SECONDS = Histogram('silverdict_dictionary_seconds',
+							   'Time taken by each dictionary to produce its article in an operation.',
+							   ('operation', 'dictionary'))
+HTTP_REQUESTS = Counter('silverdict_http_requests_total',
+						'HTTP requests handled, by endpoint and status.',
+						('endpoint', 'status'))
+
+
+class Timings:
+	"""
+	Seconds spent by an operation in each stage, exclusive of the stages nested in it, and in each dictionary.
+	"""
+	def __init__(self, operation_name: str) -> None:
+		self.operation_name = operation_name
+		self.stages: dict[str, float] = dict()
+		self.dictionaries: dict[str, float] = dict()
+		self.total = 0.0
+		self.discarded = False
+		self._lock = threading.Lock()
+
+	def add(self, totals: dict[str, float], name: str, seconds: float) -> None:
+		with self._lock:
+			totals[name] = totals.get(name, 0.0) + seconds
+
+	def server_timing(self) -> str:
+		"""
+		The value of a Server-Timing header, in milliseconds.
+		"""
+		with self._lock:
+			stages = list(self.stages.items())
+		return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in stages + [('total', self.total)])
+
+
+_timings: contextvars.ContextVar[Timings | None] = contextvars.ContextVar('timings', default=None)
+# The stage being timed in the thread, whose own time excludes that of the stages nested in it
+_stage: contextvars.ContextVar['_Timer | None'] = contextvars.ContextVar('stage', default=None)
+
+
+class _Timer:
+	__slots__ = ('_name', '_of_dictionary', '_timings', '_time_started', '_time_nested', '_token')
+
+	def __init__(self, name: str, of_dictionary: bool) -> None:
+		self._name = name
+		self._of_dictionary = of_dictionary
+		self._time_nested = 0.0
+
+	def __enter__(self) -> None:
+		self._timings = _timings.get()
+		if self._timings is not None:
+			if not self._of_dictionary:
+				self._token = _stage.set(self)
+			self._time_started = time.perf_counter()
+
+	def __exit__(self, *exc_info) -> None:
+		if self._timings is None:
+			return
+		seconds = time.perf_counter() - self._time_started
+		if self._of_dictionary:
+			self._timings.add(self._timings.dictionaries, self._name, seconds)
+			return
+		_stage.reset(self._token)
+		if (outer := _stage.get()) is not None:
+			outer._time_nested += seconds
+		self._timings.add(self._timings.stages, self._name, seconds - self._time_nested)
+
+
+def task_context() -> contextvars.Context:
+	"""
+	The context in which to run a task submitted to another thread: that of the operation, without the stage
+	being timed in this thread.
+	"""
+	context = contextvars.copy_context()
+	if context.get(_stage) is not None:
+		context.run(_stage.set, None)
+	return context
+
+
+def stage(name: str) -> _Timer:
+	"""
+	with metrics.stage('sqlite'): times the block as a stage of the current operation.
+	"""
+	return _Timer(name, False)
+
+
+def dictionary(name: str) -> _Timer:
+	"""
+	with metrics.dictionary(dictionary_name): times the block as the work of a dictionary for the current operation.
+	"""
+	return _Timer(name, True)
+
+
+def timed_by_dictionary(function: Callable[[str], R]) -> Callable[[str], R]:
+	"""
+	Decorates a function of a dictionary name, to time each call with dictionary().
+	"""
+	def function_timed(dictionary_name: str) -> R:
+		with dictionary(dictionary_name):
+			return function(dictionary_name)
+	return function_timed
+
+
+class operation:
+	"""
+	with metrics.operation('query') as timings: the stages timed in the block, in this thread and the tasks of
+	the executors it submits, are recorded in timings and then in the histograms,
+	unless timings.discarded is set or an exception leaves the block.
+	"""
+	def __init__(self, name: str) -> None:
+		self._timings = Timings(name)
+
+	def __enter__(self) -> Timings:
+		# Restored with set() rather than reset(), as a generator timing a stream may be closed in another context
+		self._timings_outer = _timings.get()
+		_timings.set(self._timings)
+		self._time_started = time.perf_counter()
+		return self._timings
+
+	def __exit__(self, exc_type, exc_value, traceback) -> None:
+		timings = self._timings
+		timings.total = time.perf_counter() - self._time_started
+		_timings.set(self._timings_outer)
+		if exc_type is not None:
+			timings.discarded = True
+		if timings.discarded:
+			return
+		OPERATION_SECONDS.observe((timings.operation_name,), timings.total)
+		with timings._lock:
+			stages = list(timings.stages.items())
+			dictionaries = list(timings.dictionaries.items())
+		for stage_name, seconds in stages:
+			STAGE_SECONDS.observe((timings.operation_name, stage_name), seconds)
+		for dictionary_name, seconds in dictionaries:
+			DICTIONARY_SECONDS.observe((timings.operation_name, dictionary_name), seconds)
+
+
+def exposition() -> str:
+	"""
+	The text of the histograms and counters recorded here.
+	"""
+	return ''.join(metric.exposition()
+				   for metric in (OPERATION_SECONDS, STAGE_SECONDS, DICTIONARY_SECONDS, HTTP_REQUESTS))
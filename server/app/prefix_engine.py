@@ -0,0 +1,254 @@
+"""
+An in-memory engine for right-side (prefix) suggestions, which are requested on every keystroke.
+
+The distinct (key, word) of each dictionary are kept sorted in a compact form:
+one contiguous UTF-8 buffer of keys plus an array of their offsets, and the same for words,
+an empty word meaning the same as the key. UTF-8 byte order is code point order, that is, the order of SQLite,
+so a prefix query is a binary search on the bytes and a k-way merge across the dictionaries of a group.
+
+The arrays are saved to <CACHE_ROOT>/<dictionary name>.keys and memory-mapped afterwards,
+so the pages are shared with the OS page cache and only those touched are read.
+
+Memory cost: about 4 bytes * 2 of offsets + the UTF-8 length of the key (~10 bytes for Latin scripts)
++ that of the word if it differs from the key, i.e. 18-25 MB per million keys mapped,
+plus ~1.5 MB per million keys of fences held on the heap.
+"""
+
+import heapq
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+from .settings import Settings
+from . import db_manager
+import logging
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# magic, number of rows of the dictionary in the database (to detect a stale file), number of (key, word),
+# size of the key buffer, size of the word buffer
+_HEADER = struct.Struct('<8sQQQQ')
+_MAGIC = b'SDKEYS01'
+_OFFSET_TYPECODE = 'I'
+_OFFSET_ITEMSIZE = 4
+assert array(_OFFSET_TYPECODE).itemsize == _OFFSET_ITEMSIZE
+# Every _FENCE_INTERVAL-th key is kept as a bytes object, so that most of a binary search runs in C
+_FENCE_INTERVAL = 32
+
+
+def _filename(dictionary_name: str) -> str:
+	return os.path.join(Settings.CACHE_ROOT, dictionary_name + '.keys')
+
+
+def discard(dictionary_name: str) -> None:
+	"""
+	Removes the saved keys of a dictionary, to be called when it is removed or re-indexed.
+	"""
+	try:
+		os.remove(_filename(dictionary_name))
+	except FileNotFoundError:
+		pass
+
+
+def _offsets(buffer: bytes | mmap.mmap, start: int, count: int) -> memoryview | array:
+	view = memoryview(buffer)[start:start + count * _OFFSET_ITEMSIZE]
+	if sys.byteorder == 'little':
+		return view.cast(_OFFSET_TYPECODE)
+	offsets = array(_OFFSET_TYPECODE, view)
+	offsets.byteswap()
+	return offsets
+
+
+class _SortedKeys:
+	"""
+	Supports len() and indexing (the key at i, as UTF-8 bytes), so that bisect can be used directly.
+	"""
+	def __init__(self, buffer: bytes | mmap.mmap) -> None:
+		magic, self.num_rows, num_entries, size_keys, size_words = _HEADER.unpack_from(buffer)
+		if magic != _MAGIC:
+			raise ValueError('Not a keys file.')
+		self._buffer = buffer
+		start = _HEADER.size
+		self._key_offsets = _offsets(buffer, start, num_entries + 1)
+		start += (num_entries + 1) * _OFFSET_ITEMSIZE
+		self._word_offsets = _offsets(buffer, start, num_entries + 1)
+		start += (num_entries + 1) * _OFFSET_ITEMSIZE
+		self._start_keys = start
+		self._start_words = start + size_keys
+		self._num_entries = num_entries
+		self._fences = [self[i] for i in range(0, num_entries, _FENCE_INTERVAL)]
+
+	def __len__(self) -> int:
+		return self._num_entries
+
+	def __getitem__(self, i: int) -> bytes:
+		return self._buffer[self._start_keys + self._key_offsets[i]:self._start_keys + self._key_offsets[i + 1]]
+
+	def word(self, i: int, key: bytes) -> str:
+		start, end = self._word_offsets[i], self._word_offsets[i + 1]
+		if start == end:
+			return key.decode('utf-8')
+		return self._buffer[self._start_words + start:self._start_words + end].decode('utf-8')
+
+	def _bisect_left(self, key: bytes) -> int:
+		block = bisect_left(self._fences, key)
+		if block == 0:
+			return 0
+		return bisect_left(self,
+						   key,
+						   (block - 1) * _FENCE_INTERVAL,
+						   min(block * _FENCE_INTERVAL, self._num_entries))
+
+	def lower_bound(self, prefix: bytes, after: bytes | None) -> int:
+		"""
+		Index of the first key not less than prefix and greater than after, if given.
+		"""
+		# Keys contain no NUL, so after + NUL is the least key greater than after
+		return self._bisect_left(max(prefix, after + b'\0') if after is not None else prefix)
+
+	def contains(self, key: bytes) -> bool:
+		i = self._bisect_left(key)
+		return i < self._num_entries and self[i] == key
+
+	@staticmethod
+	def write(filename: str, num_rows: int, keys_and_words: Iterable[tuple[str, str]]) -> None:
+		key_offsets = array(_OFFSET_TYPECODE, [0])
+		word_offsets = array(_OFFSET_TYPECODE, [0])
+		keys = bytearray()
+		words = bytearray()
+		for key, word in keys_and_words:
+			keys += key.encode('utf-8')
+			key_offsets.append(len(keys))
+			if word != key:
+				words += word.encode('utf-8')
+			word_offsets.append(len(words))
+		if sys.byteorder != 'little':
+			key_offsets.byteswap()
+			word_offsets.byteswap()
+		filename_temp = filename + '.tmp'
+		with open(filename_temp, 'wb') as f:
+			f.write(_HEADER.pack(_MAGIC, num_rows, len(key_offsets) - 1, len(keys), len(words)))
+			key_offsets.tofile(f)
+			word_offsets.tofile(f)
+			f.write(keys)
+			f.write(words)
+		os.replace(filename_temp, filename)
+
+
+def _open(filename: str) -> _SortedKeys:
+	with open(filename, 'rb') as f:
+		return _SortedKeys(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def _disjoint_prefixes(keys: list[str]) -> list[str]:
+	prefixes = []
+	for key in sorted(set(keys)):
+		if not prefixes or not key.startswith(prefixes[-1]):
+			prefixes.append(key)
+	return prefixes
+
+
+class PrefixEngine:
+	"""
+	Answers the same queries as db_manager.select_entries_beginning_with()
+	and db_manager.entry_exists_in_dictionaries() without touching the database.
+	"""
+	def __init__(self) -> None:
+		self._sorted_keys: dict[str, _SortedKeys] = dict()
+		self._lock = threading.Lock()
+
+	def add(self, dictionary_name: str) -> None:
+		"""
+		Loads the saved keys of a dictionary, (re)building them from the database if missing or stale.
+		"""
+		filename = _filename(dictionary_name)
+		num_rows = db_manager.headword_count_of_dictionary(dictionary_name)
+		sorted_keys = None
+		if os.path.isfile(filename):
+			try:
+				sorted_keys = _open(filename)
+			except (ValueError, struct.error):
+				pass
+			if sorted_keys is not None and sorted_keys.num_rows != num_rows:
+				sorted_keys = None # unmapped once no longer referenced
+		if sorted_keys is None:
+			_SortedKeys.write(filename, num_rows, db_manager.get_keys_and_words(dictionary_name))
+			sorted_keys = _open(filename)
+			logger.info(f'Sorted keys of {dictionary_name} built.')
+		with self._lock:
+			self._sorted_keys[dictionary_name] = sorted_keys
+
+	def remove(self, dictionary_name: str) -> None:
+		"""
+		The file is left to discard().
+		The mapping is not closed explicitly, as a query may still be walking it.
+		"""
+		with self._lock:
+			self._sorted_keys.pop(dictionary_name, None)
+
+	def covers(self, names_dictionaries: list[str]) -> bool:
+		"""
+		Whether the keys of all the dictionaries are loaded, which is not the case while they are being opened.
+		"""
+		return all(name in self._sorted_keys for name in names_dictionaries)
+
+	def _of(self, names_dictionaries: list[str]) -> list[_SortedKeys]:
+		return [sorted_keys
+				for sorted_keys in (self._sorted_keys.get(name) for name in names_dictionaries)
+				if sorted_keys is not None]
+
+	def select_entries_beginning_with(self,
+									  keys: list[str],
+									  names_dictionaries: list[str],
+									  words_already_found: list[str],
+									  limit: int,
+									  after: str | None = None,
+									  with_keys: bool = False) -> list[str] | list[tuple[str, str]]:
+		"""
+		Same semantics as db_manager.select_entries_beginning_with().
+		"""
+		num_words = limit - len(words_already_found)
+		if num_words <= 0 or not keys:
+			return []
+		words_already_found = set(words_already_found)
+		sorted_keys_of_group = self._of(names_dictionaries)
+		if after is not None:
+			after = after.encode('utf-8')
+		words = dict() # insertion-ordered set
+		keys_and_words = dict()
+		last_key = None
+		for prefix in _disjoint_prefixes(keys):
+			prefix = prefix.encode('utf-8')
+			# k-way merge on (key, position in the group, index), advancing one dictionary at a time
+			heap = []
+			for j, sorted_keys in enumerate(sorted_keys_of_group):
+				i = sorted_keys.lower_bound(prefix, after)
+				if i < len(sorted_keys) and (key := sorted_keys[i]).startswith(prefix):
+					heap.append((key, j, i))
+			heapq.heapify(heap)
+			while heap:
+				key, j, i = heap[0]
+				if len(words) >= num_words and key != last_key:
+					return list(keys_and_words) if with_keys else list(words)
+				sorted_keys = sorted_keys_of_group[j]
+				word = sorted_keys.word(i, key)
+				if word not in words_already_found:
+					words[word] = None
+					if with_keys:
+						keys_and_words[(key.decode('utf-8'), word)] = None
+					last_key = key
+				i += 1
+				if i < len(sorted_keys) and (key := sorted_keys[i]).startswith(prefix):
+					heapq.heapreplace(heap, (key, j, i))
+				else:
+					heapq.heappop(heap)
+		return list(keys_and_words) if with_keys else list(words)
+
+	def entry_exists_in_dictionaries(self, key: str, names_dictionaries: list[str]) -> bool:
+		key = key.encode('utf-8')
+		return any(sorted_keys.contains(key) for sorted_keys in self._of(names_dictionaries))
@@ -0,0 +1,64 @@
+"""
+Handles on the readers of the dictionaries, which are opened on first use, so that the server can start accepting
+requests before the readers are constructed (pickles unpickled, resources scanned, new dictionaries indexed).
+Dictionaries warms them up in the background, and a request for a dictionary not open yet waits for that one only.
+"""
+
+import concurrent.futures
+import threading
+from typing import Callable
+from .dicts import BaseReader
+from . import metrics
+
+
+class ReaderHandle:
+	"""
+	The reader is opened by calling opener once, in the first thread that needs it, the others waiting for it.
+	If the dictionary is being indexed by another process (indexing), it is opened once that is done;
+	if that failed, opening the reader indexes it here.
+	"""
+	def __init__(self,
+				 opener: Callable[[], BaseReader],
+				 indexing: concurrent.futures.Future | None = None) -> None:
+		self._opener = opener
+		self._indexing = indexing
+		self._reader: BaseReader | None = None
+		self._exception: Exception | None = None
+		self._lock = threading.Lock()
+
+	def reader(self) -> BaseReader:
+		"""
+		Raises RuntimeError if the reader could not be opened, every time, as the dictionary cannot be read.
+		"""
+		if (reader := self._reader) is not None:
+			return reader
+		with metrics.stage('open'), self._lock:
+			if self._reader is None and self._exception is None:
+				if self._indexing is not None:
+					concurrent.futures.wait([self._indexing])
+				try:
+					self._reader = self._opener()
+				except Exception as e:
+					self._exception = e
+			if self._exception is not None:
+				raise RuntimeError('The dictionary could not be opened') from self._exception
+			return self._reader
+
+	@property
+	def ready(self) -> bool:
+		return self._reader is not None
+
+	@property
+	def state(self) -> str:
+		"""
+		'ready', 'failed', 'indexing' (in another process), 'opening' or 'cold'.
+		"""
+		if self._reader is not None:
+			return 'ready'
+		if self._exception is not None:
+			return 'failed'
+		if self._indexing is not None and not self._indexing.done():
+			return 'indexing'
+		if self._lock.locked():
+			return 'opening'
+		return 'cold'
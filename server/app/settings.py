@@ -115,8 +115,20 @@ class Settings:
 
 	Path(DEFAULT_SOURCE_DIR).mkdir(parents=True, exist_ok=True)
 
-	SQLITE_DB_FILE = os.path.join(APP_RESOURCES_ROOT, 'dictionaries.db')
+	SQLITE_DB_FILE = os.path.join(APP_RESOURCES_ROOT, 'dictionaries.db') # the registry and the ngram table
+	SQLITE_ENTRIES_DIR = os.path.join(APP_RESOURCES_ROOT, 'entries') # one database of entries per dictionary
+	Path(SQLITE_ENTRIES_DIR).mkdir(parents=True, exist_ok=True)
 	SQLITE_LIMIT_VARIABLE_NUMBER = 30000 # The real limit seems to be an arbitrary number choosen by SQLite people: 0x7ffe
+	SQLITE_READ_CONNECTIONS = 8 # size of the pool of read-only connections used by request threads
+	SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+	SQLITE_CACHE_SIZE = -32768 # in KiB when negative, per connection
+	SQLITE_ENTRIES_CACHE_SIZE = -2048 # per connection to the database of a dictionary, most pages being mapped anyway
+	SQLITE_JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024 # the WAL file is truncated to this size after checkpoints
+	SQLITE_VACUUM_STEP_PAGES = 1024 # pages freed per transaction by the incremental vacuum of maintenance
+	SQLITE_VACUUM_STEP_PAUSE = 0.01 # seconds between two steps, so that other writers get their turn
+
+	# Dotted so as not to clash with the resources of a dictionary, also extracted to CACHE_ROOT/<dictionary name>
+	ARTICLE_CACHE_DIR = os.path.join(CACHE_ROOT, '.articles')
 
 	XAPIAN_DIR = os.path.join(APP_RESOURCES_ROOT, 'xapian')
 	XAPIAN_GROUP_NAME = 'Xapian'
@@ -126,13 +138,30 @@ class Settings:
 
 	NGRAM_LEN = 4
 
+	ASGI_SUGGESTIONS_WORKERS = 4 # threads serving the suggestions under the 'asgi' server
+	ASGI_WORKERS = 4 # threads serving the other requests under the 'asgi' server
+	ASGI_KEEP_ALIVE_TIMEOUT = 120 # seconds an idle connection is kept open, as with waitress
+
+	# Upper bounds (in seconds) of the buckets of the histograms of /api/metrics
+	METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+	BATCH_LOOKUP_CHUNK_SIZE = 256 # keys of a batch lookup read together, with one query per chunk
+
+	SUGGESTIONS_CACHE_WINDOWS = 1024 # keys recently typed whose first suggestions are kept, all groups together
+	SUGGESTIONS_CACHE_WINDOW_SIZE = 20 # words kept per key, so that longer keys can be answered from them
+
 	NAME_GROUP_LOADED_INTO_MEMORY = 'Memory'
 
 	def _preferences_valid(self) -> bool:
 		return all(key in self.preferences.keys()
 				   for key in ['listening_address', 'suggestions_mode', 'running_mode'])\
-			  	and self.preferences['suggestions_mode'] in ('right-side', 'both-sides')\
-				and self.preferences['running_mode'] in ('normal', 'preparation', 'server')
+			  	and self.preferences['suggestions_mode'] in ('right-side', 'both-sides', 'both-sides-fts')\
+				and self.preferences['running_mode'] in ('normal', 'preparation', 'server')\
+				and self.preferences['server'] in ('waitress', 'asgi')\
+				and all(isinstance(self.preferences[key], int) and self.preferences[key] > 0
+						for key in ('io_workers', 'cpu_workers', 'startup_io_workers'))\
+				and all(isinstance(self.preferences[key], int) and self.preferences[key] >= 0
+						for key in ('article_cache_size', 'article_disk_cache_size', 'conversion_processes'))
 
 	@classmethod
 	def transform_wildcards(cls, key: str) -> str:
@@ -213,7 +242,8 @@ class Settings:
 		with open(self.PREFERENCES_FILE) as preferences_file:
 			preferences = preferences_file.read()
 		preferences = preferences.replace('suggestions_mode: right-side', '# suggestions_mode: right-side')
-		preferences = preferences.replace('# suggestions_mode: both-sides', 'suggestions_mode: both-sides')
+		# Not the line of both-sides-fts, which begins the same
+		preferences = preferences.replace('# suggestions_mode: both-sides #', 'suggestions_mode: both-sides #')
 		with open(self.PREFERENCES_FILE, 'w') as preferences_file:
 			preferences_file.write(preferences)
 
@@ -224,15 +254,25 @@ class Settings:
 stardict_load_syns: false # often useless, not exactly slow
 suggestions_mode: right-side # instantaneous
 # suggestions_mode: both-sides # slow
+# suggestions_mode: both-sides-fts # uses an FTS5 trigram index maintained per dictionary instead of the ngram table
 ngram_stores_keys: false # the database size would almost double if set to true, but creation is faster
 running_mode: normal # suitable for running locally
 # running_mode: preparation # use before deploying to a server
 # running_mode: server # to be used in a resource-constrained environment
+server: waitress # a fixed pool of threads serving all the requests
+# server: asgi # asyncio event loop with separate threads for suggestions, requires uvicorn and a2wsgi
 # chinese_preference: cn
 # chinese_preference: tw
 chinese_preference: none
 check_for_updates: false
-full_text_search_diacritic_insensitive: false''')
+full_text_search_diacritic_insensitive: false
+in_memory_suggestions: false # memory-map the sorted keys of the dictionaries for faster suggestions, ~20 MB per million entries
+# io_workers: 8 # threads reading the articles of the dictionaries, shared by all requests (default: number of CPUs + 4)
+# cpu_workers: 4 # threads cleaning up and converting the articles, shared by all requests, and processes indexing new dictionaries at startup (default: number of CPUs)
+startup_io_workers: 4 # dictionaries opened at the same time at startup, 1 suits a hard disk
+conversion_processes: 0 # processes converting DSL, MDict, XDXF and Chinese articles instead of the CPU threads, for multi-core machines, 0 to disable
+article_cache_size: 64 # MB of rendered articles kept in memory for repeated lookups, 0 to disable
+article_disk_cache_size: 0 # MB of compressed articles also kept on disk across restarts, 0 to disable''')
 		self.preferences: dict[str, str] = self._read_settings_from_file(self.PREFERENCES_FILE)
 
 		# Backward compatibility
@@ -246,6 +286,22 @@ full_text_search_diacritic_insensitive: false''')
 			self.preferences['check_for_updates'] = False
 		if 'full_text_search_diacritic_insensitive' not in self.preferences.keys():
 			self.preferences['full_text_search_diacritic_insensitive'] = False
+		if 'in_memory_suggestions' not in self.preferences.keys():
+			self.preferences['in_memory_suggestions'] = False
+		if 'io_workers' not in self.preferences.keys():
+			self.preferences['io_workers'] = min(32, (os.cpu_count() or 1) + 4)
+		if 'cpu_workers' not in self.preferences.keys():
+			self.preferences['cpu_workers'] = os.cpu_count() or 1
+		if 'startup_io_workers' not in self.preferences.keys():
+			self.preferences['startup_io_workers'] = 4
+		if 'conversion_processes' not in self.preferences.keys():
+			self.preferences['conversion_processes'] = 0
+		if 'server' not in self.preferences.keys():
+			self.preferences['server'] = 'waitress'
+		if 'article_cache_size' not in self.preferences.keys():
+			self.preferences['article_cache_size'] = 64
+		if 'article_disk_cache_size' not in self.preferences.keys():
+			self.preferences['article_disk_cache_size'] = 0
 
 		if not self._preferences_valid():
 			raise ValueError('Invalid preferences file.')
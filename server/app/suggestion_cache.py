@@ -0,0 +1,110 @@
+"""
+A cache of the right-side (prefix) suggestions for the keys recently typed in each group.
+For every such key, the first entries beginning with it are kept in key order (the window),
+with whether they are all of them. A longer key typed afterwards ('hel', then 'hell') is answered
+by filtering the window of the longest cached prefix, and only goes to the index when the window runs out.
+An empty complete window is a negative result: no longer key can have any entry.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from typing import Callable
+
+
+class SuggestionCache:
+	def __init__(self, max_windows: int, window_size: int) -> None:
+		"""
+		:param max_windows: number of windows kept, least recently used first out
+		:param window_size: number of words fetched for a window, at least the number of suggestions
+		"""
+		self._max_windows = max_windows
+		self._window_size = window_size
+		# (names of the dictionaries of the group, key) -> ((key, word) in key order, complete)
+		self._windows: OrderedDict[tuple[tuple[str, ...], str], tuple[list[tuple[str, str]], bool]] = OrderedDict()
+		self._generation = 0
+		self._lock = threading.Lock()
+		self._num_hits = 0
+		self._num_misses = 0
+
+	@staticmethod
+	def _narrow(window: list[tuple[str, str]],
+				complete: bool,
+				key: str,
+				words_already_found: list[str],
+				num_words: int) -> list[str] | None:
+		"""
+		Same semantics as db_manager.select_entries_beginning_with() on the entries of the window beginning with key,
+		or None if those may not be enough.
+		"""
+		words_already_found = set(words_already_found)
+		words = dict() # insertion-ordered set
+		last_key = None
+		for i in range(bisect_left(window, (key,)), len(window)):
+			key_window, word = window[i]
+			if not key_window.startswith(key):
+				return list(words)
+			if word in words_already_found:
+				continue
+			if len(words) >= num_words and key_window != last_key:
+				return list(words)
+			words[word] = None
+			last_key = key_window
+		# The window ends after all the words of its last key, so the entries after it
+		# are never part of a page that is already full.
+		if complete or len(words) >= num_words:
+			return list(words)
+		return None
+
+	def select_entries_beginning_with(self,
+									  key: str,
+									  names_dictionaries: list[str],
+									  words_already_found: list[str],
+									  limit: int,
+									  select: Callable[[list[str], list[str], list[str], int, str | None, bool],
+													   list[tuple[str, str]]]) -> list[str]:
+		"""
+		Same semantics as db_manager.select_entries_beginning_with() with a single key and no pagination,
+		select being that function or the one of the prefix engine.
+		"""
+		num_words = limit - len(words_already_found)
+		if num_words <= 0:
+			return []
+		names_dictionaries = tuple(names_dictionaries)
+		with self._lock:
+			generation = self._generation
+			for length in range(len(key), -1, -1): # down to the empty key, which has a window too
+				if (window := self._windows.get((names_dictionaries, key[:length]))) is not None:
+					self._windows.move_to_end((names_dictionaries, key[:length]))
+					break
+		if window is not None and (words := self._narrow(*window, key, words_already_found, num_words)) is not None:
+			with self._lock:
+				self._num_hits += 1
+			return words
+
+		window_size = max(self._window_size, limit)
+		keys_and_words = select([key], list(names_dictionaries), [], window_size, None, True)
+		window = (keys_and_words, len(set(word for _, word in keys_and_words)) < window_size)
+		with self._lock:
+			self._num_misses += 1
+			if generation == self._generation:
+				self._windows[(names_dictionaries, key)] = window
+				self._windows.move_to_end((names_dictionaries, key))
+				if len(self._windows) > self._max_windows:
+					self._windows.popitem(last=False)
+		if (words := self._narrow(*window, key, words_already_found, num_words)) is not None:
+			return words
+		# Too many of the window are already found
+		return select([key], list(names_dictionaries), words_already_found, limit, None, False)
+
+	def clear(self) -> None:
+		"""
+		To be called when a dictionary is added, removed or re-indexed.
+		"""
+		with self._lock:
+			self._generation += 1
+			self._windows.clear()
+
+	def statistics(self) -> dict[str, int]:
+		with self._lock:
+			return {'hits': self._num_hits, 'misses': self._num_misses, 'windows': len(self._windows)}
@@ -1,11 +1,28 @@
-from .michaelis import transform_michaelis
-from .oxford_hachette import transform_oxford_hachette
-from .harrap import transform_harrap
-
-transform = {
-	'por-eng_michmoddic_an_1_1': transform_michaelis,
-	'eng-por_michmoddic_an_1_1': transform_michaelis,
-	'eng-fra_hachette-oxford_le_1_3': transform_oxford_hachette,
-	'fra-eng_hachett-oxford_le_1_2': transform_oxford_hachette,
-	'eng-fra_harraps_unabridged_le_1_0': transform_harrap,
-}
+"""
+Fixes for the articles of particular dictionaries, by dictionary name.
+Rules are substitutions, literal() or regex(), made in order by the article pipeline (see article_pipeline),
+which compiles them once; functions of the whole article, in transform, are applied afterwards.
+"""
+
+from typing import Callable
+from ..article_pipeline import Rule
+from .michaelis import rules_michaelis
+from .oxford_hachette import rules_oxford_hachette
+from .harrap import rules_harrap
+
+rules: dict[str, list[Rule]] = dict()
+
+
+def register_rules(names_dictionaries: list[str], rules_of_dictionaries: list[Rule]) -> None:
+	"""
+	To be called at import time, before the articles of the dictionaries are processed.
+	"""
+	for dictionary_name in names_dictionaries:
+		rules.setdefault(dictionary_name, []).extend(rules_of_dictionaries)
+
+
+register_rules(['por-eng_michmoddic_an_1_1', 'eng-por_michmoddic_an_1_1'], rules_michaelis)
+register_rules(['eng-fra_hachette-oxford_le_1_3', 'fra-eng_hachett-oxford_le_1_2'], rules_oxford_hachette)
+register_rules(['eng-fra_harraps_unabridged_le_1_0'], rules_harrap)
+
+transform: dict[str, Callable[[str], str]] = dict()
@@ -1,2 +1,5 @@
-def transform_harrap(html: str) -> str:
-	return html.replace('darkslategray', 'grey')
+from ..article_pipeline import literal
+
+rules_harrap = [
+	literal('darkslategray', 'grey'),
+]
@@ -1,2 +1,7 @@
-def transform_oxford_hachette(html: str) -> str:
-	return html.replace('; ', ';<br />').replace('darkslategray', 'grey').replace('color: darkmagenta', 'font-style: italic')
+from ..article_pipeline import literal
+
+rules_oxford_hachette = [
+	literal('; ', ';<br />'),
+	literal('darkslategray', 'grey'),
+	literal('color: darkmagenta', 'font-style: italic'),
+]
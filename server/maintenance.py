@@ -0,0 +1,20 @@
+"""
+Maintains the databases without starting the server, e.g. from cron:
+statistics for the query planner, incremental vacuum and an integrity check.
+The report is printed as JSON. It may run while the server is running.
+"""
+import json
+import sys
+from app import db_manager
+
+import logging
+
+logging.basicConfig(level=logging.INFO)
+
+if __name__ == '__main__':
+	db_manager.create_table_entries()
+	report = db_manager.maintain()
+	print(json.dumps(report, indent='\t'))
+	if any(report_of_database['integrity'] != ['ok']
+		   for report_of_database in (report['shared'], *report['dictionaries'].values())):
+		sys.exit(1)
@@ -8,6 +8,24 @@ from app import create_app
 import logging
 
 logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def run_server(app, host: str, port: str) -> None:
+	if app.extensions['dictionaries'].settings.preferences['server'] == 'asgi':
+		try:
+			import uvicorn
+			from app.asgi import create_asgi_app
+		except ImportError:
+			logger.warning('uvicorn and a2wsgi are required by the asgi server. Falling back to waitress.')
+		else:
+			uvicorn.run(create_asgi_app(app),
+						host=host,
+						port=int(port),
+						timeout_keep_alive=app.extensions['dictionaries'].settings.ASGI_KEEP_ALIVE_TIMEOUT)
+			return
+	serve(app, listen='%s:%s' % (host, port))
+
 
 if __name__ == '__main__':
 	app = create_app()
@@ -27,9 +45,9 @@ if __name__ == '__main__':
 		update()
 
 	if os.getenv('BROWSER'):  # mainly for use on a-Shell
-		server_thread = threading.Thread(target=lambda: serve(app, listen='%s:%s' % (host, port)))
+		server_thread = threading.Thread(target=lambda: run_server(app, host, port))
 		server_thread.start()
 		webbrowser.open('http://localhost:%s' % port)
 		server_thread.join()
 	else:
-		serve(app, listen='%s:%s' % (host, port))
+		run_server(app, host, port)
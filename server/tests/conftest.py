@@ -0,0 +1,7 @@
+import os
+import sys
+import tempfile
+
+# Settings take their paths from the home directory when the app is imported, so the tests get one of their own
+os.environ['HOME'] = tempfile.mkdtemp(prefix='silverdict-tests-')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,16 @@
+import os
+from app.article_cache import ArticleCache
+from app.settings import Settings
+
+
+def test_disk_tier_is_only_served_with_the_same_fingerprint() -> None:
+	cache = ArticleCache(1024 * 1024, 1024 * 1024, 'fingerprint1')
+	cache.put('dictionary', ('Group', ('key',), None), '<p>article</p>', cache.generation('dictionary'))
+
+	cache = ArticleCache(1024 * 1024, 1024 * 1024, 'fingerprint1')
+	assert cache.get('dictionary', ('Group', ('key',), None)) == '<p>article</p>'
+	assert cache.statistics()['disk_hits'] == 1
+
+	cache = ArticleCache(1024 * 1024, 1024 * 1024, 'fingerprint2')
+	assert cache.get('dictionary', ('Group', ('key',), None)) is None
+	assert not os.path.exists(os.path.join(Settings.ARTICLE_CACHE_DIR, 'v1-fingerprint1'))
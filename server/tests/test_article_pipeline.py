@@ -0,0 +1,19 @@
+from app.article_pipeline import ArticlePipeline, literal, regex
+from app import transformation
+
+
+def test_literal_rules_take_patterns_and_replacements_as_they_are() -> None:
+	pipeline = ArticlePipeline([literal('a.b', r'\1'), literal('&nbsp;', ' '), regex(r'c(.)', r'<\1>')])
+	assert pipeline.process('a.b acb &nbsp; cd') == r'\1 a<b>   <d>'
+
+
+def test_rules_are_applied_in_order_with_the_group_name() -> None:
+	pipeline = ArticlePipeline([regex(r'/api/lookup/([^/]+)/([^/]+)',
+									  lambda match, group_name: f'/api/query/{group_name}/{match.group(2)}'),
+								literal('/api/query/', '/q/')])
+	assert pipeline.process('<a href="/api/lookup/dictionary/word">', 'Group') == '<a href="/q/Group/word">'
+
+
+def test_transformation_rules_keep_their_kind() -> None:
+	pipeline = ArticlePipeline(transformation.rules['por-eng_michmoddic_an_1_1'])
+	assert pipeline.process('• Sense a) one.<i>x</i>') == 'Sense<br />a) one.<br /><i>x</i>'
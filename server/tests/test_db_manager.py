@@ -0,0 +1,58 @@
+import sqlite3
+import threading
+import pytest
+from app import db_manager
+
+
+def test_reader_pool_recovers_from_failed_openings(tmp_path, monkeypatch) -> None:
+	filename = str(tmp_path / 'test.db')
+	connection = sqlite3.connect(filename)
+	connection.execute('create table t (x integer)')
+	connection.execute('insert into t values (1)')
+	connection.commit()
+	connection.close()
+	pool = db_manager._ReaderPool(filename, 2, -1024)
+	open_connection = pool._open
+
+	def fail() -> sqlite3.Connection:
+		raise sqlite3.OperationalError('unable to open database file')
+
+	monkeypatch.setattr(pool, '_open', fail)
+	for _ in range(2): # as many failures as connections in the pool
+		with pytest.raises(sqlite3.OperationalError):
+			with pool.cursor():
+				pass
+	monkeypatch.setattr(pool, '_open', open_connection)
+
+	results = []
+
+	def select() -> None:
+		with pool.cursor() as cursor:
+			results.append(cursor.execute('select x from t').fetchone()[0])
+
+	# In other threads, which a leaked slot would block forever
+	threads = [threading.Thread(target=select, daemon=True) for _ in range(4)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join(timeout=10)
+	assert results == [1] * 4
+
+
+def test_pages_of_entries_beginning_with_cover_every_word_once() -> None:
+	# Several words share some keys, and the punctuation of '!' is simplified away into an empty key
+	db_manager._build_entries_database('pages_a', [('', '!', 0, 1), ('ab', 'ab', 0, 1), ('ab', 'Ab', 0, 1),
+												   ('abc', 'abc', 0, 1), ('b', 'b', 0, 1), ('ba', 'ba', 0, 1)])
+	db_manager._build_entries_database('pages_b', [('aa', 'aa', 0, 1), ('ab', 'AB', 0, 1), ('abd', 'abd', 0, 1),
+												   ('bb', 'bb', 0, 1), ('c', 'c', 0, 1)])
+	names = ['pages_a', 'pages_b']
+	assert db_manager.select_entries_beginning_with([''], names, [], 3) == ['!', 'aa', 'AB', 'ab', 'Ab']
+
+	for keys in ([''], ['a'], ['b', 'a'], ['ab', 'a', 'c']):
+		everything = db_manager.select_entries_beginning_with(keys, names, [], 100, with_keys=True)
+		paged = []
+		after = None
+		while page := db_manager.select_entries_beginning_with(keys, names, [], 2, after, with_keys=True):
+			paged.extend(page)
+			after = page[-1][0]
+		assert paged == everything
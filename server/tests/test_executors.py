@@ -0,0 +1,11 @@
+import pickle
+from app import executors
+
+
+def test_conversion_processes_keep_a_bounded_number_of_converters() -> None:
+	converter_state = pickle.dumps({'key': 'value'})
+	for token in range(executors._MAX_CONVERTERS * 2):
+		assert executors._convert(token, converter_state, 'get', ['key', 'other']) == ['value', None]
+		executors._convert(0, converter_state, 'get', []) # the most recently used is kept
+	assert len(executors._converters) == executors._MAX_CONVERTERS
+	assert 0 in executors._converters and 1 not in executors._converters
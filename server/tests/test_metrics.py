@@ -0,0 +1,43 @@
+import pytest
+from flask import Flask, make_response
+from app import metrics
+from app.api.lookup import _timed
+
+
+def test_operations_of_failed_requests_are_not_recorded() -> None:
+	@_timed('test_failing')
+	def failing_view() -> None:
+		with metrics.stage('test_stage'):
+			pass
+		raise RuntimeError('failed')
+
+	@_timed('test_succeeding')
+	def succeeding_view():
+		with metrics.stage('test_stage'):
+			return make_response('ok')
+
+	with Flask(__name__).test_request_context():
+		with pytest.raises(RuntimeError):
+			failing_view()
+		response = succeeding_view()
+	assert 'test_stage;dur=' in response.headers['Server-Timing']
+	exposition = metrics.exposition()
+	assert 'operation="test_failing"' not in exposition
+	assert 'silverdict_stage_seconds_count{operation="test_succeeding",stage="test_stage"} 1' in exposition
+
+
+def test_batches_are_recorded_once_streamed() -> None:
+	from types import SimpleNamespace
+	from app.api import api
+
+	app = Flask('app')
+	app.register_blueprint(api, url_prefix='/api')
+	app.extensions['dictionaries'] = SimpleNamespace(
+		settings=SimpleNamespace(group_exists=lambda group_name: True),
+		query_anki_batch=lambda group_name, words: ((word, [('test', f'<p>{word}</p>')]) for word in words)
+	)
+	response = app.test_client().post('/api/anki_batch/Default Group', json=['a', 'b'])
+	assert [line.count('<p>') for line in response.get_data(as_text=True).splitlines()] == [1, 1]
+	exposition = metrics.exposition()
+	assert 'silverdict_operation_seconds_count{operation="anki_batch"} 1' in exposition
+	assert 'silverdict_stage_seconds_count{operation="anki_batch",stage="templating"} 1' in exposition
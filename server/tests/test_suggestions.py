@@ -0,0 +1,91 @@
+import os
+import sqlite3
+import struct
+import time
+import pytest
+from flask import Flask
+from app import db_manager
+from app.dictionaries import Dictionaries, simplify
+from app.settings import Settings
+
+WORDS = ['!', 'hello', 'mellow', 'yellow'] # '!' has an empty simplified key
+
+
+def _write_stardict(directory: str, name: str, words: list[str]) -> str:
+	idx = b''
+	articles = b''
+	for word in words:
+		article = f'Definition of {word}'.encode('utf-8')
+		idx += word.encode('utf-8') + b'\0' + struct.pack('>II', len(articles), len(article))
+		articles += article
+	with open(os.path.join(directory, name + '.idx'), 'wb') as idx_file:
+		idx_file.write(idx)
+	with open(os.path.join(directory, name + '.dict'), 'wb') as dict_file:
+		dict_file.write(articles)
+	filename = os.path.join(directory, name + '.ifo')
+	with open(filename, 'w') as ifo_file:
+		ifo_file.write("StarDict's dict ifo file\nversion=2.4.2\n"
+					   f'bookname={name}\nwordcount={len(words)}\nidxfilesize={len(idx)}\nsametypesequence=m\n')
+	return filename
+
+
+def _write_v1_database(dictionary_name: str, words: list[str]) -> None:
+	"""
+	The schema of the versions before 2: all the entries in one table, and the ngrams referring to their rowids.
+	"""
+	connection = sqlite3.connect(Settings.SQLITE_DB_FILE)
+	connection.execute('create table entries (key text, dictionary_name text, word text, offset integer, size integer)')
+	offset = 0
+	for word in words:
+		size = len(f'Definition of {word}'.encode('utf-8'))
+		connection.execute('insert into entries values (?, ?, ?, ?, ?)',
+						   (simplify(word), dictionary_name, word, offset, size))
+		offset += size
+	connection.execute('create table ngrams (ngram text, idxs text)')
+	connection.execute("insert into ngrams values ('ello', '1,2,3')")
+	connection.commit()
+	connection.close()
+
+
+@pytest.fixture(scope='module')
+def dicts() -> Dictionaries:
+	"""
+	Both-sides suggestions, on a database of schema version 1 migrated at startup.
+	"""
+	settings = Settings()
+	settings.change_suggestions_mode_from_right_side_to_both_sides()
+	settings.add_dictionary({
+		'dictionary_display_name': 'Test',
+		'dictionary_name': 'test',
+		'dictionary_format': 'StarDict (.ifo)',
+		'dictionary_filename': _write_stardict(Settings.DEFAULT_SOURCE_DIR, 'test', WORDS)
+	})
+	_write_v1_database('test', WORDS)
+
+	dicts = Dictionaries(Flask(__name__))
+	while dicts.readiness()['ready'] < 1:
+		time.sleep(0.01)
+	return dicts
+
+
+def test_both_sides_suggestions_after_migration_from_v1(dicts: Dictionaries) -> None:
+	assert dicts.settings.preferences['suggestions_mode'] == 'both-sides'
+	# The ngram table of the old schema is dropped, and only the right-side suggestions are given until it is rebuilt
+	assert dicts.suggestions('Default Group', 'hell') == ['hello']
+	assert dicts.suggestions('Default Group', 'ello') == []
+
+	db_manager.create_ngram_table(stores_keys=False)
+	assert dicts.suggestions('Default Group', 'llow') == ['mellow', 'yellow']
+
+
+def test_suggestions_of_a_key_of_punctuation_only(dicts: Dictionaries) -> None:
+	for key in ('-', '!', ' '):
+		assert dicts.suggestions('Default Group', key) == WORDS
+
+
+def test_pages_after_a_word_of_punctuation_only(dicts: Dictionaries, monkeypatch) -> None:
+	monkeypatch.setitem(dicts.settings.misc_configs, 'num_suggestions', 1)
+	pages = [dicts.suggestions('Default Group', '-')]
+	while page := dicts.suggestions('Default Group', '-', pages[-1][-1]):
+		pages.append(page)
+	assert pages == [[word] for word in WORDS]